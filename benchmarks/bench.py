@@ -0,0 +1,383 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import stat
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vusbpb import config, usb, vm, daemon  # noqa: E402
+from vusbpb.admission import AdmissionController  # noqa: E402
+from vusbpb.coalesce import EventCoalescer  # noqa: E402
+from vusbpb.mappings import VmMapping, loadMappings  # noqa: E402
+from vusbpb.matcher import TriggerMatcher  # noqa: E402
+from vusbpb.workers import VmActionPool  # noqa: E402
+
+STUB_QM = """#!/bin/sh
+[ -n "$STUB_QM_LATENCY" ] && sleep "$STUB_QM_LATENCY"
+case "$1" in
+    status) echo "status: stopped" ;;
+    start) exit 0 ;;
+    list) echo "      VMID NAME                 STATUS     MEM(MB)    BOOTDISK(GB) PID" ;;
+    create) exit 0 ;;
+    *) exit 2 ;;
+esac
+"""
+
+VENDORS = ["046d", "0781", "8087", "1d6b", "05ac", "0bda", "2109", "1a86"]
+
+
+def buildParser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog = "bench",
+        description = "Benchmark vUSBPB scan, match, render and daemon event handling",
+    )
+    parser.add_argument(
+        "--devices",
+        type = int,
+        default = 150,
+        help = "USB devices in the fake sysfs tree",
+    )
+    parser.add_argument(
+        "--mappings",
+        type = int,
+        default = 200,
+        help = "VM mappings in the generated config",
+    )
+    parser.add_argument(
+        "--iterations",
+        type = int,
+        default = 200,
+        help = "Iterations per benchmark",
+    )
+    parser.add_argument(
+        "--events",
+        type = int,
+        default = 50,
+        help = "Events for the end-to-end benchmark",
+    )
+    parser.add_argument(
+        "--qm-latency",
+        type = float,
+        default = 0.0,
+        help = "Stub qm latency in seconds",
+    )
+    parser.add_argument(
+        "--optimistic-start",
+        action = "store_true",
+        help = "Generate mappings with optimisticStart (no 'qm status' before 'qm start')",
+    )
+    parser.add_argument("--workers", type = int, default = 4, help = "Daemon VM worker threads")
+    parser.add_argument("--seed", type = int, default = 1, help = "Random seed for generated data")
+    parser.add_argument("--json", action = "store_true", help = "Print results as JSON")
+    return parser
+
+
+def main(argv: List[str] | None = None) -> int:
+    args = buildParser().parse_args(argv)
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory(prefix = "vusbpb_bench_") as root:
+        sysfsPath = os.path.join(root, "sys", "bus", "usb", "devices")
+        ports = generateSysfsTree(sysfsPath, args.devices, rng)
+        entries = generateMappings(ports, args.mappings, rng)
+        if args.optimistic_start:
+            entries = [{**entry, "optimisticStart": True} for entry in entries]
+        installStubQm(os.path.join(root, "bin"), args.qm_latency)
+
+        usb.USB_SYSFS_PATH = sysfsPath
+        vm.QEMU_RUN_DIR = os.path.join(root, "run", "qemu-server")
+        config.CONFIG_PATH = os.path.join(root, "vusbpb.conf")
+        config.USB_HISTORY_PATH = os.path.join(root, "usb-seen.json")
+        config.saveConfig({"VMS": entries})
+        mappings = loadMappings(config.loadConfig(allow_missing = False))
+
+        results = {
+            "scan (cold)": benchScan(args.iterations, cold = True),
+            "scan (cached)": benchScan(args.iterations, cold = False),
+            "match": benchMatch(mappings, ports, args.iterations, rng),
+            "render (tree)": benchRender(args.iterations, "tree"),
+            "render (json)": benchRender(args.iterations, "json"),
+            "end-to-end": benchEndToEnd(mappings, ports, args.events, args.workers, rng),
+        }
+
+    if args.json:
+        print(json.dumps(results, indent = 4))
+    else:
+        printResults(results, args)
+    return 0
+
+
+# Fixtures
+def generateSysfsTree(
+    sysfsPath: str,
+    deviceCount: int,
+    rng: random.Random,
+) -> List[Tuple[str, str]]:
+    os.makedirs(sysfsPath)
+    ports: List[Tuple[str, str]] = []
+    busCount = max(1, deviceCount // 32)
+    hubs = [f"{bus}-{port}" for bus in range(1, busCount + 1) for port in range(1, 5)]
+
+    for bus in range(1, busCount + 1):
+        helperWriteDevice(sysfsPath, f"usb{bus}", "1d6b", "0002", bus, 1)
+
+    while len(ports) < deviceCount:
+        parent = rng.choice(hubs)
+        usbPortId = f"{parent}.{rng.randint(1, 7)}"
+        if any(port == usbPortId for port, _ in ports):
+            continue
+        # Deep hub chains are what real docking stations look like
+        if usbPortId.count(".") < 4 and rng.random() < 0.2:
+            hubs.append(usbPortId)
+
+        vendor = rng.choice(VENDORS)
+        product = f"{rng.randrange(0x10000):04x}"
+        bus = int(usbPortId.split("-", 1)[0])
+        helperWriteDevice(sysfsPath, usbPortId, vendor, product, bus, len(ports) + 2)
+        os.makedirs(os.path.join(sysfsPath, f"{usbPortId}:1.0"))
+        ports.append((usbPortId, f"{vendor}:{product}"))
+
+    return ports
+
+
+def generateMappings(
+    ports: List[Tuple[str, str]],
+    mappingCount: int,
+    rng: random.Random,
+) -> List[Dict]:
+    mappings: List[Dict] = []
+    for idx in range(mappingCount):
+        usbPortId, usbDeviceId = rng.choice(ports)
+        kind = idx % 5
+        mapping: Dict = {"vmId": 100 + idx}
+        if kind == 0:
+            mapping["usbPortId"] = usbPortId
+        elif kind == 1:
+            mapping["usbDeviceId"] = usbDeviceId
+        elif kind == 2:
+            mapping["usbPortId"] = usbPortId
+            mapping["usbDeviceId"] = usbDeviceId
+        elif kind == 3:
+            mapping["usbPortId"] = usbPortId.rsplit(".", 1)[0] + ".*"
+        else:
+            mapping["usbDeviceId"] = usbDeviceId.split(":", 1)[0] + ":*"
+        mappings.append(mapping)
+    return mappings
+
+
+def installStubQm(binPath: str, latency: float) -> None:
+    os.makedirs(binPath)
+    qmPath = os.path.join(binPath, "qm")
+    with open(qmPath, "w", encoding = "utf-8") as file:
+        file.write(STUB_QM)
+    os.chmod(qmPath, os.stat(qmPath).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+    os.environ["PATH"] = binPath + os.pathsep + os.environ.get("PATH", "")
+    os.environ["STUB_QM_LATENCY"] = str(latency) if latency > 0 else ""
+    vm.QM_COMMAND = qmPath
+    # Answers 'pvesh create .../status/start' too, so redirected cluster starts stay stubbed
+    vm.PVESH_COMMAND = qmPath
+
+
+class FakeDevice:
+    def __init__(self, sysfsPath: str, usbPortId: str, usbDeviceId: str) -> None:
+        vendor, product = usbDeviceId.split(":")
+        self.action = "add"
+        self.sys_name = usbPortId
+        self.sys_path = os.path.join(sysfsPath, usbPortId)
+        self.device_type = "usb_device"
+        self.properties = {"ID_VENDOR_ID": vendor, "ID_MODEL_ID": product, "DEVTYPE": "usb_device"}
+
+
+# Benchmarks
+def benchScan(iterations: int, cold: bool) -> Dict:
+    def run() -> None:
+        if cold:
+            usb.USB_INVENTORY = usb.UsbInventory()
+        usb.scanUSBPorts()
+
+    usb.scanUSBPorts()
+    return helperMeasure(run, iterations)
+
+
+def benchMatch(
+    mappings: List[VmMapping],
+    ports: List[Tuple[str, str]],
+    iterations: int,
+    rng: random.Random,
+) -> Dict:
+    buildStartedAt = time.perf_counter()
+    matcher = TriggerMatcher(mappings)
+    buildSeconds = time.perf_counter() - buildStartedAt
+
+    samples = [rng.choice(ports) for _ in range(iterations)]
+    queries = iter(samples * 2)
+    result = helperMeasure(lambda: matcher.match(*next(queries)), iterations)
+    result["build_ms"] = round(buildSeconds * 1000, 3)
+    return result
+
+
+def benchRender(iterations: int, outputFormat: str) -> Dict:
+    # The whole '--list usb' output path, written to /dev/null instead of a terminal
+    usbPorts = usb.scanUSBPorts()
+    sink = open(os.devnull, "w", encoding = "utf-8")
+    savedStdout, sys.stdout = sys.stdout, sink
+    try:
+        return helperMeasure(lambda: usb.showUSB(usbPorts, outputFormat), iterations)
+    finally:
+        sys.stdout = savedStdout
+        sink.close()
+
+
+def benchEndToEnd(
+    mappings: List[VmMapping],
+    ports: List[Tuple[str, str]],
+    eventCount: int,
+    workers: int,
+    rng: random.Random,
+) -> Dict:
+    mappedPorts = {
+        m.usbPortId for m in mappings
+        if m.usbPortId is not None and "*" not in m.usbPortId
+    }
+    candidates = [port for port in ports if port[0] in mappedPorts] or ports
+    events = [FakeDevice(usb.USB_SYSFS_PATH, *rng.choice(candidates)) for _ in range(eventCount)]
+
+    latencies: List[float] = []
+    logSink = open(os.devnull, "w", encoding = "utf-8")
+    savedStderr, sys.stderr = sys.stderr, logSink
+    try:
+        elapsed = asyncio.run(helperDriveDaemon(mappings, events, workers, latencies))
+    finally:
+        sys.stderr = savedStderr
+        logSink.close()
+
+    result = helperSummary(latencies)
+    result["events_per_sec"] = round(eventCount / elapsed, 1) if elapsed > 0 else 0.0
+    result["vm_actions"] = len(latencies)
+    return result
+
+
+# Helpers
+async def helperDriveDaemon(
+    mappings: List[VmMapping],
+    events: List[FakeDevice],
+    workers: int,
+    latencies: List[float],
+) -> float:
+    statusTable = vm.VmStatusTable()
+    state = daemon.DaemonState({"VMS": []}, mappings, statusTable)
+    # Admission limits scaled to the worker count, the stub qm has no real cost
+    admission = AdmissionController(
+        maxConcurrent = workers,
+        minFreeMemoryMb = 0,
+        maxCpuPressure = 100.0,
+        maxMemoryPressure = 100.0,
+    )
+
+    async def action(vmId: int, receivedAt: float) -> None:
+        await daemon.helperHandleVm(state, admission, vmId, receivedAt)
+        latencies.append(time.monotonic() - receivedAt)
+
+    vmPool = VmActionPool(action, workers = workers, queueSize = max(64, len(events) * 4))
+    coalescer = EventCoalescer(0.0)
+
+    startedAt = time.monotonic()
+    try:
+        for device in events:
+            receivedAt = time.monotonic()
+            usbDeviceId = await daemon.helperGetUsbDeviceId(device)
+            coalescer.add(device.sys_name, usbDeviceId, receivedAt)
+            burst = coalescer.flush(time.monotonic())
+            daemon.helperDispatchBurst(state.matcher, vmPool, burst)
+            # Let each event finish so in-flight deduplication does not hide work
+            while vmPool.inFlight:
+                await asyncio.sleep(0.0005)
+    finally:
+        elapsed = time.monotonic() - startedAt
+        await vmPool.stop()
+        statusTable.close()
+    return elapsed
+
+
+def helperWriteDevice(
+    sysfsPath: str,
+    name: str,
+    vendor: str,
+    product: str,
+    bus: int,
+    devNum: int,
+) -> None:
+    devicePath = os.path.join(sysfsPath, name)
+    os.makedirs(devicePath)
+    files = {
+        "uevent": (
+            f"DEVTYPE=usb_device\nPRODUCT={vendor.lstrip('0')}/{product.lstrip('0') or '0'}/100\n"
+            f"BUSNUM={bus:03d}\nDEVNUM={devNum:03d}\n"
+        ),
+        "idVendor": vendor + "\n",
+        "idProduct": product + "\n",
+        "manufacturer": "Bench Corp\n",
+        "product": f"Device {name}\n",
+    }
+    for fileName, content in files.items():
+        with open(os.path.join(devicePath, fileName), "w", encoding = "utf-8") as file:
+            file.write(content)
+
+
+def helperMeasure(fn: Callable[[], object], iterations: int) -> Dict:
+    samples: List[float] = []
+    startedAt = time.perf_counter()
+    for _ in range(iterations):
+        callStartedAt = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - callStartedAt)
+    elapsed = time.perf_counter() - startedAt
+
+    result = helperSummary(samples)
+    result["ops_per_sec"] = round(iterations / elapsed, 1) if elapsed > 0 else 0.0
+    return result
+
+
+def helperSummary(samples: List[float]) -> Dict:
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def percentile(pct: float) -> float:
+        idx = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+        return round(ordered[idx] * 1000, 4)
+
+    return {
+        "count": len(ordered),
+        "p50_ms": percentile(50),
+        "p90_ms": percentile(90),
+        "p99_ms": percentile(99),
+        "max_ms": round(ordered[-1] * 1000, 4),
+    }
+
+
+def printResults(results: Dict[str, Dict], args: argparse.Namespace) -> None:
+    print(
+        f"devices={args.devices} mappings={args.mappings} iterations={args.iterations} "
+        f"qm-latency={args.qm_latency}s workers={args.workers}"
+    )
+    for name, result in results.items():
+        extras = ", ".join(
+            f"{key}={value}" for key, value in result.items()
+            if key not in ("p50_ms", "p90_ms", "p99_ms", "max_ms")
+        )
+        print(
+            f"{name:<14} p50={result.get('p50_ms')}ms p90={result.get('p90_ms')}ms "
+            f"p99={result.get('p99_ms')}ms max={result.get('max_ms')}ms  {extras}"
+        )
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
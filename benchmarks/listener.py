@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# "none" only starts the interpreter, the baseline the other two are compared against
+LISTENERS = ("none", "netlink", "pyudev")
+
+
+def buildParser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog = "listener",
+        description = "Compare cold start and resident memory of the daemon's USB event listeners",
+    )
+    parser.add_argument("--runs", type = int, default = 5, help = "Fresh processes per listener")
+    parser.add_argument("--json", action = "store_true", help = "Print results as JSON")
+    parser.add_argument("--child", choices = LISTENERS, help = argparse.SUPPRESS)
+    return parser
+
+
+def main(argv: List[str] | None = None) -> int:
+    args = buildParser().parse_args(argv)
+    if args.child:
+        return runChild(args.child)
+
+    results: Dict[str, Dict] = {}
+    for listener in LISTENERS:
+        samples = [measure(listener) for _ in range(max(1, args.runs))]
+        if any(sample is None for sample in samples):
+            results[listener] = {"error": "unavailable"}
+            continue
+        results[listener] = {
+            "wall_ms": round(statistics.median(sample["wall"] for sample in samples) * 1000, 2),
+            "open_ms": round(statistics.median(sample["open"] for sample in samples) * 1000, 2),
+            "rss_kb": int(statistics.median(sample["rssKb"] for sample in samples)),
+        }
+
+    if args.json:
+        print(json.dumps(results, indent = 4))
+        return 0
+    for listener, result in results.items():
+        if "error" in result:
+            print(f"{listener:<8} {result['error']}")
+            continue
+        print(
+            f"{listener:<8} wall={result['wall_ms']:7.1f}ms  "
+            f"import+open={result['open_ms']:6.1f}ms  "
+            f"rss={result['rss_kb'] / 1024:6.1f}MB"
+        )
+    return 0
+
+
+def measure(listener: str) -> Dict[str, float] | None:
+    # Wall time runs until the child has its socket subscribed, interpreter start-up included
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", listener]
+    startedAt = time.perf_counter()
+    result = subprocess.run(cmd, cwd = ROOT, capture_output = True, text = True, check = False)
+    wall = time.perf_counter() - startedAt
+    if result.returncode != 0:
+        return None
+    return {"wall": wall, **json.loads(result.stdout)}
+
+
+def runChild(listener: str) -> int:
+    startedAt = time.perf_counter()
+    if listener == "netlink":
+        sys.path.insert(0, ROOT)
+        from vusbpb.uevent import UeventMonitor, UeventError
+        try:
+            portMonitor = UeventMonitor()
+            portMonitor.filter_by(subsystem = "usb", device_type = "usb_device")
+            portMonitor.start()
+        except UeventError:
+            return 1
+    elif listener == "pyudev":
+        try:
+            import pyudev
+        except ImportError:
+            return 1
+        portMonitor = pyudev.Monitor.from_netlink(pyudev.Context())
+        portMonitor.filter_by(subsystem = "usb", device_type = "usb_device")
+        portMonitor.start()
+    opened = time.perf_counter() - startedAt
+
+    print(json.dumps({"open": opened, "rssKb": helperRssKb()}))
+    return 0
+
+
+# Helpers
+def helperRssKb() -> int:
+    with open("/proc/self/status", "r", encoding = "ascii") as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
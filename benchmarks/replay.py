@@ -0,0 +1,174 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vusbpb import config, vm, daemon  # noqa: E402
+from vusbpb.admission import AdmissionController  # noqa: E402
+from vusbpb.coalesce import EventCoalescer  # noqa: E402
+from vusbpb.mappings import VmMapping, loadMappings  # noqa: E402
+from vusbpb.metrics import METRICS  # noqa: E402
+from vusbpb.record import readRecording  # noqa: E402
+from vusbpb.uevent import UeventDevice  # noqa: E402
+from vusbpb.workers import VmActionPool  # noqa: E402
+from bench import installStubQm, helperSummary  # noqa: E402
+
+
+def buildParser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog = "replay",
+        description = "Replay a 'vusbpb --daemon --record' capture through the daemon's "
+            "event handling",
+    )
+    parser.add_argument("recording", help = "Capture written by 'vusbpb --daemon --record FILE'")
+    parser.add_argument(
+        "--config",
+        default = config.CONFIG_PATH,
+        help = "Config with the mappings and DAEMON settings",
+    )
+    parser.add_argument(
+        "--speed",
+        type = float,
+        default = 1.0,
+        help = "Replay speed: 1 keeps the original timing, 10 is ten times faster, "
+            "0 sends events back to back",
+    )
+    parser.add_argument(
+        "--qm-latency",
+        type = float,
+        default = 0.0,
+        help = "Stub qm latency in seconds",
+    )
+    parser.add_argument("--json", action = "store_true", help = "Print results as JSON")
+    parser.add_argument("--verbose", action = "store_true", help = "Show the daemon's log")
+    return parser
+
+
+def main(argv: List[str] | None = None) -> int:
+    args = buildParser().parse_args(argv)
+    try:
+        events = list(readRecording(args.recording))
+        config.CONFIG_PATH = args.config
+        daemonConfig = config.loadConfig(allow_missing = False)
+        settings = config.getDaemonSettings(daemonConfig)
+        mappings = loadMappings(daemonConfig)
+    except (OSError, ValueError, config.ConfigError) as error:
+        print(f"ERROR: {error}", file = sys.stderr)
+        return 1
+
+    with tempfile.TemporaryDirectory(prefix = "vusbpb_replay_") as root:
+        # Nothing real is started: every qm/pvesh call goes to the stub, and without a
+        # qemu-server run dir every status check goes through it as well
+        installStubQm(os.path.join(root, "bin"), args.qm_latency)
+        vm.QEMU_RUN_DIR = os.path.join(root, "run", "qemu-server")
+
+        logSink = None if args.verbose else open(os.devnull, "w", encoding = "utf-8")
+        savedStderr = sys.stderr
+        if logSink is not None:
+            sys.stderr = logSink
+        try:
+            results = asyncio.run(replay(events, daemonConfig, settings, mappings, args.speed))
+        finally:
+            sys.stderr = savedStderr
+            if logSink is not None:
+                logSink.close()
+
+    if args.json:
+        print(json.dumps(results, indent = 4))
+    else:
+        printResults(results, args)
+    return 0
+
+
+async def replay(
+    events: List[Tuple[float, UeventDevice]],
+    daemonConfig: Dict[str, Any],
+    settings: Dict[str, Any],
+    mappings: List[VmMapping],
+    speed: float,
+) -> Dict[str, Any]:
+    statusTable = vm.VmStatusTable()
+    state = daemon.DaemonState(daemonConfig, mappings, statusTable)
+    admission = AdmissionController()
+    daemon.helperConfigureAdmission(admission, settings)
+    triggerLatencies: List[float] = []
+
+    async def action(vmId: int, receivedAt: float) -> None:
+        await daemon.helperHandleVm(state, admission, vmId, receivedAt)
+        triggerLatencies.append(time.monotonic() - receivedAt)
+
+    vmPool = VmActionPool(
+        action,
+        workers = settings["vmWorkers"],
+        queueSize = settings["vmQueueSize"],
+    )
+    coalescer = EventCoalescer(settings["coalesceWindowMs"] / 1000.0)
+    daemonLoop = daemon.DaemonLoop(state, admission, vmPool, coalescer)
+
+    # How late each event reached the handler compared to its (scaled) capture time
+    deliveryLags: List[float] = []
+    firstOffset = events[0][0] if events else 0.0
+    startedAt = time.monotonic()
+    try:
+        for offset, device in events:
+            if speed > 0:
+                due = startedAt + (offset - firstOffset) / speed
+                if due > time.monotonic():
+                    await asyncio.sleep(due - time.monotonic())
+                deliveryLags.append(time.monotonic() - due)
+            daemon.helperHandleDeviceEvent(daemonLoop, device)
+            # Back to back still yields to timers and VM tasks between events, like the daemon
+            await asyncio.sleep(0)
+
+        while daemonLoop.tasks or daemonLoop.flushTimer is not None or vmPool.inFlight:
+            await asyncio.sleep(0.001)
+        elapsed = time.monotonic() - startedAt
+    finally:
+        daemonLoop.close()
+        await vmPool.stop()
+        statusTable.close()
+
+    results: Dict[str, Any] = {
+        "trigger": {**helperSummary(triggerLatencies), "vm_actions": len(triggerLatencies)},
+        "replay": {
+            "events": len(events),
+            "seconds": round(elapsed, 3),
+            "events_per_sec": round(len(events) / elapsed, 1) if elapsed > 0 else 0.0,
+            "starts": int(helperCounter("vusbpb_starts_total")),
+            "refused": int(helperCounter("vusbpb_start_refused_total")),
+        },
+    }
+    if deliveryLags:
+        results["delivery lag"] = helperSummary(deliveryLags)
+    return results
+
+
+def printResults(results: Dict[str, Dict], args: argparse.Namespace) -> None:
+    print(f"recording={args.recording} speed={args.speed:g}x qm-latency={args.qm_latency}s")
+    for name, result in results.items():
+        if "p50_ms" not in result:
+            print(f"{name:<14} " + ", ".join(f"{key}={value}" for key, value in result.items()))
+            continue
+        extras = ", ".join(
+            f"{key}={value}" for key, value in result.items()
+            if key not in ("p50_ms", "p90_ms", "p99_ms", "max_ms")
+        )
+        print(
+            f"{name:<14} p50={result['p50_ms']}ms p90={result['p90_ms']}ms "
+            f"p99={result['p99_ms']}ms max={result['max_ms']}ms  {extras}"
+        )
+
+
+# Helpers
+def helperCounter(name: str) -> float:
+    return sum(value for (counterName, _), value in METRICS.counters.items() if counterName == name)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,106 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (CLI arguments, import budget in ms for vusbpb and its imports, needs a PVE host)
+COMMANDS: Dict[str, Tuple[List[str], float, bool]] = {
+    "version": (["--version"], 2.0, False),
+    "help": (["--help"], 25.0, False),
+    "list-pb": (["--list", "pb"], 60.0, True),
+    "list-usb": (["--list", "usb"], 60.0, False),
+    "list-vm": (["--list", "vm"], 60.0, True),
+}
+# Checked by the CLI's requireProxmox(); elsewhere these commands exit before importing anything
+PVE_DIR = "/etc/pve"
+
+
+def buildParser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog = "startup",
+        description = "Check vUSBPB CLI start-up cost against per-command import budgets",
+    )
+    parser.add_argument("--runs", type = int, default = 5, help = "Runs per command")
+    parser.add_argument(
+        "--binary",
+        help = "Measure wall time of an installed binary instead of the source tree",
+    )
+    parser.add_argument(
+        "--scale",
+        type = float,
+        default = 1.0,
+        help = "Multiply every budget (slow hosts)",
+    )
+    return parser
+
+
+def main(argv: List[str] | None = None) -> int:
+    args = buildParser().parse_args(argv)
+    overBudget = False
+
+    for name, (cliArgs, budget, needsProxmox) in COMMANDS.items():
+        if needsProxmox and not os.path.isdir(PVE_DIR):
+            print(f"{name:<10} skipped, needs a Proxmox VE host")
+            continue
+        wallTimes: List[float] = []
+        importTimes: List[float] = []
+        for _ in range(max(1, args.runs)):
+            wall, imported = measure(cliArgs, args.binary)
+            wallTimes.append(wall)
+            if imported is not None:
+                importTimes.append(imported)
+
+        wallMs = statistics.median(wallTimes) * 1000
+        line = f"{name:<10} wall={wallMs:7.1f}ms"
+        if importTimes:
+            importMs = statistics.median(importTimes)
+            limit = budget * args.scale
+            status = "ok" if importMs <= limit else "OVER BUDGET"
+            overBudget = overBudget or importMs > limit
+            line += f"  vusbpb imports={importMs:6.1f}ms  budget={limit:.1f}ms  {status}"
+        print(line)
+
+    return 1 if overBudget else 0
+
+
+def measure(cliArgs: List[str], binary: str | None) -> Tuple[float, float | None]:
+    if binary:
+        cmd = [binary, *cliArgs]
+    else:
+        cmd = [sys.executable, "-X", "importtime", "-m", "vusbpb", *cliArgs]
+
+    startedAt = time.perf_counter()
+    result = subprocess.run(cmd, cwd = ROOT, capture_output = True, text = True, check = False)
+    wall = time.perf_counter() - startedAt
+
+    if binary:
+        return wall, None
+    return wall, helperVusbpbImportMs(result.stderr)
+
+
+# Helpers
+def helperVusbpbImportMs(importLog: str) -> float:
+    # Interpreter start-up (site, encodings, runpy) comes before vusbpb and is not ours
+    # to budget; every outermost import from the first vusbpb module on is
+    totalUs = 0
+    counting = False
+    for line in importLog.splitlines():
+        parts = line.split("|")
+        if not line.startswith("import time:") or len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2]
+        if name.startswith("  "):
+            continue
+        counting = counting or name.strip().startswith("vusbpb")
+        if counting:
+            totalUs += int(parts[1])
+    return totalUs / 1000.0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
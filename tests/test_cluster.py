@@ -0,0 +1,96 @@
+import json
+import os
+
+import pytest
+
+from vusbpb.cluster import VmLocationIndex, helperReadVmlist
+
+VMLIST = {
+    "version": 12,
+    "ids": {
+        "100": {"node": "pve1", "type": "qemu", "version": 3},
+        "101": {"node": "pve2", "type": "qemu", "version": 5},
+        "102": {"node": "pve2", "type": "lxc", "version": 1},
+        "103": {"node": "pve3"},
+        "abc": {"node": "pve2", "type": "qemu"},
+        "104": "pve2",
+        "105": {"type": "qemu"},
+        "106": {"node": "", "type": "qemu"},
+    },
+}
+
+
+@pytest.fixture
+def pveDir(tmp_path) -> str:
+    # /etc/pve as pmxcfs shows it: .vmlist, and local -> nodes/<this node>
+    (tmp_path / "nodes" / "pve1").mkdir(parents = True)
+    os.symlink("nodes/pve1", tmp_path / "local")
+    helperWriteVmlist(str(tmp_path), VMLIST)
+    return str(tmp_path)
+
+
+def testReadVmlistSkipsMalformedEntries(pveDir):
+    nodes, types = helperReadVmlist(os.path.join(pveDir, ".vmlist"))
+    assert nodes == {100: "pve1", 101: "pve2", 102: "pve2", 103: "pve3"}
+    # A missing type is a VM, the only kind old pmxcfs versions listed
+    assert types == {100: "qemu", 101: "qemu", 102: "lxc", 103: "qemu"}
+
+
+@pytest.mark.parametrize("content", ["", "not json", "[]", '{"ids": []}'])
+def testReadVmlistToleratesBrokenFiles(tmp_path, content):
+    path = tmp_path / ".vmlist"
+    path.write_text(content)
+    assert helperReadVmlist(str(path)) == ({}, {})
+
+
+def testRemoteNodeOf(pveDir):
+    index = helperIndex(pveDir)
+    assert index.remoteNodeOf(100) is None
+    assert index.remoteNodeOf(101) == "pve2"
+    assert index.remoteNodeOf(999) is None
+
+
+def testRemoteVMsListsOnlyOtherNodesQemuGuests(pveDir):
+    assert helperIndex(pveDir).remoteVMs() == {101: "pve2", 103: "pve3"}
+
+
+def testClusterNodeOnACluster(pveDir):
+    index = helperIndex(pveDir)
+    assert index.clusterNode() == "pve1"
+    assert index.nodeOf(101) == "pve2"
+
+
+def testStandaloneHostHasNoNode(pveDir):
+    # pmxcfs writes .vmlist on a single host too, with every guest on this node
+    helperWriteVmlist(pveDir, {"version": 1, "ids": {"100": {"node": "pve1", "type": "qemu"}}})
+    index = helperIndex(pveDir)
+    assert index.clusterNode() is None
+    assert index.nodeOf(100) is None
+    assert index.remoteVMs() == {}
+
+
+def testCorosyncConfigMarksASingleNodeCluster(pveDir):
+    helperWriteVmlist(pveDir, {"version": 1, "ids": {"100": {"node": "pve1", "type": "qemu"}}})
+    open(os.path.join(pveDir, "corosync.conf"), "w").close()
+    assert helperIndex(pveDir).clusterNode() == "pve1"
+
+
+def testMissingVmlistMeansEverythingIsLocal(tmp_path):
+    index = helperIndex(str(tmp_path))
+    assert index.clusterNode() is None
+    assert index.remoteNodeOf(101) is None
+    assert index.remoteVMs() == {}
+
+
+# Helpers
+def helperIndex(pveDir: str) -> VmLocationIndex:
+    return VmLocationIndex(
+        vmlistPath = os.path.join(pveDir, ".vmlist"),
+        localNodePath = os.path.join(pveDir, "local"),
+        corosyncPath = os.path.join(pveDir, "corosync.conf"),
+    )
+
+
+def helperWriteVmlist(pveDir: str, vmlist: dict) -> None:
+    with open(os.path.join(pveDir, ".vmlist"), "w", encoding = "utf-8") as file:
+        json.dump(vmlist, file)
@@ -0,0 +1,25 @@
+import pytest
+
+from vusbpb.config import ConfigError, getDaemonSettings
+
+
+def testNullOrEmptyMetricsPathDisablesMetrics():
+    assert getDaemonSettings({"DAEMON": {"metricsPath": None}})["metricsPath"] == ""
+    assert getDaemonSettings({"DAEMON": {"metricsPath": ""}})["metricsPath"] == ""
+
+
+@pytest.mark.parametrize("override", [
+    {"vmWorkers": True},
+    {"startMaxCpuPressure": False},
+    {"vmQueueSize": None},
+    {"logJson": 1},
+])
+def testWrongTypesAreRejected(override):
+    with pytest.raises(ConfigError):
+        getDaemonSettings({"DAEMON": override})
+
+
+def testNumbersAreCoerced():
+    settings = getDaemonSettings({"DAEMON": {"vmWorkers": "6", "startMaxCpuPressure": 50}})
+    assert settings["vmWorkers"] == 6
+    assert settings["startMaxCpuPressure"] == 50.0
@@ -0,0 +1,109 @@
+import pytest
+
+from vusbpb.config import ConfigError
+from vusbpb.mappings import VmMapping, loadMappings, normalizeMappings, parseInteger
+
+
+@pytest.mark.parametrize("value, expected", [
+    (101, 101),
+    ("101", 101),
+    (" 102 ", 102),
+    ("-3", -3),
+    (True, None),
+    (False, None),
+    (101.9, None),
+    ("101.9", None),
+    ("1e2", None),
+    ("", None),
+    (None, None),
+])
+def testParseInteger(value, expected):
+    assert parseInteger(value) == expected
+
+
+@pytest.mark.parametrize("vmId", [True, 101.9, "101.9", 0, -5, None])
+def testInvalidVmIdIsRejected(vmId):
+    mappings, errors = normalizeMappings([{"vmId": vmId, "usbPortId": "1-1"}])
+    assert mappings == []
+    assert len(errors) == 1 and "invalid vmId" in errors[0]
+
+
+def testInvalidPriorityIsRejected():
+    for priority in (True, 2.5, "high"):
+        _, errors = normalizeMappings([{"vmId": 100, "usbPortId": "1-1", "priority": priority}])
+        assert len(errors) == 1 and "invalid priority" in errors[0]
+
+
+def testDuplicateVmIdIsRejected():
+    mappings, errors = normalizeMappings([
+        {"vmId": 100, "usbPortId": "1-1"},
+        {"vmId": "100", "usbPortId": "1-2"},
+    ])
+    assert [mapping.usbPortId for mapping in mappings] == ["1-1"]
+    assert errors == ["mapping #2 (VM 100): duplicate of mapping #1"]
+
+
+@pytest.mark.parametrize("usbPortId, expected", [
+    ("1-01.2", "1-1.2"),
+    ("01-1.02.3", "1-1.2.3"),
+    ("3-0:1.0", "3-0"),
+    ("1-1.2:1.1", "1-1.2"),
+    ("1-01.*", "1-1.*"),
+    ("1-*", "1-*"),
+    ("*", "*"),
+])
+def testPortsAreNormalized(usbPortId, expected):
+    mappings, errors = normalizeMappings([{"vmId": 100, "usbPortId": usbPortId}])
+    assert errors == []
+    assert mappings[0].usbPortId == expected
+
+
+def testDeviceIdsAreNormalized():
+    mappings, errors = normalizeMappings([
+        {"vmId": 100, "usbDeviceId": "046D:C52B"},
+        {"vmId": 101, "usbDeviceId": "*:*"},
+        {"vmId": 102, "usbDeviceId": "046d:*"},
+    ])
+    assert errors == []
+    assert [mapping.usbDeviceId for mapping in mappings] == ["046d:c52b", "*", "046d:*"]
+
+
+def testTextFieldsFromCsvImport():
+    mappings, errors = normalizeMappings([
+        {
+            "vmId": "100",
+            "usbPortId": "1-1",
+            "usbDeviceId": "",
+            "priority": "5",
+            "optimisticStart": "yes",
+        },
+    ])
+    assert errors == []
+    assert mappings == [VmMapping(100, usbPortId = "1-1", priority = 5, optimisticStart = True)]
+
+
+def testAllErrorsAreReportedInOnePass():
+    config = {"VMS": [
+        {"vmId": 100, "usbPortId": "1-1"},
+        {"vmId": True, "usbPortId": "1-2"},
+        {"vmId": 101},
+        {"vmId": 102, "usbPortId": "1-x"},
+        {"vmId": 103, "usbDeviceId": "logitech"},
+        {"vmId": 100, "usbPortId": "1-3"},
+        "not an object",
+    ]}
+    with pytest.raises(ConfigError) as error:
+        loadMappings(config)
+    assert str(error.value).splitlines() == [
+        "Invalid VM mappings:",
+        "  mapping #2: invalid vmId True",
+        "  mapping #3 (VM 101): needs usbPortId and/or usbDeviceId",
+        "  mapping #4 (VM 102): invalid usbPortId '1-x'",
+        "  mapping #5 (VM 103): invalid usbDeviceId 'logitech', expected VENDOR:PRODUCT in hex",
+        "  mapping #6 (VM 100): duplicate of mapping #1",
+        "  mapping #7: must be an object",
+    ]
+
+
+def testMappingsMustBeAList():
+    assert normalizeMappings({"vmId": 100}) == ([], ["VM mappings must be a list"])
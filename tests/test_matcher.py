@@ -0,0 +1,36 @@
+from vusbpb.mappings import VmMapping
+from vusbpb.matcher import TriggerMatcher
+
+
+def testBusSubtreeMatchesEveryPortOnTheBus():
+    matcher = TriggerMatcher([VmMapping(100, usbPortId = "1-*")])
+    assert matcher.match("1-1", None) == [100]
+    assert matcher.match("1-1.2.3", "046d:c52b") == [100]
+    assert matcher.match("2-1", None) == []
+
+
+def testHubSubtreeMatchesStrictDescendantsOnly():
+    matcher = TriggerMatcher([VmMapping(100, usbPortId = "1-1.*")])
+    assert matcher.match("1-1.2", None) == [100]
+    assert matcher.match("1-1.2.4", None) == [100]
+    assert matcher.match("1-1", None) == []
+    assert matcher.match("1-10", None) == []
+    assert matcher.match("1-2.1", None) == []
+
+
+def testVendorWildcardMatchesAnyProductOnAnyPort():
+    matcher = TriggerMatcher([VmMapping(100, usbDeviceId = "046d:*")])
+    assert matcher.match("3-4", "046d:c52b") == [100]
+    assert matcher.match("3-4", "046D:C077") == [100]
+    assert matcher.match("3-4", "1d6b:0002") == []
+    assert matcher.match("3-4", None) == []
+
+
+def testResultsFollowConfigOrderWithoutDuplicates():
+    matcher = TriggerMatcher([
+        VmMapping(102, usbDeviceId = "046d:*"),
+        VmMapping(101, usbPortId = "1-1.*"),
+        VmMapping(100, usbPortId = "1-1.2", usbDeviceId = "046d:c52b"),
+    ])
+    assert matcher.match("1-1.2", "046d:c52b") == [102, 101, 100]
+    assert matcher.ruleCount == 3
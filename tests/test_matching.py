@@ -0,0 +1,142 @@
+import os
+from typing import List
+
+import pytest
+
+from vusbpb.mappings import VmMapping
+from vusbpb.ueventfilter import (
+    BPF_JA,
+    BPF_JEQ_K,
+    BPF_LD_B_ABS,
+    BPF_LD_H_ABS,
+    BPF_LD_W_ABS,
+    BPF_RET_K,
+    FILTER_ACCEPT,
+    FILTER_DROP,
+    Instruction,
+    compileMappingsFilter,
+)
+
+CONTROLLER = "/devices/pci0000:00/0000:00:14.0/usb1"
+SECOND_CONTROLLER = "/devices/pci0000:00/0000:00:1d.0/usb2"
+
+
+@pytest.fixture
+def sysfsPath(tmp_path) -> str:
+    # Like /sys/bus/usb/devices: usbN links to the root hub's devpath, ports are not controllers
+    devices = tmp_path / "sys" / "bus" / "usb" / "devices"
+    devices.mkdir(parents = True)
+    os.symlink(f"../../..{CONTROLLER}", devices / "usb1")
+    os.symlink(f"../../..{SECOND_CONTROLLER}", devices / "usb2")
+    os.symlink(f"../../..{CONTROLLER}/1-1", devices / "1-1")
+    return str(devices)
+
+
+# Kernel filter
+def testExactPortAcceptsOnlyItsAddEvent(sysfsPath):
+    program = helperCompile(sysfsPath, VmMapping(100, usbPortId = "1-1.2"))
+    assert helperRun(program, helperUevent("add", f"{CONTROLLER}/1-1/1-1.2")) == FILTER_ACCEPT
+    assert helperRun(program, helperUevent("remove", f"{CONTROLLER}/1-1/1-1.2")) == FILTER_DROP
+    # Neighbours and children of the mapped port share its prefix but not the terminator
+    assert helperRun(program, helperUevent("add", f"{CONTROLLER}/1-1/1-1.3")) == FILTER_DROP
+    assert helperRun(program, helperUevent("add", f"{CONTROLLER}/1-1/1-1.2/1-1.2.1")) == FILTER_DROP
+    # The hub in front of it, and any port behind the other known controller
+    assert helperRun(program, helperUevent("add", f"{CONTROLLER}/1-1")) == FILTER_DROP
+    assert helperRun(program, helperUevent("add", f"{SECOND_CONTROLLER}/2-1")) == FILTER_DROP
+
+
+def testInterfaceEventsAreDropped(sysfsPath):
+    program = helperCompile(sysfsPath, VmMapping(100, usbPortId = "1-1.2"))
+    interface = f"{CONTROLLER}/1-1/1-1.2/1-1.2:1.0"
+    assert helperRun(program, helperUevent("add", interface)) == FILTER_DROP
+
+
+def testSubtreeAcceptsEveryPortBehindTheHub(sysfsPath):
+    program = helperCompile(sysfsPath, VmMapping(100, usbPortId = "1-1.*"))
+    assert helperRun(program, helperUevent("add", f"{CONTROLLER}/1-1/1-1.4")) == FILTER_ACCEPT
+    nested = f"{CONTROLLER}/1-1/1-1.4/1-1.4.2"
+    assert helperRun(program, helperUevent("add", nested)) == FILTER_ACCEPT
+    # The hub itself is not behind itself
+    assert helperRun(program, helperUevent("add", f"{CONTROLLER}/1-1")) == FILTER_DROP
+    assert helperRun(program, helperUevent("add", f"{CONTROLLER}/1-2")) == FILTER_DROP
+
+
+def testBusWildcardAcceptsTheWholeController(sysfsPath):
+    program = helperCompile(sysfsPath, VmMapping(100, usbPortId = "2-*"))
+    assert helperRun(program, helperUevent("add", f"{SECOND_CONTROLLER}/2-3")) == FILTER_ACCEPT
+    nested = f"{SECOND_CONTROLLER}/2-3/2-3.1"
+    assert helperRun(program, helperUevent("add", nested)) == FILTER_ACCEPT
+    assert helperRun(program, helperUevent("add", f"{CONTROLLER}/1-1")) == FILTER_DROP
+
+
+def testUnknownControllerIsLetThrough(sysfsPath):
+    # A dock's own xHCI shows up after the filter was compiled
+    program = helperCompile(sysfsPath, VmMapping(100, usbPortId = "1-1.2"))
+    dock = "/devices/pci0000:00/0000:00:1c.0/0000:3a:00.0/usb3"
+    assert helperRun(program, helperUevent("add", f"{dock}/3-1")) == FILTER_ACCEPT
+    assert helperRun(program, helperUevent("remove", f"{dock}/3-1")) == FILTER_DROP
+
+
+def testAnyPortMappingFiltersOnlyTheAction(sysfsPath):
+    mappings = [VmMapping(100, usbDeviceId = "046d:c52b")]
+    program, patterns = compileMappingsFilter(mappings, sysfsPath)
+    assert patterns is None
+    assert helperRun(program, helperUevent("add", f"{CONTROLLER}/1-7")) == FILTER_ACCEPT
+    assert helperRun(program, helperUevent("remove", f"{CONTROLLER}/1-7")) == FILTER_DROP
+
+
+def testVirtualDevicesAreDropped(sysfsPath):
+    # Every 'qm start' adds tap and firewall bridge interfaces, every new zvol a block device
+    for mappings in (
+        [VmMapping(100, usbPortId = "1-1.2")],
+        [VmMapping(100, usbDeviceId = "046d:*")],
+    ):
+        program, _ = compileMappingsFilter(mappings, sysfsPath)
+        tap = "/devices/virtual/net/tap100i0"
+        assert helperRun(program, helperUevent("add", tap)) == FILTER_DROP
+        assert helperRun(program, helperUevent("add", "/devices/virtual/block/zd0")) == FILTER_DROP
+
+
+def testSubtreeLetsInterfacesThrough(sysfsPath):
+    # The filter can't tell an interface from a device below a hub; the listener drops it by DEVTYPE
+    program = helperCompile(sysfsPath, VmMapping(100, usbPortId = "1-1.*"))
+    interface = f"{CONTROLLER}/1-1/1-1.4/1-1.4:1.0"
+    assert helperRun(program, helperUevent("add", interface)) == FILTER_ACCEPT
+
+
+def testShortPacketIsDropped(sysfsPath):
+    program = helperCompile(sysfsPath, VmMapping(100, usbPortId = "1-1.2"))
+    assert helperRun(program, b"add@/dev") == FILTER_DROP
+
+
+# Helpers
+def helperCompile(sysfsPath: str, *mappings: VmMapping) -> List[Instruction]:
+    program, patterns = compileMappingsFilter(mappings, sysfsPath)
+    assert patterns is not None
+    return program
+
+
+def helperUevent(action: str, devpath: str) -> bytes:
+    return f"{action}@{devpath}\0ACTION={action}\0DEVPATH={devpath}\0SUBSYSTEM=usb\0".encode()
+
+
+def helperRun(program: List[Instruction], packet: bytes) -> int:
+    # Just the classic BPF the compiler emits, with the kernel's rule that a load past the end drops
+    widths = {BPF_LD_W_ABS: 4, BPF_LD_H_ABS: 2, BPF_LD_B_ABS: 1}
+    accumulator = 0
+    position = 0
+    while True:
+        code, jt, jf, k = program[position]
+        position += 1
+        if code in widths:
+            if k + widths[code] > len(packet):
+                return FILTER_DROP
+            accumulator = int.from_bytes(packet[k:k + widths[code]], "big")
+        elif code == BPF_JEQ_K:
+            position += jt if accumulator == k else jf
+        elif code == BPF_JA:
+            position += k
+        elif code == BPF_RET_K:
+            return k
+        else:
+            raise AssertionError(f"unexpected opcode {code:#x}")
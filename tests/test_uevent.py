@@ -0,0 +1,84 @@
+from typing import List
+
+from vusbpb.uevent import SYSFS_ROOT, parseUevent
+
+DEVPATH = "/devices/pci0000:00/0000:00:14.0/usb1/1-1/1-1.2"
+
+
+def testAddEvent():
+    device = parseUevent(helperPayload(f"add@{DEVPATH}", [
+        "ACTION=add",
+        f"DEVPATH={DEVPATH}",
+        "SUBSYSTEM=usb",
+        "DEVTYPE=usb_device",
+        "PRODUCT=46d/c52b/1211",
+        "SEQNUM=4242",
+    ]))
+    assert device is not None
+    assert device.action == "add"
+    assert device.sys_name == "1-1.2"
+    assert device.sys_path == SYSFS_ROOT + DEVPATH
+    assert device.device_type == "usb_device"
+    assert device.properties["PRODUCT"] == "46d/c52b/1211"
+    assert device.properties["SEQNUM"] == "4242"
+
+
+def testInterfaceEvent():
+    devpath = f"{DEVPATH}/1-1.2:1.0"
+    device = parseUevent(helperPayload(f"add@{devpath}", [
+        "ACTION=add",
+        f"DEVPATH={devpath}",
+        "SUBSYSTEM=usb",
+        "DEVTYPE=usb_interface",
+    ]))
+    assert device.sys_name == "1-1.2:1.0"
+    assert device.sys_path == SYSFS_ROOT + devpath
+    assert device.device_type == "usb_interface"
+
+
+def testMissingDevtype():
+    device = parseUevent(helperPayload("add@/devices/virtual/net/tap100i0", [
+        "ACTION=add",
+        "DEVPATH=/devices/virtual/net/tap100i0",
+        "SUBSYSTEM=net",
+    ]))
+    assert device.sys_name == "tap100i0"
+    assert device.device_type is None
+
+
+def testLibudevMessageIsIgnored():
+    # udevd's re-broadcast: "libudev" magic and a binary header, not a kernel uevent
+    payload = b"libudev\0\xfe\xed\xca\xfe" + b"\0" * 32 + b"ACTION=add\0DEVPATH=/devices/x\0"
+    assert parseUevent(payload) is None
+
+
+def testHeaderWithoutAtIsIgnored():
+    assert parseUevent(helperPayload("garbage", ["ACTION=add", f"DEVPATH={DEVPATH}"])) is None
+
+
+def testMissingActionOrDevpath():
+    header = f"add@{DEVPATH}"
+    assert parseUevent(helperPayload(header, [f"DEVPATH={DEVPATH}", "SUBSYSTEM=usb"])) is None
+    assert parseUevent(helperPayload(header, ["ACTION=add", "SUBSYSTEM=usb"])) is None
+    assert parseUevent(helperPayload(header, ["ACTION=", f"DEVPATH={DEVPATH}"])) is None
+
+
+def testNonUtf8ValueIsReplaced():
+    fields = ["ACTION=add", f"DEVPATH={DEVPATH}", "DEVTYPE=usb_device"]
+    device = parseUevent(helperPayload(f"add@{DEVPATH}", fields) + b"PRODUCT=\xff\xfe/c52b\0")
+    assert device.sys_name == "1-1.2"
+    assert device.sys_path == SYSFS_ROOT + DEVPATH
+    assert device.device_type == "usb_device"
+    assert device.properties["PRODUCT"] == "\ufffd\ufffd/c52b"
+
+
+def testEntriesWithoutEqualsAreSkipped():
+    fields = ["ACTION=add", "junk", f"DEVPATH={DEVPATH}", ""]
+    device = parseUevent(helperPayload(f"add@{DEVPATH}", fields))
+    assert device is not None
+    assert "junk" not in device.properties
+
+
+# Helpers
+def helperPayload(header: str, fields: List[str]) -> bytes:
+    return "\0".join([header, *fields]).encode() + b"\0"
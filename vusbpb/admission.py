@@ -0,0 +1,150 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Callable, Dict, List, Tuple
+
+MEMINFO_PATH = "/proc/meminfo"
+PRESSURE_DIR = "/proc/pressure"
+# Host conditions change without notifying us, so waiting starts re-check at this pace
+RECHECK_INTERVAL = 0.5
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        maxConcurrent: int = 2,
+        minFreeMemoryMb: int = 256,
+        maxCpuPressure: float = 80.0,
+        maxMemoryPressure: float = 20.0,
+        queueTimeout: float = 120.0,
+    ) -> None:
+        # Only touched from the daemon's event loop; replaced whenever a waiting start may fit
+        self.wakeup = asyncio.Event()
+        # (-priority, arrival order, vmId): highest priority first, then first come first served
+        self.waiting: List[Tuple[int, int, int]] = []
+        self.arrivals = itertools.count()
+        # vmId -> memory promised to a start that qemu has not allocated yet
+        self.starting: Dict[int, int] = {}
+        self.configure(
+            maxConcurrent,
+            minFreeMemoryMb,
+            maxCpuPressure,
+            maxMemoryPressure,
+            queueTimeout,
+        )
+
+    def configure(
+        self,
+        maxConcurrent: int,
+        minFreeMemoryMb: int,
+        maxCpuPressure: float,
+        maxMemoryPressure: float,
+        queueTimeout: float,
+    ) -> None:
+        self.maxConcurrent = max(1, maxConcurrent)
+        self.minFreeMemoryMb = max(0, minFreeMemoryMb)
+        self.maxCpuPressure = maxCpuPressure
+        self.maxMemoryPressure = maxMemoryPressure
+        self.queueTimeout = max(0.0, queueTimeout)
+        self.helperNotify()
+
+    async def acquire(
+        self,
+        vmId: int,
+        memoryMb: int,
+        priority: int = 0,
+        onQueued: Callable[[str], None] | None = None,
+    ) -> Tuple[bool, str]:
+        # Returns (admitted, reason); an admitted start must be followed by release(vmId)
+        memTotal = readMemInfo().get("MemTotal")
+        if memTotal is not None and memoryMb + self.minFreeMemoryMb > memTotal // 1024:
+            return False, f"needs {memoryMb} MB but the host only has {memTotal // 1024} MB"
+
+        entry = (-priority, next(self.arrivals), vmId)
+        deadline = time.monotonic() + self.queueTimeout
+        heapq.heappush(self.waiting, entry)
+        try:
+            while True:
+                reason = self.helperBlockedBy(entry, memoryMb)
+                if reason is None:
+                    self.starting[vmId] = memoryMb
+                    return True, ""
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False, f"still waiting after {self.queueTimeout:g}s: {reason}"
+                if onQueued is not None:
+                    onQueued(reason)
+                    onQueued = None
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), min(remaining, RECHECK_INTERVAL))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.waiting.remove(entry)
+            heapq.heapify(self.waiting)
+            # The next in line may fit now that this one is out of the queue
+            self.helperNotify()
+
+    def release(self, vmId: int) -> None:
+        self.starting.pop(vmId, None)
+        self.helperNotify()
+
+    def queued(self) -> int:
+        return len(self.waiting)
+
+    def helperNotify(self) -> None:
+        # Wakes every current waiter; later waits block on the fresh event
+        self.wakeup.set()
+        self.wakeup = asyncio.Event()
+
+    def helperBlockedBy(self, entry: Tuple[int, int, int], memoryMb: int) -> str | None:
+        if self.waiting[0] != entry:
+            return "starts ahead of it in the queue are still waiting"
+        if len(self.starting) >= self.maxConcurrent:
+            return f"{len(self.starting)} start(s) already in progress"
+
+        memAvailable = readMemInfo().get("MemAvailable")
+        if memAvailable is not None:
+            freeMb = memAvailable // 1024 - sum(self.starting.values())
+            if freeMb - memoryMb < self.minFreeMemoryMb:
+                return f"needs {memoryMb} MB, {max(0, freeMb)} MB available"
+
+        cpuPressure = readPressure("cpu")
+        if cpuPressure is not None and cpuPressure > self.maxCpuPressure:
+            return f"CPU pressure {cpuPressure:.1f}% is above {self.maxCpuPressure:g}%"
+        memoryPressure = readPressure("memory")
+        if memoryPressure is not None and memoryPressure > self.maxMemoryPressure:
+            return f"memory pressure {memoryPressure:.1f}% is above {self.maxMemoryPressure:g}%"
+        return None
+
+
+def readMemInfo() -> Dict[str, int]:
+    # Values in kB, as the kernel reports them
+    info: Dict[str, int] = {}
+    try:
+        with open(MEMINFO_PATH, "r", encoding = "ascii") as file:
+            for line in file:
+                key, _, rest = line.partition(":")
+                fields = rest.split()
+                if fields and fields[0].isdigit():
+                    info[key] = int(fields[0])
+    except OSError:
+        pass
+    return info
+
+
+def readPressure(resource: str) -> float | None:
+    # "some avg10" from PSI: share of the last 10s in which some task stalled on the resource
+    try:
+        with open(f"{PRESSURE_DIR}/{resource}", "r", encoding = "ascii") as file:
+            for line in file:
+                if not line.startswith("some "):
+                    continue
+                for field in line.split()[1:]:
+                    key, _, value = field.partition("=")
+                    if key == "avg10":
+                        return float(value)
+    except (OSError, ValueError):
+        pass
+    return None
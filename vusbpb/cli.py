@@ -1,14 +1,14 @@
-import argparse
 import os
 import sys
 
-from .usb import showUSB
-from .vm import showVMFromSystem, addVMPowerButton, deleteVMPowerButton, listVMPowerButton
-from .systemd import (install as doInstall, uninstall as doUninstall, daemonRestartIfInstalled)
-from .daemon import runDaemon
+# Subcommands import their modules on demand: monitoring scripts call the CLI
+# every few seconds, and in the onefile build every import is paid per call
+VERSION = "vUSBPB v0.5"
 
 
-def buildParser() -> argparse.ArgumentParser:
+def buildParser():
+    import argparse
+
     parser = argparse.ArgumentParser(
         prog = "vusbpb",
         description = "Virtual USB Power Button for Proxmox Virtual Machines"
@@ -29,10 +29,31 @@ def buildParser() -> argparse.ArgumentParser:
         action = "store_true",
         help = "Run vUSBPB daemon (used by systemd)",
     )
+    parser.add_argument(
+        "--record",
+        dest = "recordFile",
+        metavar = "FILE",
+        help = "With --daemon, also write every incoming USB event to FILE for "
+            "benchmarks/replay.py (stop the service first)",
+    )
     parser.add_argument(
         "--list",
-        choices = ["usb", "vm", "pb"],
-        help = "List: 'usb' (USB ports), 'vm' (VMs), 'pb' (VM power buttons)",
+        choices = ["usb", "vm", "pb", "events"],
+        help = "List: 'usb' (USB ports), 'vm' (VMs), 'pb' (VM power buttons), "
+            "'events' (recent USB events seen by the running daemon)",
+    )
+    parser.add_argument(
+        "--format",
+        dest = "outputFormat",
+        choices = ["tree", "json"],
+        default = "tree",
+        help = "Output of --list: 'tree' (default) or 'json' (compact, for scripts)",
+    )
+    parser.add_argument(
+        "--no-color",
+        dest = "noColor",
+        action = "store_true",
+        help = "Don't use colors in --list output (also honours the NO_COLOR variable)",
     )
     parser.add_argument(
         "--add",
@@ -42,18 +63,52 @@ def buildParser() -> argparse.ArgumentParser:
     parser.add_argument(
         "--delete",
         type = int,
-        help = "Delete VM mapping by VM ID",
+        nargs = "+",
+        metavar = "VM_ID",
+        help = "Delete VM mapping(s) by VM ID, several IDs are removed in one config update",
+    )
+    parser.add_argument(
+        "--import",
+        dest = "importFile",
+        metavar = "FILE",
+        help = "Import VM mappings from a JSON or CSV file ('-' for stdin) in one config update",
+    )
+    parser.add_argument(
+        "--replace",
+        action = "store_true",
+        help = "With --import, replace all existing mappings instead of adding to them",
+    )
+    parser.add_argument(
+        "--export",
+        dest = "exportFile",
+        metavar = "FILE",
+        help = "Export VM mappings to a JSON or CSV (*.csv) file, '-' for stdout",
     )
     parser.add_argument(
         "--usbport",
         type = str,
-        help = "USB port devpath (e.g. 1-1.2, 3-0:1.0) used with --add "
+        help = "USB port devpath (e.g. 1-1.2) used with --add, an interface like 1-1.2:1.0 "
+            "stands for its device; '1-1.*' matches every port behind hub 1-1 "
             "(use '--list usb' as a helper)",
     )
     parser.add_argument(
         "--usbdevice",
         type = str,
-        help = "USB device ID (idVendor:idProduct, e.g. 1234:abcd) used with --add",
+        help = "USB device ID (idVendor:idProduct, e.g. 1234:abcd) used with --add, "
+            "'1234:*' matches any product of that vendor",
+    )
+    parser.add_argument(
+        "--priority",
+        type = int,
+        default = 0,
+        help = "Start priority used with --add; when starts have to wait, "
+            "higher goes first (default 0)",
+    )
+    parser.add_argument(
+        "--optimistic-start",
+        dest = "optimisticStart",
+        action = "store_true",
+        help = "Used with --add: skip the 'qm status' check and run 'qm start' right away",
     )
     parser.add_argument(
         "--version",
@@ -68,41 +123,75 @@ def main(argv: list[str] | None = None) -> int:
     if argv is None:
         argv = sys.argv[1:]
 
+    # VERSION, answered before argparse is even imported
+    if list(argv) == ["--version"]:
+        print(VERSION)
+        return 0
+
     parser = buildParser()
     args = parser.parse_args(argv)
 
-    # VERSION
     if args.version:
-        print("vUSBPB v0.5")
+        print(VERSION)
         return 0
 
     # INSTALL / UNINSTALL
     if args.install:
         requireProxmox()
         requireRoot()
-        return doInstall()
+        from .systemd import install
+        return install()
     if args.uninstall:
         requireProxmox()
         requireRoot()
-        return doUninstall()
+        from .systemd import uninstall
+        return uninstall()
 
     # DAEMON
+    if args.recordFile and not args.daemon:
+        print("--record can only be used with --daemon")
+        return 1
     if args.daemon:
         requireProxmox()
         requireRoot()
-        return runDaemon()
+        from .control import controlRequest
+        if args.recordFile and controlRequest({"command": "ping"}) is not None:
+            # A second daemon would start the same VMs; the recording one has to replace the service
+            print(
+                "ERROR: the vUSBPB daemon is already running, stop it first: "
+                "systemctl stop vusbpb.service"
+            )
+            return 1
+        from .daemon import runDaemon
+        return runDaemon(args.recordFile)
 
     # LIST: usb / vm / pb
+    if args.list is not None and (args.noColor or os.environ.get("NO_COLOR")):
+        from .drawtree import setColor
+        setColor(False)
     if args.list == "usb":
         requireRoot()
-        return showUSB()
+        from .usb import showUSB, UsbPortInfo
+        usbPorts = helperDaemonRequest({"command": "list-usb"})
+        if usbPorts is not None:
+            return showUSB([UsbPortInfo(**port) for port in usbPorts], args.outputFormat)
+        return showUSB(outputFormat = args.outputFormat)
     if args.list == "vm":
         requireProxmox()
         requireRoot()
-        return showVMFromSystem()
+        from .vm import showVMFromSystem
+        return showVMFromSystem(args.outputFormat)
     if args.list == "pb":
         requireProxmox()
-        return listVMPowerButton()
+        from .vm import listVMPowerButton
+        return listVMPowerButton(helperDaemonRequest({"command": "list-pb"}), args.outputFormat)
+    if args.list == "events":
+        requireRoot()
+        events = helperDaemonRequest({"command": "events"})
+        if events is None:
+            print("vUSBPB daemon is not running, no events to show")
+            return 1
+        return showEvents(events, args.outputFormat)
 
     # ADD / DELETE VM MAPPING
     if args.add is not None:
@@ -112,18 +201,48 @@ def main(argv: list[str] | None = None) -> int:
             return 1
         requireProxmox()
         requireRoot()
-        result = addVMPowerButton(args.add, args.usbport, args.usbdevice)
-        if result == 0:
-            daemonRestartIfInstalled()
-        return result
+        # The running daemon picks up config changes by itself
+        result = helperDaemonRequest({
+            "command": "add",
+            "vmId": args.add,
+            "usbPortId": args.usbport,
+            "usbDeviceId": args.usbdevice,
+            "priority": args.priority,
+            "optimisticStart": args.optimisticStart,
+        })
+        if result is not None:
+            print(result["message"])
+            return result["code"]
+        from .vm import addVMPowerButton
+        return addVMPowerButton(
+            args.add,
+            args.usbport,
+            args.usbdevice,
+            args.priority,
+            args.optimisticStart,
+        )
 
     if args.delete is not None:
         requireProxmox()
         requireRoot()
-        result = deleteVMPowerButton(args.delete)
-        if result == 0:
-            daemonRestartIfInstalled()
-        return result
+        result = helperDaemonRequest({"command": "delete", "vmIds": args.delete})
+        if result is not None:
+            print(result["message"])
+            return result["code"]
+        from .vm import deleteVMPowerButton
+        return deleteVMPowerButton(args.delete)
+
+    # BULK IMPORT / EXPORT
+    if args.importFile is not None:
+        requireProxmox()
+        requireRoot()
+        # A single config rewrite, the daemon reloads once through its config watcher
+        from .vm import importVMPowerButtons
+        return importVMPowerButtons(args.importFile, replace = args.replace)
+
+    if args.exportFile is not None:
+        from .vm import exportVMPowerButtons
+        return exportVMPowerButtons(args.exportFile)
 
     # Default: HELP
     parser.print_help()
@@ -131,6 +250,39 @@ def main(argv: list[str] | None = None) -> int:
 
 
 # Helpers
+def helperDaemonRequest(request: dict):
+    # Served from the daemon's memory when it runs, None means "do it directly"
+    from .control import controlRequest
+    response = controlRequest(request)
+    if response is None or not response.get("ok"):
+        return None
+    return response.get("result")
+
+
+def showEvents(events: list, outputFormat: str = "tree") -> int:
+    import time
+
+    if outputFormat == "json":
+        from .drawtree import writeJson
+        writeJson(events)
+        return 0
+
+    if not events:
+        print("No USB events seen since the daemon started")
+        return 0
+
+    for event in events:
+        when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(event.get("time", 0)))
+        if event.get("action") == "trigger":
+            ports = ", ".join(event.get("usbPortIds", []))
+            print(f"{when}  trigger  {ports} -> VMs {event.get('vmIds')}")
+        else:
+            device = event.get("usbDeviceId") or ""
+            action = event.get("action", "")
+            print(f"{when}  {action:<7}  {event.get('usbPortId', '')}  {device}".rstrip())
+    return 0
+
+
 def requireRoot() -> None:
     if os.geteuid() != 0:
         print("This command must be executed as root!")
@@ -0,0 +1,113 @@
+import json
+import os
+import threading
+from typing import Dict, Tuple
+
+PVE_VMLIST_PATH = "/etc/pve/.vmlist"
+PVE_LOCAL_NODE_PATH = "/etc/pve/local"
+PVE_NODES_DIR = "/etc/pve/nodes"
+PVE_COROSYNC_PATH = "/etc/pve/corosync.conf"
+
+
+class VmLocationIndex:
+    def __init__(
+        self,
+        vmlistPath: str | None = None,
+        localNodePath: str | None = None,
+        corosyncPath: str | None = None,
+    ) -> None:
+        self.vmlistPath = vmlistPath
+        self.localNodePath = localNodePath
+        self.corosyncPath = corosyncPath
+        self.lock = threading.Lock()
+        # (mtime_ns, size, inode) of the parsed .vmlist; pmxcfs rewrites the whole file on change
+        self.stamp: Tuple[int, int, int] | None = None
+        self.nodes: Dict[int, str] = {}
+        self.types: Dict[int, str] = {}
+        self.localNode: str | None = None
+        # pmxcfs serves .vmlist on standalone hosts too, only a cluster has nodes worth showing
+        self.clustered = False
+
+    def refresh(self) -> None:
+        path = self.vmlistPath or PVE_VMLIST_PATH
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # Not a cluster (or pmxcfs is down): everything is treated as local
+            with self.lock:
+                self.stamp, self.nodes, self.types, self.clustered = None, {}, {}, False
+            return
+
+        stamp = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if stamp == self.stamp:
+            return
+
+        nodes, types = helperReadVmlist(path)
+        localNode = helperReadLocalNode(self.localNodePath or PVE_LOCAL_NODE_PATH)
+        corosyncPath = self.corosyncPath or PVE_COROSYNC_PATH
+        clustered = len(set(nodes.values())) > 1 or os.path.exists(corosyncPath)
+        with self.lock:
+            self.stamp, self.nodes, self.types, self.localNode = stamp, nodes, types, localNode
+            self.clustered = clustered
+
+    def clusterNode(self) -> str | None:
+        # This node's name, None on a standalone host
+        self.refresh()
+        return self.localNode if self.clustered else None
+
+    def nodeOf(self, vmId: int) -> str | None:
+        # The owning node for display, None on a standalone host
+        self.refresh()
+        return self.nodes.get(vmId) if self.clustered else None
+
+    def remoteNodeOf(self, vmId: int) -> str | None:
+        # The owning node when it is known and not this one, None otherwise
+        self.refresh()
+        node = self.nodes.get(vmId)
+        if node is None or self.localNode is None or node == self.localNode:
+            return None
+        return node
+
+    def remoteVMs(self) -> Dict[int, str]:
+        self.refresh()
+        with self.lock:
+            return {
+                vmId: node
+                for vmId, node in self.nodes.items()
+                if node != self.localNode and self.types.get(vmId) == "qemu"
+            }
+
+
+VM_LOCATIONS = VmLocationIndex()
+
+
+# Helpers
+def helperReadVmlist(path: str) -> Tuple[Dict[int, str], Dict[int, str]]:
+    # {"version": N, "ids": {"100": {"node": "pve1", "type": "qemu", "version": 7}, ...}}
+    nodes: Dict[int, str] = {}
+    types: Dict[int, str] = {}
+    try:
+        with open(path, "r", encoding = "utf-8") as file:
+            data = json.load(file)
+        ids = data.get("ids") or {}
+    except (OSError, ValueError, AttributeError):
+        return nodes, types
+
+    if not isinstance(ids, dict):
+        return nodes, types
+    for vmIdText, info in ids.items():
+        if not vmIdText.isdigit() or not isinstance(info, dict) or not info.get("node"):
+            continue
+        nodes[int(vmIdText)] = str(info["node"])
+        types[int(vmIdText)] = str(info.get("type", "qemu"))
+    return nodes, types
+
+
+def helperReadLocalNode(localNodePath: str) -> str | None:
+    # /etc/pve/local -> nodes/<name>; the hostname is what pmxcfs uses when the link is missing
+    try:
+        return os.path.basename(os.readlink(localNodePath).rstrip("/"))
+    except OSError:
+        pass
+    hostname = os.uname().nodename.split(".", 1)[0]
+    return hostname or None
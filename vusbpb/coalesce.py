@@ -0,0 +1,35 @@
+from typing import Dict, List, Tuple
+
+
+class EventCoalescer:
+    def __init__(self, windowSec: float) -> None:
+        self.windowSec = max(0.0, windowSec)
+        # port -> (device ID, first receipt time)
+        self.pending: Dict[str, Tuple[str | None, float]] = {}
+        self.deadline: float | None = None
+
+    def add(self, usbPortId: str, usbDeviceId: str | None, now: float) -> None:
+        # Repeated events for one port inside the window collapse into one
+        previous = self.pending.get(usbPortId)
+        if previous is None:
+            self.pending[usbPortId] = (usbDeviceId, now)
+        elif usbDeviceId is not None:
+            self.pending[usbPortId] = (usbDeviceId, previous[1])
+        if self.deadline is None:
+            self.deadline = now + self.windowSec
+
+    def timeout(self, now: float) -> float | None:
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - now)
+
+    def flush(self, now: float) -> List[Tuple[str, str | None, float]]:
+        if self.deadline is None or now < self.deadline:
+            return []
+        burst = [
+            (port, usbDeviceId, receivedAt)
+            for port, (usbDeviceId, receivedAt) in self.pending.items()
+        ]
+        self.pending.clear()
+        self.deadline = None
+        return burst
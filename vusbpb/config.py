@@ -1,9 +1,47 @@
+import fcntl
 import json
 import os
 import tempfile
-from typing import Any, Dict, List
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+from .inotify import Inotify, InotifyError, IN_CLOSE_WRITE, IN_MOVED_TO, IN_ONLYDIR
 
 CONFIG_PATH = "/etc/vusbpb.conf"
+# Next to the config: lockConfig() creates CONFIG_PATH + CONFIG_LOCK_SUFFIX
+CONFIG_LOCK_SUFFIX = ".lock"
+USB_HISTORY_PATH = "/var/lib/vusbpb/usb-seen.json"
+
+DAEMON_DEFAULTS: Dict[str, Any] = {
+    "vmWorkers": 4,
+    "vmQueueSize": 64,
+    "coalesceWindowMs": 200,
+    "metricsPath": "/var/lib/prometheus/node-exporter/vusbpb.prom",
+    "metricsIntervalSec": 15,
+    "logBuffered": True,
+    "logJson": False,
+    "logFlushIntervalMs": 500,
+    "logRateBurst": 5,
+    "logRateWindowSec": 10,
+    "maxConcurrentStarts": 2,
+    "startMinFreeMemoryMb": 256,
+    "startMaxCpuPressure": 80.0,
+    "startMaxMemoryPressure": 20.0,
+    "startQueueTimeoutSec": 120,
+    "remoteVmAction": "skip",
+    "netlinkReceiveBufferBytes": 16777216,
+    "ueventListener": "auto",
+    "ueventFilter": True,
+}
+
+# Settings that only accept a fixed set of values
+DAEMON_CHOICES: Dict[str, tuple] = {
+    "remoteVmAction": ("skip", "redirect"),
+    "ueventListener": ("auto", "netlink", "pyudev"),
+}
+
+# Settings that null or an empty string turns off
+DAEMON_OPTIONAL = ("metricsPath",)
 
 
 class ConfigError(Exception):
@@ -13,7 +51,6 @@ class ConfigError(Exception):
 def defaultConfig() -> Dict[str, Any]:
     return {
         "VMS": [],
-        "USB": [],
     }
 
 
@@ -53,6 +90,47 @@ def saveConfig(config: Dict[str, Any]) -> None:
         raise ConfigError(f"Can't write config to {CONFIG_PATH}: {error}") from error
 
 
+@contextmanager
+def lockConfig() -> Iterator[None]:
+    # Serialises load-modify-save between CLI calls and the daemon's control socket
+    lockPath = CONFIG_PATH + CONFIG_LOCK_SUFFIX
+    try:
+        os.makedirs(os.path.dirname(lockPath) or "/", exist_ok = True)
+        fd = os.open(lockPath, os.O_RDWR | os.O_CREAT | os.O_CLOEXEC, 0o600)
+    except OSError as error:
+        raise ConfigError(f"Can't open lock file {lockPath}: {error}") from error
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+class ConfigWatcher:
+    def __init__(self, path: str | None = None) -> None:
+        path = path or CONFIG_PATH
+        self.fileName = os.path.basename(path)
+        self.inotify = Inotify()
+        # saveConfig replaces the file, so the directory is watched rather than the inode
+        try:
+            self.inotify.addWatch(
+                os.path.dirname(path) or "/",
+                IN_CLOSE_WRITE | IN_MOVED_TO | IN_ONLYDIR,
+            )
+        except InotifyError:
+            self.inotify.close()
+            raise
+
+    def fileno(self) -> int:
+        return self.inotify.fileno()
+
+    def changed(self) -> bool:
+        return any(name == self.fileName for _, _, name in self.inotify.readEvents())
+
+    def close(self) -> None:
+        self.inotify.close()
+
+
 def getVmMappings(config: Dict[str, Any]) -> List[Dict[str, Any]]:
     return list(config.get("VMS", []))
 
@@ -62,10 +140,77 @@ def setVmMappings(config: Dict[str, Any], mappings: List[Dict[str, Any]]) -> Dic
     return config
 
 
-def getUSBHistory(config: Dict[str, Any]) -> List[str]:
-    return list(config.get("USB", []))
-
-
-def setUSBHistory(config: Dict[str, Any], ports: List[str]) -> Dict[str, Any]:
-    config["USB"] = list(ports)
-    return config
+def loadUSBHistory() -> List[str]:
+    try:
+        with open(USB_HISTORY_PATH, "r", encoding = "utf-8") as file:
+            ports = json.load(file)
+        if isinstance(ports, list):
+            return [str(port) for port in ports]
+    except FileNotFoundError:
+        # Older versions kept the history in the config itself
+        try:
+            return list(loadConfig(allow_missing = True).get("USB", []))
+        except ConfigError:
+            return []
+    except (OSError, ValueError):
+        pass
+    return []
+
+
+def saveUSBHistory(ports: List[str], previous: List[str] | None = None) -> bool:
+    # Only touches the disk when the set of connected ports differs from what is stored
+    ports = sorted(set(ports))
+    if os.path.exists(USB_HISTORY_PATH):
+        if previous is None:
+            previous = loadUSBHistory()
+        if sorted(set(previous)) == ports:
+            return False
+
+    dirName = os.path.dirname(USB_HISTORY_PATH) or "/"
+    try:
+        os.makedirs(dirName, exist_ok = True)
+        fd, tmpPath = tempfile.mkstemp(prefix = ".usb-seen_", dir = dirName)
+    except OSError as error:
+        raise ConfigError(f"Can't write USB history to {USB_HISTORY_PATH}: {error}") from error
+    try:
+        # A lost history only costs a few spurious NEW markers, no fsync needed
+        with os.fdopen(fd, "w", encoding = "utf-8") as tmpFile:
+            json.dump(ports, tmpFile)
+        os.replace(tmpPath, USB_HISTORY_PATH)
+    except OSError as error:
+        try:
+            os.unlink(tmpPath)
+        except OSError:
+            pass
+        raise ConfigError(f"Can't write USB history to {USB_HISTORY_PATH}: {error}") from error
+    return True
+
+
+def getDaemonSettings(config: Dict[str, Any]) -> Dict[str, Any]:
+    settings = dict(DAEMON_DEFAULTS)
+    overrides = config.get("DAEMON") or {}
+    if not isinstance(overrides, dict):
+        raise ConfigError("DAEMON section in config must be an object")
+
+    for key, default in DAEMON_DEFAULTS.items():
+        if key not in overrides:
+            continue
+        value = overrides[key]
+        if key in DAEMON_OPTIONAL and value in (None, ""):
+            settings[key] = ""
+            continue
+        if isinstance(default, bool):
+            if not isinstance(value, bool):
+                raise ConfigError(f"DAEMON.{key} must be true or false")
+        elif isinstance(value, bool) or value is None:
+            # int(true) would quietly become 1, str(None) a file named "None"
+            raise ConfigError(f"Invalid DAEMON.{key}: {value!r}")
+        elif default is not None:
+            try:
+                value = type(default)(value)
+            except (TypeError, ValueError) as error:
+                raise ConfigError(f"Invalid DAEMON.{key}: {value!r}") from error
+        if key in DAEMON_CHOICES and value not in DAEMON_CHOICES[key]:
+            raise ConfigError(f"DAEMON.{key} must be one of: {', '.join(DAEMON_CHOICES[key])}")
+        settings[key] = value
+    return settings
@@ -0,0 +1,63 @@
+import json
+import os
+import socket
+from typing import Any, Dict
+
+CONTROL_SOCKET_PATH = "/run/vusbpb.sock"
+CONTROL_TIMEOUT = 2.0
+MAX_REQUEST_SIZE = 64 * 1024
+
+
+class ControlError(Exception):
+    pass
+
+
+def controlRequest(request: Dict[str, Any], path: str | None = None) -> Dict[str, Any] | None:
+    path = path or CONTROL_SOCKET_PATH
+    # Cheap check first, most CLI calls on hosts without the daemon end here
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            conn.settimeout(CONTROL_TIMEOUT)
+            conn.connect(path)
+            conn.sendall(helperEncodeMessage(request))
+            response = helperReadMessage(conn)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(response, dict):
+        return None
+    return response
+
+
+# Helpers
+def helperReadMessage(conn: socket.socket, maxSize: int | None = None) -> Dict[str, Any]:
+    chunks = []
+    size = 0
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+        if chunk.endswith(b"\n"):
+            break
+        if maxSize is not None and size > maxSize:
+            raise ValueError("Control message is too large")
+    return helperDecodeMessage(b"".join(chunks))
+
+
+def helperDecodeMessage(data: bytes) -> Dict[str, Any]:
+    data = data.strip()
+    if not data:
+        raise ValueError("Empty control message")
+    message = json.loads(data)
+    if not isinstance(message, dict):
+        raise ValueError("Control message must be a JSON object")
+    return message
+
+
+def helperEncodeMessage(message: Dict[str, Any]) -> bytes:
+    return json.dumps(message, separators = (",", ":")).encode() + b"\n"
@@ -0,0 +1,103 @@
+import asyncio
+import os
+import socket
+from typing import Any, Awaitable, Callable, Dict
+
+from .control import (
+    CONTROL_SOCKET_PATH,
+    CONTROL_TIMEOUT,
+    MAX_REQUEST_SIZE,
+    ControlError,
+    helperDecodeMessage,
+    helperEncodeMessage,
+)
+
+# Apart from control.py, which the CLI imports: asyncio alone costs it more than its budget
+
+
+class ControlServer:
+    def __init__(
+        self,
+        handler: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        path: str | None = None,
+    ) -> None:
+        self.handler = handler
+        self.path = path or CONTROL_SOCKET_PATH
+        self.server: asyncio.AbstractServer | None = None
+        # Inode of the socket this process bound, so close() never removes another daemon's socket
+        self.boundInode: int | None = None
+
+    async def start(self) -> None:
+        if helperSocketInUse(self.path):
+            raise ControlError(f"Another vUSBPB daemon is already serving {self.path}")
+        try:
+            # Nobody answers, so whatever is left there belongs to a daemon that died
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            # Requests can edit the config, keep the socket root-only
+            oldUmask = os.umask(0o177)
+            try:
+                sock.bind(self.path)
+            finally:
+                os.umask(oldUmask)
+            self.boundInode = os.stat(self.path).st_ino
+            # Passing the socket keeps asyncio from unlinking the path on its own
+            self.server = await asyncio.start_unix_server(
+                self.helperServeClient,
+                sock = sock,
+                limit = MAX_REQUEST_SIZE,
+            )
+        except OSError:
+            sock.close()
+            raise
+
+    def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        if self.boundInode is None:
+            return
+        try:
+            if os.stat(self.path).st_ino == self.boundInode:
+                os.unlink(self.path)
+        except OSError:
+            pass
+        self.boundInode = None
+
+    async def helperServeClient(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        # A client that connects and stays silent only holds its own task, never the loop
+        try:
+            try:
+                line = await asyncio.wait_for(reader.readline(), CONTROL_TIMEOUT)
+                response = await self.handler(helperDecodeMessage(line))
+            except TimeoutError:
+                response = {"ok": False, "error": "Timed out waiting for the request"}
+            except (OSError, ValueError) as error:
+                # readline() reports a request over MAX_REQUEST_SIZE as ValueError too
+                response = {"ok": False, "error": str(error)}
+            writer.write(helperEncodeMessage(response))
+            await asyncio.wait_for(writer.drain(), CONTROL_TIMEOUT)
+        except (OSError, TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+
+# Helpers
+def helperSocketInUse(path: str) -> bool:
+    # A listening daemon accepts the connection right away; a stale socket file refuses it
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        probe.settimeout(CONTROL_TIMEOUT)
+        try:
+            probe.connect(path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            return False
+    return True
@@ -1,34 +1,330 @@
+import asyncio
+import errno
+import signal
 import time
-from typing import Dict, List
+from collections import deque
+from dataclasses import asdict
+from functools import partial
+from typing import Any, Callable, Coroutine, Deque, Dict, List, Set, Tuple
 
-from .logging_util import logInfo, logError, logWarning
-from .config import loadConfig, ConfigError
-from .vm import getVMStatus, startVM, VmStatus
-from .usb import scanUSBPorts
+from .logging_util import logInfo, logError, logWarning, configureLogging, shutdownLogging
+from .config import loadConfig, getDaemonSettings, ConfigError, ConfigWatcher
+from .inotify import InotifyError
+from .vm import (
+    startVMAsync,
+    startRemoteVMAsync,
+    getVMMemoryMb,
+    StartOutcome,
+    VmStatus,
+    VmStatusTable,
+    collectPowerButtons,
+    addMapping,
+    deleteMapping,
+)
+from .usb import usbDeviceIdFromProperties, readUsbDeviceIdAsync, UsbInventory, USB_INVENTORY
+from .matcher import TriggerMatcher
+from .mappings import VmMapping, loadMappings, parseInteger
+from .workers import VmActionPool, SubmitResult
+from .coalesce import EventCoalescer
+from .admission import AdmissionController
+from .cluster import VM_LOCATIONS
+from .metrics import METRICS
+from .control import ControlError
+from .controlserver import ControlServer
+from .uevent import UeventDevice, UeventMonitor, UeventError
+from .ueventfilter import compileMappingsFilter, packFilter
+from .record import EventRecorder
 
+DEVICE_ID_WAIT_TIMEOUT = 0.5
+STAGE_METRIC = "vusbpb_stage_duration_seconds"
+RECENT_EVENTS_LIMIT = 200
 
-def runDaemon() -> int:
-    try:
-        import pyudev
-    except ImportError:
-        logError("pyudev is not installed. Please install python3-pyudev")
-        return 1
+
+class DaemonState:
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        mappings: List[VmMapping],
+        statusTable: VmStatusTable,
+    ) -> None:
+        self.config = config
+        self.settings = getDaemonSettings(config)
+        self.mappings = mappings
+        self.matcher = helperBuildMatcher(mappings)
+        self.priorities = helperPriorities(mappings)
+        self.optimistic = helperOptimisticVMs(mappings)
+        self.statusTable = statusTable
+        self.configWatcher: ConfigWatcher | None = None
+        self.portMonitor = None
+        # A capture should hold all USB activity, not what this config's kernel filter lets through
+        self.recording = False
+        self.recentEvents: Deque[Dict[str, Any]] = deque(maxlen = RECENT_EVENTS_LIMIT)
+
+    def reload(self) -> bool:
+        loaded = helperReloadConfig()
+        if loaded is None:
+            return False
+        newConfig, newMappings = loaded
+        # Build first, then swap: events never see a half-built matcher
+        newMatcher = helperBuildMatcher(newMappings)
+        self.config, self.mappings, self.matcher = newConfig, newMappings, newMatcher
+        self.settings = getDaemonSettings(newConfig)
+        self.priorities = helperPriorities(newMappings)
+        self.optimistic = helperOptimisticVMs(newMappings)
+        helperApplyUeventFilter(self)
+        return True
+
+    def priorityOf(self, vmId: int) -> int:
+        return self.priorities.get(vmId, 0)
+
+    def isOptimistic(self, vmId: int) -> bool:
+        return vmId in self.optimistic
+
+
+class DaemonLoop:
+    # Everything runs on one event loop thread: udev and inotify are readers, control clients are
+    # stream tasks, the coalescing window is a timer, and VM actions are tasks awaiting their qm
+    # subprocesses
+    def __init__(
+        self,
+        state: DaemonState,
+        admission: AdmissionController,
+        vmPool: VmActionPool,
+        coalescer: EventCoalescer,
+    ) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.state = state
+        self.admission = admission
+        self.vmPool = vmPool
+        self.coalescer = coalescer
+        # Resolves to the daemon's exit code
+        self.stopped: asyncio.Future = self.loop.create_future()
+        self.flushTimer: asyncio.TimerHandle | None = None
+        self.readers: List[int] = []
+        self.tasks: Set[asyncio.Task] = set()
+        self.recorder: EventRecorder | None = None
+
+    def addReader(self, source, callback: Callable[[], None]) -> None:
+        fd = source.fileno()
+        self.loop.add_reader(fd, self.helperGuarded, callback)
+        self.readers.append(fd)
+
+    def spawn(self, coroutine: Coroutine) -> None:
+        # The loop only keeps weak references to tasks
+        task = self.loop.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.helperTaskDone)
+
+    def stop(self, exitCode: int) -> None:
+        if not self.stopped.done():
+            self.stopped.set_result(exitCode)
+
+    def onSignal(self, signum: int) -> None:
+        logInfo(f"vUSBPB daemon stopping on {signal.Signals(signum).name}")
+        self.stop(0)
+
+    def onMonitorReadable(self, portMonitor) -> None:
+        try:
+            for device in iter(partial(portMonitor.poll, timeout = 0), None):
+                if self.recorder is not None:
+                    self.recorder.record(device, time.monotonic())
+                helperHandleDeviceEvent(self, device)
+        except OSError as error:
+            # libudev reports the socket overrun as ENOBUFS on the next receive
+            if error.errno != errno.ENOBUFS:
+                raise
+            helperResyncAfterOverflow(self)
+
+    def onConfigReadable(self, configWatcher: ConfigWatcher) -> None:
+        if configWatcher.changed() and self.state.reload():
+            self.coalescer.windowSec = max(0.0, self.state.settings["coalesceWindowMs"] / 1000.0)
+            helperConfigureAdmission(self.admission, self.state.settings)
+
+    def queueTrigger(self, usbPortId: str, usbDeviceId: str | None, receivedAt: float) -> None:
+        self.coalescer.add(usbPortId, usbDeviceId, receivedAt)
+        if self.flushTimer is None:
+            untilFlush = self.coalescer.timeout(time.monotonic()) or 0.0
+            self.flushTimer = self.loop.call_later(untilFlush, self.helperFlush)
+
+    def close(self) -> None:
+        for fd in self.readers:
+            self.loop.remove_reader(fd)
+        self.readers.clear()
+        if self.flushTimer is not None:
+            self.flushTimer.cancel()
+            self.flushTimer = None
+        for task in self.tasks:
+            task.cancel()
+
+    def helperFlush(self) -> None:
+        self.flushTimer = None
+        burst = self.coalescer.flush(time.monotonic())
+        if burst:
+            state = self.state
+            vmIds = helperDispatchBurst(state.matcher, self.vmPool, burst, state.priorities)
+            if vmIds:
+                state.recentEvents.append({
+                    "time": time.time(),
+                    "action": "trigger",
+                    "usbPortIds": [port for port, _, _ in burst],
+                    "vmIds": vmIds,
+                })
+        # A window shrunk by a reload may leave the deadline in the future
+        untilFlush = self.coalescer.timeout(time.monotonic())
+        if untilFlush is not None:
+            self.flushTimer = self.loop.call_later(untilFlush, self.helperFlush)
+
+    def helperGuarded(self, callback: Callable[[], None]) -> None:
+        try:
+            callback()
+        except Exception as error:
+            self.helperFail(error)
+
+    def helperTaskDone(self, task: asyncio.Task) -> None:
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.helperFail(task.exception())
+
+    def helperFail(self, error: BaseException) -> None:
+        logError(f"Unexpected error in daemon loop: {error}")
+        self.stop(1)
+
+
+def runDaemon(recordPath: str | None = None) -> int:
     logInfo("vUSBPB daemon starting")
 
     try:
         config = loadConfig(allow_missing = False)
+        settings = getDaemonSettings(config)
+        mappings = loadMappings(config)
     except ConfigError as error:
         logError(f"Can't load config: {error}")
         return 1
 
-    mappings = config.get("VMS", [])
+    configureLogging(
+        buffered = settings["logBuffered"],
+        jsonFormat = settings["logJson"],
+        flushInterval = settings["logFlushIntervalMs"] / 1000.0,
+        rateWindow = settings["logRateWindowSec"],
+        rateBurst = settings["logRateBurst"],
+    )
+
+    portMonitor = helperOpenMonitor(
+        settings["ueventListener"],
+        settings["netlinkReceiveBufferBytes"],
+    )
+    if portMonitor is None:
+        shutdownLogging()
+        return 1
+
+    try:
+        exitCode = asyncio.run(helperServe(portMonitor, config, settings, mappings, recordPath))
+    except KeyboardInterrupt:
+        logInfo("vUSBPB daemon interrupted by user (KeyboardInterrupt)")
+        exitCode = 0
+    except Exception as error:
+        logError(f"Unexpected error in daemon loop: {error}")
+        exitCode = 1
+    finally:
+        shutdownLogging()
+
+    if exitCode:
+        # Keep systemd's restart from spinning on a persistent failure
+        time.sleep(2)
+    return exitCode
+
+
+# Helpers
+async def helperServe(
+    portMonitor,
+    config: Dict[str, Any],
+    settings: Dict[str, Any],
+    mappings: List[VmMapping],
+    recordPath: str | None = None,
+) -> int:
+    statusTable = VmStatusTable()
+    state = DaemonState(config, mappings, statusTable)
+
+    # First, so a second daemon stops here before it records or starts anything
+    controlServer = ControlServer(partial(helperControlRequest, state))
+    try:
+        await controlServer.start()
+    except ControlError as error:
+        logError(str(error))
+        statusTable.close()
+        return 1
+    except OSError as error:
+        controlServer = None
+        logWarning(f"Can't open control socket, CLI will work without the daemon: {error}")
+
+    admission = AdmissionController()
+    helperConfigureAdmission(admission, settings)
+    vmPool = VmActionPool(
+        partial(helperHandleVm, state, admission),
+        workers = settings["vmWorkers"],
+        queueSize = settings["vmQueueSize"],
+    )
+
+    coalescer = EventCoalescer(settings["coalesceWindowMs"] / 1000.0)
+    daemonLoop = DaemonLoop(state, admission, vmPool, coalescer)
+
+    if recordPath:
+        try:
+            daemonLoop.recorder = EventRecorder(recordPath)
+        except OSError as error:
+            logError(f"Can't record USB events to {recordPath}: {error}")
+            statusTable.close()
+            if controlServer is not None:
+                controlServer.close()
+            return 1
+        state.recording = True
+        logInfo(f"Recording USB events to {recordPath}")
+    state.portMonitor = portMonitor
+    helperApplyUeventFilter(state)
+    daemonLoop.addReader(portMonitor, partial(daemonLoop.onMonitorReadable, portMonitor))
+    # Prime the inventory after the monitor is up so no plug falls in between
+    USB_INVENTORY.scan()
+    logInfo(f"Listening for USB 'add' events ({helperMonitorSource(portMonitor)})...")
+
+    try:
+        configWatcher = state.configWatcher = ConfigWatcher()
+        daemonLoop.addReader(configWatcher, partial(daemonLoop.onConfigReadable, configWatcher))
+    except InotifyError as error:
+        configWatcher = None
+        logWarning(f"Can't watch config for changes, restart the service after edits: {error}")
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        daemonLoop.loop.add_signal_handler(signum, daemonLoop.onSignal, signum)
+
+    metricsPath = settings["metricsPath"]
+    if metricsPath:
+        metricsInterval = max(1, settings["metricsIntervalSec"])
+        daemonLoop.spawn(helperWriteMetricsEvery(metricsPath, metricsInterval))
+
+    try:
+        return await daemonLoop.stopped
+    finally:
+        daemonLoop.close()
+        if daemonLoop.recorder is not None:
+            daemonLoop.recorder.close()
+        if metricsPath:
+            helperWriteMetrics(metricsPath)
+        await vmPool.stop()
+        statusTable.close()
+        if configWatcher is not None:
+            configWatcher.close()
+        if controlServer is not None:
+            controlServer.close()
+
+
+def helperBuildMatcher(mappings: List[VmMapping]) -> TriggerMatcher:
     if not mappings:
         logWarning("No VM mappings found in config. Daemon will run but do nothing")
     else:
         countPortOnly = countDevOnly = countBoth = 0
-        for entry in mappings:
-            hasPort = bool(entry.get("usbPortId"))
-            hasDev  = bool(entry.get("usbDeviceId"))
+        for mapping in mappings:
+            hasPort = mapping.usbPortId is not None
+            hasDev  = mapping.usbDeviceId is not None
             if hasPort and hasDev:
                 countBoth += 1
             elif hasPort:
@@ -41,92 +337,438 @@ def runDaemon() -> int:
             f"(port only: {countPortOnly}, device only: {countDevOnly}, port+device: {countBoth})"
         )
 
-    portMonitor = pyudev.Monitor.from_netlink(pyudev.Context())
-    portMonitor.filter_by(subsystem = "usb")
-    logInfo("Listening for USB 'add' events...")
+    return TriggerMatcher(mappings)
+
+
+def helperPriorities(mappings: List[VmMapping]) -> Dict[int, int]:
+    return {mapping.vmId: mapping.priority for mapping in mappings if mapping.priority}
+
+
+def helperOptimisticVMs(mappings: List[VmMapping]) -> Set[int]:
+    return {mapping.vmId for mapping in mappings if mapping.optimisticStart}
 
+
+def helperConfigureAdmission(admission: AdmissionController, settings: Dict[str, Any]) -> None:
+    admission.configure(
+        maxConcurrent = settings["maxConcurrentStarts"],
+        minFreeMemoryMb = settings["startMinFreeMemoryMb"],
+        maxCpuPressure = settings["startMaxCpuPressure"],
+        maxMemoryPressure = settings["startMaxMemoryPressure"],
+        queueTimeout = settings["startQueueTimeoutSec"],
+    )
+
+
+def helperReloadConfig() -> Tuple[dict, List[VmMapping]] | None:
     try:
-        for device in iter(portMonitor.poll, None):
-            usbAction = getattr(device, "action", None)
-            usbSysName = getattr(device, "sys_name", None)
-
-            if usbAction is None or usbSysName is None:
-                continue
-            if usbAction != "add":
-                continue
-
-            usbPortId = usbSysName
-            usbDeviceId = helperGetUsbDeviceId(usbPortId)
-
-            vmIds = helperFindMatchingVMs(config, usbPortId, usbDeviceId)
-            if not vmIds:
-                logInfo(
-                    f"USB 'add' event on {usbPortId}, "
-                    f"device={usbDeviceId or 'unknown'}, no matching VMs"
-                )
-                continue
+        config = loadConfig(allow_missing = False)
+        getDaemonSettings(config)
+        mappings = loadMappings(config)
+    except ConfigError as error:
+        logError(f"Config changed but can't be loaded, keeping previous mappings: {error}")
+        return None
+    logInfo("Config changed, reloading VM mappings")
+    return config, mappings
+
+
+def helperDispatchBurst(
+    matcher: TriggerMatcher,
+    vmPool: VmActionPool,
+    burst: List[Tuple[str, str | None, float]],
+    priorities: Dict[int, int] | None = None,
+) -> List[int]:
+    dispatchedAt = time.monotonic()
+    # vmId -> receipt time of the earliest event that triggered it
+    vmTriggers: Dict[int, float] = {}
+    for usbPortId, usbDeviceId, receivedAt in burst:
+        METRICS.observe(STAGE_METRIC, dispatchedAt - receivedAt, {"stage": "coalesce"})
+        for vmId in matcher.match(usbPortId, usbDeviceId):
+            vmTriggers[vmId] = min(receivedAt, vmTriggers.get(vmId, receivedAt))
+    METRICS.observe(STAGE_METRIC, time.monotonic() - dispatchedAt, {"stage": "match"})
+
+    vmIds = list(vmTriggers)
+    if priorities:
+        # Workers take triggers in queue order, so the important VMs get to admission first
+        vmIds.sort(key = lambda vmId: -priorities.get(vmId, 0))
+    usbPortIds = [port for port, _, _ in burst]
+    if len(burst) == 1:
+        usbPortId, usbDeviceId, _ = burst[0]
+        eventInfo = f"USB 'add' event on {usbPortId}, device={usbDeviceId or 'unknown'}"
+        eventKey = usbPortId
+    else:
+        eventInfo = f"{len(burst)} USB 'add' events on {', '.join(usbPortIds)}"
+        eventKey = "burst"
 
+    if not vmIds:
+        # Noisy unmapped ports are the common case, keep them from flooding the journal
+        logInfo(
+            f"{eventInfo}, no matching VMs",
+            key = f"nomatch:{eventKey}",
+            usbPortIds = usbPortIds,
+        )
+        return vmIds
+    logInfo(f"{eventInfo}, mapped VMs: {vmIds}", usbPortIds = usbPortIds, vmIds = vmIds)
+    METRICS.inc("vusbpb_matches_total", value = len(vmIds))
+
+    for vmId in vmIds:
+        submitResult = vmPool.submit(vmId, vmTriggers[vmId])
+        if submitResult == SubmitResult.IN_FLIGHT:
             logInfo(
-                f"USB 'add' event on {usbPortId}, "
-                f"device={usbDeviceId or 'unknown'}, mapped VMs: {vmIds}"
+                f"VM {vmId} is already being handled; ignoring duplicate trigger",
+                key = f"inflight:{vmId}",
+                vmId = vmId,
+            )
+        elif submitResult == SubmitResult.QUEUE_FULL:
+            logWarning(
+                f"VM action queue is full; dropping trigger for VM {vmId}",
+                key = "queuefull",
+                vmId = vmId,
             )
+    return vmIds
 
-            for vmId in vmIds:
-                vmStatus = getVMStatus(vmId)
-                if vmStatus == VmStatus.STOPPED:
-                    logInfo(f"VM {vmId} is stopped, attempting to start...")
-                    ok = startVM(vmId)
-                    if ok:
-                        logInfo(f"Successfully started VM {vmId}")
-                    else:
-                        logError(f"Failed to start VM {vmId}")
-                elif vmStatus == VmStatus.RUNNING:
-                    logInfo(f"VM {vmId} is already running; nothing to do")
-                else:
-                    logWarning(f"Unknown status for VM {vmId}; skipping start")
 
-    except KeyboardInterrupt:
-        logInfo("vUSBPB daemon interrupted by user (KeyboardInterrupt)")
-        return 0
-    except Exception as error:
-        logError(f"Unexpected error in daemon loop: {error}")
-        time.sleep(2)
-        return 1
+async def helperHandleVm(
+    state: DaemonState,
+    admission: AdmissionController,
+    vmId: int,
+    receivedAt: float,
+) -> None:
+    statusTable = state.statusTable
+    # Decided from the cluster's .vmlist: qm would only fail slowly on another node's guest.
+    # It lives on pmxcfs, which can hang, so it is read off the loop like every /etc/pve file
+    remoteNode = await helperRunBlocking(VM_LOCATIONS.remoteNodeOf, vmId)
+    if remoteNode is not None:
+        await helperHandleRemoteVm(state.settings["remoteVmAction"], vmId, remoteNode, receivedAt)
+        return
 
+    optimistic = state.isOptimistic(vmId)
+    statusStartedAt = time.monotonic()
+    if optimistic:
+        # Pid files only; when they can't tell, 'qm start' will, and one qm run is saved
+        vmStatus = statusTable.cachedStatus(vmId) or VmStatus.STOPPED
+    else:
+        vmStatus = await statusTable.statusAsync(vmId)
+    METRICS.observe(STAGE_METRIC, time.monotonic() - statusStartedAt, {"stage": "status"})
 
-# Helpers
-def helperGetUsbDeviceId(usbPortId: str) -> str | None:
-    for port in scanUSBPorts():
-        if port.usbPortId == usbPortId and port.usbIsConnected:
-            return port.usbDeviceId
-    return None
-
-
-def helperFindMatchingVMs(config: dict, usbPortId: str, usbDeviceId: str | None) -> List[int]:
-    result: List[int] = []
-    vms = config.get("VMS", [])
-    for entry in vms:
-        vmId_raw = entry.get("vmId")
-        if vmId_raw is None:
-            continue
+    if vmStatus == VmStatus.RUNNING:
+        logInfo(
+            f"VM {vmId} is already running; nothing to do",
+            key = f"running:{vmId}",
+            vmId = vmId,
+        )
+        return
+    if vmStatus != VmStatus.STOPPED:
+        logWarning(f"Unknown status for VM {vmId}; skipping start")
+        return
+
+    wasQueued = False
+
+    def onQueued(reason: str) -> None:
+        nonlocal wasQueued
+        wasQueued = True
+        logInfo(f"VM {vmId} start queued: {reason}", key = f"queued:{vmId}", vmId = vmId)
+
+    admissionStartedAt = time.monotonic()
+    memoryMb = await helperRunBlocking(getVMMemoryMb, vmId)
+    admitted, reason = await admission.acquire(vmId, memoryMb, state.priorityOf(vmId), onQueued)
+    METRICS.observe(STAGE_METRIC, time.monotonic() - admissionStartedAt, {"stage": "admission"})
+    if not admitted:
+        METRICS.inc("vusbpb_start_refused_total")
+        logWarning(f"Not starting VM {vmId}: {reason}", vmId = vmId)
+        return
+
+    try:
+        # Someone may have started it while it waited in the queue
+        if wasQueued:
+            if optimistic:
+                queuedStatus = statusTable.cachedStatus(vmId)
+            else:
+                queuedStatus = await statusTable.statusAsync(vmId)
+            if queuedStatus == VmStatus.RUNNING:
+                logInfo(f"VM {vmId} was started while queued; nothing to do", vmId = vmId)
+                return
+
+        if optimistic:
+            logInfo(f"VM {vmId} is not known to be running, attempting to start...")
+        else:
+            logInfo(f"VM {vmId} is stopped, attempting to start...")
+        startStartedAt = time.monotonic()
+        outcome, detail = await startVMAsync(vmId)
+        finishedAt = time.monotonic()
+        METRICS.observe(STAGE_METRIC, finishedAt - startStartedAt, {"stage": "start"})
+        METRICS.observe(STAGE_METRIC, finishedAt - receivedAt, {"stage": "trigger"})
+        if outcome == StartOutcome.STARTED:
+            METRICS.inc("vusbpb_starts_total")
+            logInfo(f"Successfully started VM {vmId}", vmId = vmId)
+        elif outcome == StartOutcome.ALREADY_RUNNING:
+            METRICS.inc("vusbpb_start_conflicts_total", {"reason": "running"})
+            logInfo(
+                f"VM {vmId} is already running; nothing to do",
+                key = f"running:{vmId}",
+                vmId = vmId,
+            )
+        elif outcome == StartOutcome.LOCKED:
+            METRICS.inc("vusbpb_start_conflicts_total", {"reason": "locked"})
+            logWarning(f"VM {vmId} is locked, not starting it: {detail}", vmId = vmId)
+        else:
+            METRICS.inc("vusbpb_start_failures_total")
+            logError(f"Failed to start VM {vmId}: {detail}", vmId = vmId)
+    finally:
+        admission.release(vmId)
+
+
+async def helperHandleRemoteVm(remoteAction: str, vmId: int, node: str, receivedAt: float) -> None:
+    METRICS.inc("vusbpb_remote_triggers_total", {"action": remoteAction})
+    if remoteAction != "redirect":
+        logInfo(
+            f"VM {vmId} runs on node {node}; skipping start",
+            key = f"remote:{vmId}",
+            vmId = vmId,
+            node = node,
+        )
+        return
+
+    # The owning node refuses a start of a running guest, so no status check up front
+    logInfo(
+        f"VM {vmId} runs on node {node}, asking it to start the VM...",
+        vmId = vmId,
+        node = node,
+    )
+    startStartedAt = time.monotonic()
+    ok = await startRemoteVMAsync(vmId, node)
+    finishedAt = time.monotonic()
+    METRICS.observe(STAGE_METRIC, finishedAt - startStartedAt, {"stage": "start"})
+    METRICS.observe(STAGE_METRIC, finishedAt - receivedAt, {"stage": "trigger"})
+    if ok:
+        METRICS.inc("vusbpb_starts_total")
+        logInfo(f"Node {node} started VM {vmId}", vmId = vmId, node = node)
+    else:
+        METRICS.inc("vusbpb_start_failures_total")
+        logError(f"Node {node} failed to start VM {vmId}", vmId = vmId, node = node)
+
+
+async def helperControlRequest(state: DaemonState, request: Dict[str, Any]) -> Dict[str, Any]:
+    command = request.get("command")
+
+    if command == "ping":
+        return {"ok": True, "result": None}
+    if command == "list-pb":
+        # Pid files only, a 'qm status' per VM would keep the client waiting; nodes come from pmxcfs
+        statusOf = lambda vmId: state.statusTable.cachedStatus(vmId) or VmStatus.UNKNOWN
+        buttons = await helperRunBlocking(
+            collectPowerButtons,
+            state.mappings,
+            statusOf,
+            VM_LOCATIONS.nodeOf,
+        )
+        return {"ok": True, "result": buttons}
+    if command == "list-usb":
+        # With the kernel filter, removals and unmapped ports never reach the inventory, so
+        # (by default) this is a fresh sysfs scan rather than the daemon's in-memory view
+        if getattr(state.portMonitor, "filtered", False):
+            ports = await helperRunBlocking(UsbInventory().scan)
+        else:
+            ports = USB_INVENTORY.snapshot()
+        return {"ok": True, "result": [asdict(port) for port in ports]}
+    if command == "events":
+        return {"ok": True, "result": list(state.recentEvents)}
+
+    if command in ("add", "delete"):
+        if command == "add":
+            vmId = parseInteger(request.get("vmId"))
+            priority = parseInteger(request.get("priority") or 0)
+            if vmId is None or priority is None:
+                return {"ok": False, "error": "Invalid VM ID or priority in request"}
+            edit = partial(
+                addMapping,
+                vmId,
+                request.get("usbPortId"),
+                request.get("usbDeviceId"),
+                priority,
+                bool(request.get("optimisticStart")),
+            )
+        else:
+            vmIds = [parseInteger(vmId) for vmId in request.get("vmIds") or []]
+            if None in vmIds:
+                return {"ok": False, "error": "Invalid VM ID in request"}
+            edit = partial(deleteMapping, vmIds)
+        # The config lock and fsync block, keep them off the loop that handles USB events
+        result, message = await helperRunBlocking(edit)
+
+        if result == 0 and (state.configWatcher is None or state.configWatcher.changed()):
+            # Unless the watcher already reloaded while the edit ran, apply now so the next
+            # request sees it, and swallow the watcher's echo
+            state.reload()
+        return {"ok": True, "result": {"code": result, "message": message}}
+
+    return {"ok": False, "error": f"Unknown command: {command!r}"}
+
+
+def helperHandleDeviceEvent(daemonLoop: DaemonLoop, device) -> None:
+    usbAction = getattr(device, "action", None)
+    usbSysName = getattr(device, "sys_name", None)
+    if usbAction is None or usbSysName is None:
+        return
+
+    receivedAt = time.monotonic()
+    METRICS.inc("vusbpb_events_total", {"action": usbAction})
+    helperObserveReceipt(device)
+
+    USB_INVENTORY.applyEvent(usbAction, usbSysName, device.properties, device.sys_path)
+    if usbAction == "add" and usbSysName.startswith("usb"):
+        # A new root hub (a dock's controller, a renumbered bus) gets its own branch in the filter
+        helperApplyUeventFilter(daemonLoop.state)
+    if usbAction == "add":
+        # Reading the device ID may have to wait for sysfs; events behind it must not
+        daemonLoop.spawn(helperResolveDevice(daemonLoop, device, receivedAt))
+        return
+    helperRecordEvent(daemonLoop.state, usbAction, usbSysName, None)
+
+
+async def helperResolveDevice(daemonLoop: DaemonLoop, device, receivedAt: float) -> None:
+    usbDeviceId = await helperGetUsbDeviceId(device)
+    METRICS.observe(STAGE_METRIC, time.monotonic() - receivedAt, {"stage": "resolve"})
+    daemonLoop.queueTrigger(device.sys_name, usbDeviceId, receivedAt)
+    helperRecordEvent(daemonLoop.state, "add", device.sys_name, usbDeviceId)
+
+
+def helperResyncAfterOverflow(daemonLoop: DaemonLoop) -> None:
+    # The kernel dropped uevents: whatever got plugged meanwhile is only visible in sysfs now
+    METRICS.inc("vusbpb_netlink_overflows_total")
+    receivedAt = time.monotonic()
+    missed = USB_INVENTORY.resync()
+    logWarning(
+        f"udev monitor overflowed (ENOBUFS), resynced from sysfs: {len(missed)} missed device(s)",
+        key = "overflow",
+        missed = [port.usbPortId for port in missed],
+    )
+    for port in missed:
+        METRICS.inc("vusbpb_events_total", {"action": "resync"})
+        daemonLoop.queueTrigger(port.usbPortId, port.usbDeviceId, receivedAt)
+        helperRecordEvent(daemonLoop.state, "resync", port.usbPortId, port.usbDeviceId)
+
+
+def helperRecordEvent(
+    state: DaemonState,
+    usbAction: str,
+    usbPortId: str,
+    usbDeviceId: str | None,
+) -> None:
+    state.recentEvents.append({
+        "time": time.time(),
+        "action": usbAction,
+        "usbPortId": usbPortId,
+        "usbDeviceId": usbDeviceId,
+    })
+
+
+def helperOpenMonitor(listener: str, receiveBufferBytes: int):
+    # 'auto' prefers the netlink listener, pyudev stays for hosts where it can't subscribe
+    if listener != "pyudev":
         try:
-            vmId = int(vmId_raw)
-        except (TypeError, ValueError):
-            continue
+            portMonitor = UeventMonitor()
+            helperStartMonitor(portMonitor, receiveBufferBytes)
+            return portMonitor
+        except UeventError as error:
+            if listener == "netlink":
+                logError(f"Can't listen for USB events: {error}")
+                return None
+            logWarning(f"Built-in uevent listener unavailable, falling back to pyudev: {error}")
+
+    try:
+        import pyudev
+    except ImportError:
+        logError("pyudev is not installed. Please install python3-pyudev")
+        return None
+    portMonitor = pyudev.Monitor.from_netlink(pyudev.Context())
+    helperStartMonitor(portMonitor, receiveBufferBytes)
+    return portMonitor
+
+
+def helperStartMonitor(portMonitor, receiveBufferBytes: int) -> None:
+    # Interfaces of a device (1-1.2:1.0, ...) report separately; only whole devices matter
+    portMonitor.filter_by(subsystem = "usb", device_type = "usb_device")
+    helperSetReceiveBuffer(portMonitor, receiveBufferBytes)
+    portMonitor.start()
+
+
+def helperMonitorSource(portMonitor) -> str:
+    return "kernel netlink" if isinstance(portMonitor, UeventMonitor) else "pyudev"
+
 
-        portCond = entry.get("usbPortId")
-        devCond = entry.get("usbDeviceId")
+def helperApplyUeventFilter(state: DaemonState) -> None:
+    portMonitor = state.portMonitor
+    if not isinstance(portMonitor, UeventMonitor):
+        return
 
-        if not portCond and not devCond:
-            continue
+    try:
+        if not state.settings["ueventFilter"] or state.recording:
+            portMonitor.detachFilter()
+            return
+        program, patterns = compileMappingsFilter(state.mappings)
+        portMonitor.attachFilter(packFilter(program), len(program))
+    except UeventError as error:
+        logWarning(f"Can't update the kernel uevent filter, Python filters every event: {error}")
+        return
+
+    if not patterns:
+        logInfo(f"Kernel uevent filter: 'add' events only ({len(program)} instructions)")
+    else:
+        portCount = sum(len(suffixes) for suffixes in patterns.values())
+        logInfo(
+            f"Kernel uevent filter: 'add' events on {portCount} mapped port pattern(s) "
+            f"behind {len(patterns)} controller(s) ({len(program)} instructions)"
+        )
+
+
+def helperSetReceiveBuffer(portMonitor, size: int) -> None:
+    if size <= 0:
+        return
+    # SO_RCVBUFFORCE: needs CAP_NET_ADMIN, which the service has as root
+    try:
+        portMonitor.set_receive_buffer_size(size)
+    except (OSError, AttributeError) as error:
+        logWarning(
+            f"Can't set udev monitor receive buffer to {size} bytes, keeping the default: {error}"
+        )
+
+
+def helperObserveReceipt(device) -> None:
+    # Time between udev finishing with the device and the daemon seeing it. Kernel uevents
+    # carry no timestamp (netlink sockets ignore SO_TIMESTAMP), so they skip this stage
+    if isinstance(device, UeventDevice):
+        return
+    sinceInitialized = device.time_since_initialized.total_seconds()
+    METRICS.observe(STAGE_METRIC, sinceInitialized, {"stage": "receive"})
+
+
+async def helperRunBlocking(func: Callable[..., Any], *args: Any) -> Any:
+    # File system calls that may block (pmxcfs, flock, fsync) run in the default executor
+    return await asyncio.get_running_loop().run_in_executor(None, partial(func, *args))
+
+
+async def helperWriteMetricsEvery(metricsPath: str, interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        helperWriteMetrics(metricsPath)
+
+
+def helperWriteMetrics(metricsPath: str) -> None:
+    try:
+        METRICS.writeTextfile(metricsPath)
+    except OSError as error:
+        logWarning(f"Can't write metrics to {metricsPath}: {error}")
 
-        if portCond and portCond != usbPortId:
-            continue
 
-        if devCond:
-            if not usbDeviceId or devCond != usbDeviceId:
-                continue
+async def helperGetUsbDeviceId(device) -> str | None:
+    usbDeviceId = usbDeviceIdFromProperties(device.properties)
+    if usbDeviceId:
+        return usbDeviceId
 
-        result.append(vmId)
+    sysPath = getattr(device, "sys_path", None)
+    if not sysPath:
+        return None
 
-    return result
+    # Descriptors may not be readable yet when the event arrives; interfaces never have them
+    if getattr(device, "device_type", None) != "usb_device":
+        return await readUsbDeviceIdAsync(sysPath)
+    return await readUsbDeviceIdAsync(sysPath, waitTimeout = DEVICE_ID_WAIT_TIMEOUT)
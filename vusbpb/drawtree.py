@@ -1,5 +1,15 @@
+import json
+import sys
 from dataclasses import dataclass, field
-from typing import List, Iterable
+from typing import Any, Iterable, Iterator, List, TextIO, Tuple
+
+# SGR codes used by the listings
+GREEN = "38;5;28"
+LIGHT_GREEN = "38;5;82"
+WHITE = "38;5;15"
+NEW_BADGE = "5;48;5;196;38;5;15"
+
+COLOR_ENABLED = True
 
 
 @dataclass
@@ -8,31 +18,72 @@ class TreeNode:
     children: List["TreeNode"] = field(default_factory=list)
 
 
-def renderTree(rootLabel: str, roots: Iterable[TreeNode]) -> str:
-    lines: List[str] = [rootLabel]
-    rootsList = list(roots)
+def setColor(enabled: bool) -> None:
+    global COLOR_ENABLED
+    COLOR_ENABLED = enabled
 
-    if not rootsList:
-        lines.append("└── (empty)")
-        return "\n".join(lines)
 
-    lastIndex = len(rootsList) - 1
-    for idx, root in enumerate(rootsList):
-        helperRenderNode(root, prefix = "", isLast = (idx == lastIndex), lines = lines)
+def paint(text: str, color: str) -> str:
+    if not COLOR_ENABLED:
+        return text
+    return f"\033[{color}m{text}\033[0m"
 
-    return "\n".join(lines)
 
+def fieldLabel(name: str, value: Any, nameColor: str = LIGHT_GREEN) -> str:
+    return paint(f"{name}: ", nameColor) + paint(str(value), WHITE)
 
-# Helpers
-def helperRenderNode(node: TreeNode, prefix: str, isLast: bool, lines: List[str]) -> None:
-    asciiConnector = "└── " if isLast else "├── "
-    lines.append(f"\033[38;5;28m{prefix}{asciiConnector}\033[0m{node.label}")
 
-    if not node.children:
-        return
+def iterTreeLines(rootLabel: str, roots: Iterable[TreeNode]) -> Iterator[str]:
+    yield rootLabel
 
-    childPrefix = prefix + ("    " if isLast else "│   ")
-    lastIndex = len(node.children) - 1
+    empty = True
+    # One node of lookahead is all that is needed to know which root is the last
+    for root, isLast in helperWithLast(roots):
+        empty = False
+        # Explicit stack instead of recursion: (node, prefix, isLast)
+        stack: List[Tuple[TreeNode, str, bool]] = [(root, "", isLast)]
+        while stack:
+            node, prefix, nodeIsLast = stack.pop()
+            asciiConnector = "└── " if nodeIsLast else "├── "
+            yield paint(f"{prefix}{asciiConnector}", GREEN) + node.label
 
-    for idx, child in enumerate(node.children):
-        helperRenderNode(child, childPrefix, idx == lastIndex, lines)
\ No newline at end of file
+            childPrefix = prefix + ("    " if nodeIsLast else "│   ")
+            lastIndex = len(node.children) - 1
+            for idx in range(lastIndex, -1, -1):
+                stack.append((node.children[idx], childPrefix, idx == lastIndex))
+
+    if empty:
+        yield "└── (empty)"
+
+
+def renderTree(rootLabel: str, roots: Iterable[TreeNode]) -> str:
+    return "\n".join(iterTreeLines(rootLabel, roots))
+
+
+def writeTree(rootLabel: str, roots: Iterable[TreeNode], out: TextIO | None = None) -> None:
+    # Lines go out as they are produced, a large listing never sits in memory as one string
+    out = out or sys.stdout
+    for line in iterTreeLines(rootLabel, roots):
+        out.write(line)
+        out.write("\n")
+    out.flush()
+
+
+def writeJson(data: Any, out: TextIO | None = None) -> None:
+    out = out or sys.stdout
+    json.dump(data, out, separators = (",", ":"))
+    out.write("\n")
+    out.flush()
+
+
+# Helpers
+def helperWithLast(items: Iterable[TreeNode]) -> Iterator[Tuple[TreeNode, bool]]:
+    iterator = iter(items)
+    try:
+        current = next(iterator)
+    except StopIteration:
+        return
+    for following in iterator:
+        yield current, False
+        current = following
+    yield current, True
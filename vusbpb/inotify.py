@@ -0,0 +1,78 @@
+import errno
+import os
+import struct
+from typing import List, Tuple
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class InotifyError(Exception):
+    pass
+
+
+class Inotify:
+    def __init__(self) -> None:
+        # Only the daemon watches files, the CLI should not pay for ctypes
+        import ctypes
+
+        self.ctypes = ctypes
+        try:
+            self.libc = ctypes.CDLL(None, use_errno = True)
+            initFn = self.libc.inotify_init1
+        except (OSError, AttributeError) as error:
+            raise InotifyError(f"inotify is not available: {error}") from error
+
+        fd = initFn(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            code = ctypes.get_errno()
+            raise InotifyError(f"inotify_init1 failed: {os.strerror(code)}")
+        self.fd = fd
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def addWatch(self, path: str, mask: int) -> int:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.ctypes.c_uint32(mask))
+        if wd < 0:
+            code = self.ctypes.get_errno()
+            raise InotifyError(f"Cannot watch {path}: {os.strerror(code)}")
+        return wd
+
+    def readEvents(self) -> List[Tuple[int, int, str]]:
+        events: List[Tuple[int, int, str]] = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            except OSError as error:
+                if error.errno == errno.EINTR:
+                    continue
+                raise
+            if not data:
+                return events
+
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(data):
+                wd, mask, _, nameLen = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + nameLen].split(b"\0", 1)[0]
+                offset += nameLen
+                events.append((wd, mask, os.fsdecode(name)))
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
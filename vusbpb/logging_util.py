@@ -1,18 +1,222 @@
+import atexit
+import json
 import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, TextIO
 
+MAX_BUFFERED_LINES = 10000
 
-def logInfo(msg: str) -> None:
-    saveLog("INFO", msg)
 
+def logInfo(msg: str, key: str | None = None, **fields: Any) -> None:
+    saveLog("INFO", msg, key, fields)
 
-def logWarning(msg: str) -> None:
-    saveLog("WARNING", msg)
 
+def logWarning(msg: str, key: str | None = None, **fields: Any) -> None:
+    saveLog("WARNING", msg, key, fields)
 
-def logError(msg: str) -> None:
-    saveLog("ERROR", msg)
 
+def logError(msg: str, key: str | None = None, **fields: Any) -> None:
+    saveLog("ERROR", msg, key, fields)
 
-def saveLog(level: str, msg: str) -> None:
+
+def saveLog(
+    level: str,
+    msg: str,
+    key: str | None = None,
+    fields: Dict[str, Any] | None = None,
+) -> None:
+    logger = LOGGER
+    if logger is not None:
+        logger.log(level, msg, key, fields)
+        return
     sys.stderr.write(f"[{level}] vusbpb: {msg}\n")
-    sys.stderr.flush()
\ No newline at end of file
+    sys.stderr.flush()
+
+
+class BufferedLogger:
+    def __init__(
+        self,
+        stream: TextIO,
+        flushInterval: float = 0.5,
+        jsonFormat: bool = False,
+        rateWindow: float = 10.0,
+        rateBurst: int = 5,
+        immediate: bool = False,
+    ) -> None:
+        self.stream = stream
+        self.flushInterval = max(0.01, flushInterval)
+        self.jsonFormat = jsonFormat
+        # Unbuffered: every message wakes the writer, the interval only paces rate-limit summaries
+        self.immediate = immediate
+        self.rateWindow = rateWindow
+        self.rateBurst = rateBurst
+
+        self.buffer: Deque[str] = deque()
+        self.dropped = 0
+        # key -> [window start, messages in window, suppressed in window, level]
+        self.rates: Dict[str, List[Any]] = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        # Set with a notify so a message logged while the writer is busy isn't left for the next
+        # tick
+        self.urgent = False
+        self.closed = False
+
+        self.thread = threading.Thread(
+            target = self.helperFlushLoop,
+            name = "vusbpb-log",
+            daemon = True,
+        )
+        self.thread.start()
+
+    def log(
+        self,
+        level: str,
+        msg: str,
+        key: str | None = None,
+        fields: Dict[str, Any] | None = None,
+    ) -> None:
+        now = time.time()
+        with self.lock:
+            if key is not None and self.rateBurst > 0 and not self.helperAllow(key, level, now):
+                return
+            self.helperAppend(level, msg, now, key, fields)
+            # Errors must not sit in a buffer if the process is about to die
+            if level == "ERROR" or self.immediate:
+                self.urgent = True
+                self.wakeup.notify()
+
+    def flush(self) -> None:
+        with self.lock:
+            self.helperSummarize(time.time(), force = False)
+            lines, self.buffer = list(self.buffer), deque()
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            overflowMsg = f"Log buffer overflow, dropped {dropped} message(s)"
+            lines.insert(0, self.helperFormat("WARNING", overflowMsg, time.time(), None, None))
+        if not lines:
+            return
+        try:
+            self.stream.write("".join(lines))
+            self.stream.flush()
+        except (OSError, ValueError):
+            pass
+
+    def close(self) -> None:
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.helperSummarize(time.time(), force = True)
+            self.wakeup.notify()
+        self.thread.join(timeout = 1.0)
+        self.flush()
+
+    def helperAllow(self, key: str, level: str, now: float) -> bool:
+        state = self.rates.get(key)
+        if state is None or now - state[0] >= self.rateWindow:
+            if state is not None and state[2]:
+                self.helperAppendSummary(key, state)
+            self.rates[key] = [now, 1, 0, level]
+            return True
+        if state[1] < self.rateBurst:
+            state[1] += 1
+            return True
+        state[2] += 1
+        return False
+
+    def helperSummarize(self, now: float, force: bool) -> None:
+        # Report windows that ended quietly, otherwise their summary would wait for the next message
+        for key, state in list(self.rates.items()):
+            if force or now - state[0] >= self.rateWindow:
+                if state[2]:
+                    self.helperAppendSummary(key, state)
+                del self.rates[key]
+
+    def helperAppendSummary(self, key: str, state: List[Any]) -> None:
+        self.helperAppend(
+            state[3],
+            f"suppressed {state[2]} similar message(s) in the last {self.rateWindow:g}s",
+            time.time(),
+            key,
+            {"suppressed": state[2]},
+        )
+
+    def helperAppend(
+        self,
+        level: str,
+        msg: str,
+        now: float,
+        key: str | None,
+        fields: Dict[str, Any] | None,
+    ) -> None:
+        if len(self.buffer) >= MAX_BUFFERED_LINES:
+            self.buffer.popleft()
+            self.dropped += 1
+        self.buffer.append(self.helperFormat(level, msg, now, key, fields))
+
+    def helperFormat(
+        self,
+        level: str,
+        msg: str,
+        now: float,
+        key: str | None,
+        fields: Dict[str, Any] | None,
+    ) -> str:
+        if not self.jsonFormat:
+            return f"[{level}] vusbpb: {msg}\n"
+        record: Dict[str, Any] = {"ts": round(now, 6), "level": level, "msg": msg}
+        if key is not None:
+            record["key"] = key
+        if fields:
+            record.update(fields)
+        return json.dumps(record, separators = (",", ":"), default = str) + "\n"
+
+    def helperFlushLoop(self) -> None:
+        while True:
+            with self.lock:
+                if not self.closed and not self.urgent:
+                    self.wakeup.wait(self.flushInterval)
+                self.urgent = False
+                closed = self.closed
+            self.flush()
+            if closed:
+                return
+
+
+LOGGER: BufferedLogger | None = None
+
+
+def configureLogging(
+    buffered: bool,
+    jsonFormat: bool = False,
+    flushInterval: float = 0.5,
+    rateWindow: float = 10.0,
+    rateBurst: int = 5,
+) -> None:
+    global LOGGER
+    shutdownLogging()
+    if not buffered and not jsonFormat and rateBurst <= 0:
+        return
+    # Unbuffered JSON or rate limiting still goes through the logger, which then writes each
+    # message right away
+    LOGGER = BufferedLogger(
+        sys.stderr,
+        flushInterval = flushInterval,
+        jsonFormat = jsonFormat,
+        rateWindow = rateWindow,
+        rateBurst = rateBurst,
+        immediate = not buffered,
+    )
+
+
+def shutdownLogging() -> None:
+    global LOGGER
+    logger, LOGGER = LOGGER, None
+    if logger is not None:
+        logger.close()
+
+
+atexit.register(shutdownLogging)
@@ -0,0 +1,162 @@
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Tuple
+
+from .config import ConfigError
+
+PORT_PATTERN = re.compile(r"^\d+-\d+(\.\d+)*(:\d+\.\d+)?$")
+PORT_SUBTREE_PATTERN = re.compile(r"^\d+-(\d+(\.\d+)*\.)?\*$")
+DEVICE_PATTERN = re.compile(r"^[0-9a-f]{4}:([0-9a-f]{4}|\*)$")
+INTEGER_PATTERN = re.compile(r"^-?[0-9]+$")
+FLAG_VALUES = {"true": True, "yes": True, "1": True, "false": False, "no": False, "0": False}
+
+
+@dataclass(frozen = True, slots = True)
+class VmMapping:
+    vmId: int
+    usbPortId: str | None = None
+    usbDeviceId: str | None = None
+    priority: int = 0
+    # Skip the 'qm status' check and let 'qm start' report a running or locked VM
+    optimisticStart: bool = False
+
+    def toDict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {"vmId": self.vmId}
+        if self.usbPortId is not None:
+            data["usbPortId"] = self.usbPortId
+        if self.usbDeviceId is not None:
+            data["usbDeviceId"] = self.usbDeviceId
+        if self.priority:
+            data["priority"] = self.priority
+        if self.optimisticStart:
+            data["optimisticStart"] = True
+        return data
+
+
+def loadMappings(config: Dict[str, Any]) -> List[VmMapping]:
+    mappings, errors = normalizeMappings(config.get("VMS", []))
+    if errors:
+        raise ConfigError("Invalid VM mappings:\n" + "\n".join(f"  {error}" for error in errors))
+    return mappings
+
+
+def mappingsToConfig(mappings: List[VmMapping]) -> List[Dict[str, Any]]:
+    return [mapping.toDict() for mapping in mappings]
+
+
+def parseInteger(value: Any) -> int | None:
+    # JSON ints and whole-number text from a CSV; int() would also take true (1) and 101.9 (101)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and INTEGER_PATTERN.match(value.strip()):
+        return int(value)
+    return None
+
+
+def normalizeMappings(entries: Any) -> Tuple[List[VmMapping], List[str]]:
+    if not isinstance(entries, list):
+        return [], ["VM mappings must be a list"]
+
+    mappings: List[VmMapping] = []
+    errors: List[str] = []
+    seen: Dict[int, int] = {}
+
+    for idx, entry in enumerate(entries, start = 1):
+        where = f"mapping #{idx}"
+        if not isinstance(entry, dict):
+            errors.append(f"{where}: must be an object")
+            continue
+
+        vmId = parseInteger(entry.get("vmId"))
+        if vmId is None:
+            errors.append(f"{where}: invalid vmId {entry.get('vmId')!r}")
+            continue
+        if vmId <= 0:
+            errors.append(f"{where}: invalid vmId {vmId}")
+            continue
+        where = f"{where} (VM {vmId})"
+
+        if vmId in seen:
+            errors.append(f"{where}: duplicate of mapping #{seen[vmId]}")
+            continue
+        seen[vmId] = idx
+
+        usbPortId = helperCleanValue(entry.get("usbPortId"))
+        usbDeviceId = helperCleanValue(entry.get("usbDeviceId"))
+        if usbDeviceId is not None:
+            usbDeviceId = usbDeviceId.lower()
+            if usbDeviceId == "*:*":
+                usbDeviceId = "*"
+
+        if usbPortId is None and usbDeviceId is None:
+            errors.append(f"{where}: needs usbPortId and/or usbDeviceId")
+            continue
+        if usbPortId is not None and not helperIsValidPort(usbPortId):
+            errors.append(f"{where}: invalid usbPortId {usbPortId!r}")
+            continue
+        if usbDeviceId is not None and usbDeviceId != "*" and not DEVICE_PATTERN.match(usbDeviceId):
+            errors.append(
+                f"{where}: invalid usbDeviceId {usbDeviceId!r}, expected VENDOR:PRODUCT in hex"
+            )
+            continue
+
+        priority = entry.get("priority")
+        priority = parseInteger(priority) if helperCleanValue(priority) is not None else 0
+        if priority is None:
+            errors.append(
+                f"{where}: invalid priority {entry.get('priority')!r}, expected an integer"
+            )
+            continue
+
+        optimisticStart = helperParseFlag(entry.get("optimisticStart"))
+        if optimisticStart is None:
+            errors.append(
+                f"{where}: invalid optimisticStart {entry.get('optimisticStart')!r}, "
+                "expected true or false"
+            )
+            continue
+
+        mappings.append(VmMapping(
+            vmId = vmId,
+            usbPortId = helperNormalizePort(usbPortId) if usbPortId is not None else None,
+            usbDeviceId = usbDeviceId,
+            priority = priority,
+            optimisticStart = optimisticStart,
+        ))
+
+    return mappings, errors
+
+
+# Helpers
+def helperCleanValue(value: Any) -> str | None:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def helperParseFlag(value: Any) -> bool | None:
+    # JSON gives a bool, a CSV import gives text; None means neither
+    if isinstance(value, bool):
+        return value
+    text = helperCleanValue(value)
+    if text is None:
+        return False
+    return FLAG_VALUES.get(text.lower())
+
+
+def helperIsValidPort(usbPortId: str) -> bool:
+    if usbPortId == "*":
+        return True
+    return bool(PORT_PATTERN.match(usbPortId) or PORT_SUBTREE_PATTERN.match(usbPortId))
+
+
+def helperNormalizePort(usbPortId: str) -> str:
+    # "1-01.2" and "1-1.2" are the same port, sysfs never uses leading zeros.
+    # Only usb_device events are watched, so an interface ("3-0:1.0") stands for its device
+    if usbPortId == "*":
+        return usbPortId
+    devpath = usbPortId.partition(":")[0]
+    busNum, _, ports = devpath.partition("-")
+    components = [part if part == "*" else str(int(part)) for part in ports.split(".")]
+    return f"{int(busNum)}-{'.'.join(components)}"
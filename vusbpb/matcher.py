@@ -0,0 +1,130 @@
+from typing import Dict, Iterable, List, Tuple
+
+from .mappings import VmMapping
+
+# (config order, vmId) - config order keeps results stable across rebuilds
+Rule = Tuple[int, int]
+
+
+class DeviceRules:
+    __slots__ = ("anyDevice", "exactDevice", "vendorDevice")
+
+    def __init__(self) -> None:
+        self.anyDevice: List[Rule] = []
+        self.exactDevice: Dict[str, List[Rule]] = {}
+        self.vendorDevice: Dict[str, List[Rule]] = {}
+
+    def add(self, deviceCond: Tuple[str, str] | None, rule: Rule) -> None:
+        if deviceCond is None:
+            self.anyDevice.append(rule)
+            return
+        kind, key = deviceCond
+        table = self.exactDevice if kind == "exact" else self.vendorDevice
+        table.setdefault(key, []).append(rule)
+
+    def collect(self, usbDeviceId: str | None, usbVendorId: str | None, out: List[Rule]) -> None:
+        if self.anyDevice:
+            out.extend(self.anyDevice)
+        if usbDeviceId is None:
+            return
+        if self.exactDevice:
+            out.extend(self.exactDevice.get(usbDeviceId, ()))
+        if self.vendorDevice:
+            out.extend(self.vendorDevice.get(usbVendorId, ()))
+
+
+class TrieNode:
+    __slots__ = ("children", "subtree")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "TrieNode"] = {}
+        self.subtree: DeviceRules | None = None
+
+
+class TriggerMatcher:
+    def __init__(self, mappings: Iterable[VmMapping]) -> None:
+        self.anyPort = DeviceRules()
+        self.exactPort: Dict[str, DeviceRules] = {}
+        self.subtreeRoot = TrieNode()
+        self.ruleCount = 0
+
+        for order, mapping in enumerate(mappings):
+            self.helperAddMapping(order, mapping)
+
+    def match(self, usbPortId: str, usbDeviceId: str | None) -> List[int]:
+        if usbDeviceId is not None:
+            usbDeviceId = usbDeviceId.lower()
+            usbVendorId = usbDeviceId.split(":", 1)[0]
+        else:
+            usbVendorId = None
+
+        found: List[Rule] = []
+        self.anyPort.collect(usbDeviceId, usbVendorId, found)
+
+        exact = self.exactPort.get(usbPortId)
+        if exact is not None:
+            exact.collect(usbDeviceId, usbVendorId, found)
+
+        if self.subtreeRoot.children:
+            components = helperDevpathComponents(usbPortId)
+            if components:
+                node = self.subtreeRoot
+                # Only strict ancestors count: "1-1.*" matches 1-1.2 but not 1-1 itself
+                for component in components[:-1]:
+                    node = node.children.get(component)
+                    if node is None:
+                        break
+                    if node.subtree is not None:
+                        node.subtree.collect(usbDeviceId, usbVendorId, found)
+
+        if not found:
+            return []
+
+        result: List[int] = []
+        seen = set()
+        for _, vmId in sorted(found):
+            if vmId not in seen:
+                seen.add(vmId)
+                result.append(vmId)
+        return result
+
+    def helperAddMapping(self, order: int, mapping: VmMapping) -> None:
+        # Mappings are validated and normalized at load, nothing to reject here
+        portCond = mapping.usbPortId
+        deviceRule = helperDeviceRule(mapping.usbDeviceId)
+        rule: Rule = (order, mapping.vmId)
+
+        if portCond is None or portCond == "*":
+            self.anyPort.add(deviceRule, rule)
+        elif portCond.endswith("*"):
+            node = self.subtreeRoot
+            for component in helperDevpathComponents(portCond[:-1].rstrip(".-")):
+                node = node.children.setdefault(component, TrieNode())
+            if node.subtree is None:
+                node.subtree = DeviceRules()
+            node.subtree.add(deviceRule, rule)
+        else:
+            self.exactPort.setdefault(portCond, DeviceRules()).add(deviceRule, rule)
+
+        self.ruleCount += 1
+
+
+# Helpers
+def helperDevpathComponents(usbPortId: str) -> Tuple[str, ...]:
+    # "1-1.2" -> ("1", "1", "2"); interfaces ("1-1.2:1.0") resolve to their device
+    devpath = usbPortId.split(":", 1)[0]
+    if not devpath:
+        return ()
+    busNum, _, ports = devpath.partition("-")
+    if not ports:
+        return (busNum,)
+    return (busNum, *ports.split("."))
+
+
+def helperDeviceRule(usbDeviceId: str | None) -> Tuple[str, str] | None:
+    if usbDeviceId is None or usbDeviceId == "*":
+        return None
+    vendor, _, product = usbDeviceId.partition(":")
+    if product == "*":
+        return ("vendor", vendor)
+    return ("exact", usbDeviceId)
@@ -0,0 +1,146 @@
+import bisect
+import os
+import tempfile
+import threading
+from typing import Dict, List, Tuple
+
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+METRIC_HELP: Dict[str, Tuple[str, str]] = {
+    "vusbpb_events_total": ("counter", "USB events received by the daemon"),
+    "vusbpb_matches_total": ("counter", "VM triggers produced by matching USB events"),
+    "vusbpb_starts_total": ("counter", "VMs started by the daemon"),
+    "vusbpb_start_failures_total": ("counter", "VM start attempts that failed"),
+    "vusbpb_start_refused_total": ("counter", "VM starts refused by admission control"),
+    "vusbpb_start_conflicts_total": (
+        "counter",
+        "qm start calls that found the VM already running or locked",
+    ),
+    "vusbpb_remote_triggers_total": ("counter", "Triggers for VMs owned by another cluster node"),
+    "vusbpb_netlink_overflows_total": (
+        "counter",
+        "udev monitor overflows (ENOBUFS) followed by a sysfs resync",
+    ),
+    "vusbpb_qm_exit_total": ("counter", "qm invocations by subcommand and exit code"),
+    "vusbpb_stage_duration_seconds": ("histogram", "Duration of each daemon pipeline stage"),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class HistogramState:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self) -> None:
+        self.counts: List[int] = [0] * len(LATENCY_BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], HistogramState] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name: str, labels: Dict[str, str] | None = None, value: float = 1.0) -> None:
+        key = (name, helperLabels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, name: str, seconds: float, labels: Dict[str, str] | None = None) -> None:
+        key = (name, helperLabels(labels))
+        idx = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self.lock:
+            state = self.histograms.get(key)
+            if state is None:
+                state = self.histograms[key] = HistogramState()
+            if idx < len(state.counts):
+                state.counts[idx] += 1
+            state.total += seconds
+            state.count += 1
+
+    def render(self) -> str:
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(
+                (key, (list(state.counts), state.total, state.count))
+                for key, state in self.histograms.items()
+            )
+
+        lines: List[str] = []
+        described = set()
+        for (name, labels), value in counters:
+            helperDescribe(name, described, lines)
+            lines.append(f"{name}{helperFormatLabels(labels)} {helperFormatValue(value)}")
+
+        for (name, labels), (counts, total, count) in histograms:
+            helperDescribe(name, described, lines)
+            cumulative = 0
+            for bound, bucketCount in zip(LATENCY_BUCKETS, counts):
+                cumulative += bucketCount
+                bucketLabels = labels + (("le", helperFormatValue(bound)),)
+                lines.append(f"{name}_bucket{helperFormatLabels(bucketLabels)} {cumulative}")
+            lines.append(f"{name}_bucket{helperFormatLabels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{helperFormatLabels(labels)} {helperFormatValue(total)}")
+            lines.append(f"{name}_count{helperFormatLabels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+    def writeTextfile(self, path: str) -> bool:
+        dirName = os.path.dirname(path) or "/"
+        # node_exporter not set up on this host
+        if not os.path.isdir(dirName):
+            return False
+
+        # node_exporter only reads *.prom, the temp name keeps half-written files invisible
+        fd, tmpPath = tempfile.mkstemp(prefix = ".vusbpb_", suffix = ".tmp", dir = dirName)
+        try:
+            with os.fdopen(fd, "w", encoding = "utf-8") as tmpFile:
+                tmpFile.write(self.render())
+            os.chmod(tmpPath, 0o644)
+            os.replace(tmpPath, path)
+        except OSError:
+            try:
+                os.unlink(tmpPath)
+            except OSError:
+                pass
+            raise
+        return True
+
+
+METRICS = MetricsRegistry()
+
+
+# Helpers
+def helperLabels(labels: Dict[str, str] | None) -> Labels:
+    if not labels:
+        return ()
+    return tuple(sorted(labels.items()))
+
+
+def helperFormatLabels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = value.replace("\\", "\\\\").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def helperFormatValue(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def helperDescribe(name: str, described: set, lines: List[str]) -> None:
+    if name in described:
+        return
+    described.add(name)
+    metricType, helpText = METRIC_HELP.get(name, ("untyped", name))
+    lines.append(f"# HELP {name} {helpText}")
+    lines.append(f"# TYPE {name} {metricType}")
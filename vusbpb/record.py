@@ -0,0 +1,52 @@
+import json
+import time
+from typing import Iterator, TextIO, Tuple
+
+from .uevent import UeventDevice
+
+RECORD_HEADER = "# vusbpb-record 1"
+
+
+class EventRecorder:
+    # One event per line: [seconds since start, action, sys_name, devtype, sys_path, {properties}]
+    def __init__(self, path: str) -> None:
+        # Line buffered: a capture stays usable when the daemon is killed mid-storm
+        self.file: TextIO = open(path, "w", encoding = "utf-8", buffering = 1)
+        self.startedAt = time.monotonic()
+        self.file.write(f"{RECORD_HEADER} started={time.time():.3f}\n")
+
+    def record(self, device, receivedAt: float) -> None:
+        entry = [
+            round(receivedAt - self.startedAt, 6),
+            device.action,
+            device.sys_name,
+            getattr(device, "device_type", None),
+            device.sys_path,
+            dict(device.properties),
+        ]
+        self.file.write(json.dumps(entry, separators = (",", ":")))
+        self.file.write("\n")
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def readRecording(path: str) -> Iterator[Tuple[float, UeventDevice]]:
+    with open(path, "r", encoding = "utf-8") as file:
+        header = file.readline()
+        if not header.startswith(RECORD_HEADER):
+            raise ValueError(f"{path} is not a vUSBPB event recording")
+        for lineNo, line in enumerate(file, start = 2):
+            if not line.strip() or line.startswith("#"):
+                continue
+            try:
+                offset, action, sysName, deviceType, sysPath, properties = json.loads(line)
+            except (TypeError, ValueError) as error:
+                raise ValueError(f"{path}:{lineNo}: malformed event: {error}") from error
+            yield float(offset), UeventDevice(
+                action = action,
+                sys_name = sysName,
+                sys_path = sysPath,
+                device_type = deviceType,
+                properties = properties,
+            )
@@ -1,7 +1,7 @@
 import os
 import subprocess
 
-from .config import CONFIG_PATH, saveConfig, loadConfig
+from .config import CONFIG_PATH, CONFIG_LOCK_SUFFIX, USB_HISTORY_PATH, saveConfig, loadConfig
 
 
 def install() -> int:
@@ -10,7 +10,7 @@ def install() -> int:
         return 1
 
     if not os.path.exists(CONFIG_PATH):
-        config = {"VMS": [], "USB": []}
+        config = {"VMS": []}
         try:
             saveConfig(config)
         except Exception as error:
@@ -71,6 +71,20 @@ def uninstall() -> int:
             print(f"ERROR: cannot remove config file: {error}")
             return 1
 
+    try:
+        os.remove(USB_HISTORY_PATH)
+    except FileNotFoundError:
+        pass
+    except OSError as error:
+        print(f"WARNING: cannot remove USB history file: {error}")
+
+    try:
+        os.remove(CONFIG_PATH + CONFIG_LOCK_SUFFIX)
+    except FileNotFoundError:
+        pass
+    except OSError as error:
+        print(f"WARNING: cannot remove config lock file: {error}")
+
     print("vUSBPB uninstalled. Service and config removed")
     return 0
 
@@ -83,21 +97,3 @@ def daemonRun(cmd: list[str], ignoreErrors: bool = False) -> bool:
         return True
     except Exception:
         return False if not ignoreErrors else True
-
-
-def daemonRestartIfInstalled() -> None:
-    if not os.path.exists("/etc/systemd/system/vusbpb.service"):
-        return
-
-    try:
-        isActive = subprocess.run(
-            ["systemctl", "is-active", "--quiet", "vusbpb.service"],
-            check = False,
-        )
-    except Exception:
-        return
-
-    if isActive.returncode != 0:
-        return
-
-    daemonRun(["systemctl", "restart", "vusbpb.service"], ignoreErrors = True)
\ No newline at end of file
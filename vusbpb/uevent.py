@@ -0,0 +1,141 @@
+import select
+import socket
+from dataclasses import dataclass
+from typing import Dict
+
+NETLINK_KOBJECT_UEVENT = 15
+# Group 1 carries the kernel's own uevents; udevd re-broadcasts on group 2 in libudev's format
+UEVENT_KERNEL_GROUP = 1
+SO_RCVBUFFORCE = 33
+SO_ATTACH_FILTER = 26
+SO_DETACH_FILTER = 27
+# The kernel caps one uevent at UEVENT_BUFFER_SIZE (2048) plus the "action@devpath" header
+RECEIVE_SIZE = 8192
+SYSFS_ROOT = "/sys"
+
+
+class UeventError(Exception):
+    pass
+
+
+@dataclass(slots = True)
+class UeventDevice:
+    # Named like the pyudev.Device attributes the daemon reads, so either source can feed it
+    action: str
+    sys_name: str
+    sys_path: str
+    device_type: str | None
+    properties: Dict[str, str]
+
+
+class UeventMonitor:
+    # The subset of pyudev.Monitor the daemon uses, on a plain NETLINK_KOBJECT_UEVENT socket
+    def __init__(self) -> None:
+        try:
+            self.sock = socket.socket(
+                socket.AF_NETLINK,
+                socket.SOCK_RAW | socket.SOCK_NONBLOCK | socket.SOCK_CLOEXEC,
+                NETLINK_KOBJECT_UEVENT,
+            )
+        except (OSError, AttributeError) as error:
+            raise UeventError(f"Can't open a uevent netlink socket: {error}") from error
+        self.subsystem: str | None = None
+        self.deviceType: str | None = None
+        # Set once a kernel-side filter drops events the daemon would see (remove, unmapped ports)
+        self.filtered = False
+
+    def filter_by(self, subsystem: str, device_type: str | None = None) -> None:
+        self.subsystem = subsystem
+        self.deviceType = device_type
+
+    def set_receive_buffer_size(self, size: int) -> None:
+        # Like libudev: SO_RCVBUFFORCE goes past rmem_max but needs CAP_NET_ADMIN
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, size)
+        except PermissionError:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+
+    def start(self) -> None:
+        try:
+            self.sock.bind((0, UEVENT_KERNEL_GROUP))
+        except OSError as error:
+            raise UeventError(f"Can't subscribe to kernel uevents: {error}") from error
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def attachFilter(self, packedProgram: bytes, instructionCount: int) -> None:
+        # struct sock_fprog holds a pointer, which only ctypes can hand to setsockopt
+        import ctypes
+
+        class SockFprog(ctypes.Structure):
+            _fields_ = [("len", ctypes.c_ushort), ("filter", ctypes.c_void_p)]
+
+        buffer = ctypes.create_string_buffer(packedProgram, len(packedProgram))
+        program = SockFprog(instructionCount, ctypes.addressof(buffer))
+        try:
+            # Replaces any previous filter atomically
+            self.sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, bytes(program))
+        except OSError as error:
+            raise UeventError(f"Can't attach uevent filter: {error}") from error
+        self.filtered = True
+
+    def detachFilter(self) -> None:
+        if not self.filtered:
+            return
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, SO_DETACH_FILTER, 0)
+        except OSError as error:
+            raise UeventError(f"Can't detach uevent filter: {error}") from error
+        self.filtered = False
+
+    def poll(self, timeout: float | None = None) -> UeventDevice | None:
+        # Next matching device, None once nothing more arrives within timeout (None waits forever)
+        while True:
+            if timeout != 0 and not select.select([self.sock], [], [], timeout)[0]:
+                return None
+            try:
+                data, (senderPid, _) = self.sock.recvfrom(RECEIVE_SIZE)
+            except BlockingIOError:
+                if timeout == 0:
+                    return None
+                continue
+            # Only the kernel (port 0) may send on this group; anything else is spoofed
+            if senderPid != 0:
+                continue
+            device = parseUevent(data)
+            if device is not None and self.helperWanted(device):
+                return device
+
+    def close(self) -> None:
+        self.sock.close()
+
+    def helperWanted(self, device: UeventDevice) -> bool:
+        if self.subsystem is not None and device.properties.get("SUBSYSTEM") != self.subsystem:
+            return False
+        return self.deviceType is None or device.device_type == self.deviceType
+
+
+def parseUevent(data: bytes) -> UeventDevice | None:
+    # "add@/devices/...\0ACTION=add\0DEVPATH=/devices/...\0SUBSYSTEM=usb\0..."
+    header, *fields = data.split(b"\0")
+    if b"@" not in header or header.startswith(b"libudev"):
+        return None
+
+    properties: Dict[str, str] = {}
+    for entry in fields:
+        key, sep, value = entry.partition(b"=")
+        if sep:
+            properties[key.decode("ascii", "replace")] = value.decode("utf-8", "replace")
+
+    action = properties.get("ACTION")
+    devpath = properties.get("DEVPATH")
+    if not action or not devpath:
+        return None
+    return UeventDevice(
+        action = action,
+        sys_name = devpath.rsplit("/", 1)[-1],
+        sys_path = SYSFS_ROOT + devpath,
+        device_type = properties.get("DEVTYPE"),
+        properties = properties,
+    )
@@ -0,0 +1,152 @@
+import os
+import struct
+from typing import Dict, Iterable, List, Tuple
+
+from .mappings import VmMapping
+from .usb import USB_SYSFS_PATH
+
+# Classic BPF, as in linux/filter.h
+BPF_LD_W_ABS = 0x20
+BPF_LD_H_ABS = 0x28
+BPF_LD_B_ABS = 0x30
+BPF_JEQ_K = 0x15
+BPF_JA = 0x05
+BPF_RET_K = 0x06
+BPF_MAXINSNS = 4096
+FILTER_ACCEPT = 0xFFFFFFFF
+FILTER_DROP = 0
+
+ADD_HEADER = b"add@"
+# tap/fwbr interfaces of every 'qm start', zvols, loop devices: never USB, never behind a controller
+VIRTUAL_PREFIX = b"/devices/virtual/"
+SOCK_FILTER = struct.Struct("HBBI")
+
+# (code, jt, jf, k)
+Instruction = Tuple[int, int, int, int]
+# controller header prefix -> suffixes that select mapped ports behind it
+FilterPatterns = Dict[bytes, List[bytes]]
+
+
+def buildFilterPatterns(
+    mappings: Iterable[VmMapping],
+    sysfsPath: str | None = None,
+) -> FilterPatterns | None:
+    # None when some mapping matches any port: only the action can be filtered then
+    busPorts: Dict[str, List[bytes]] = {}
+    for mapping in mappings:
+        if mapping.usbPortId is None or mapping.usbPortId == "*":
+            return None
+        busNum, suffix = helperPortSuffix(mapping.usbPortId)
+        busPorts.setdefault(busNum, []).append(suffix)
+
+    patterns: FilterPatterns = {}
+    for busNum, devpath in helperControllerDevpaths(sysfsPath or USB_SYSFS_PATH).items():
+        # A kernel uevent header is "add@" + devpath, and every device of bus N sits below usbN
+        prefix = f"{devpath}/".encode()
+        patterns[prefix] = sorted(set(busPorts.get(busNum, ())))
+    return patterns
+
+
+def compileFilter(patterns: FilterPatterns | None) -> List[Instruction]:
+    program: List[Instruction | Tuple[str, str]] = []
+    labels: Dict[str, int] = {}
+
+    helperEmitCompare(program, 0, ADD_HEADER, "drop")
+    if patterns:
+        offset = len(ADD_HEADER)
+        for idx, (prefix, suffixes) in enumerate(sorted(patterns.items())):
+            nextBus = f"bus{idx + 1}"
+            helperEmitCompare(program, offset, prefix, nextBus)
+            for suffixIdx, suffix in enumerate(suffixes):
+                nextSuffix = f"bus{idx}.{suffixIdx + 1}"
+                helperEmitCompare(program, offset + len(prefix), suffix, nextSuffix)
+                program.append((BPF_RET_K, 0, 0, FILTER_ACCEPT))
+                labels[nextSuffix] = len(program)
+            # A known controller, but none of the mapped ports
+            program.append((BPF_RET_K, 0, 0, FILTER_DROP))
+            labels[nextBus] = len(program)
+    helperEmitCompare(program, len(ADD_HEADER), VIRTUAL_PREFIX, "unknown")
+    program.append((BPF_RET_K, 0, 0, FILTER_DROP))
+    labels["unknown"] = len(program)
+    # Controllers that appeared after compiling (a dock's xHCI, renumbered buses) are let through
+    program.append((BPF_RET_K, 0, 0, FILTER_ACCEPT))
+    labels["drop"] = len(program)
+    program.append((BPF_RET_K, 0, 0, FILTER_DROP))
+
+    resolved: List[Instruction] = []
+    for position, instruction in enumerate(program):
+        if isinstance(instruction[0], str):
+            # Jump offsets count from the next instruction
+            resolved.append((BPF_JA, 0, 0, labels[instruction[1]] - position - 1))
+        else:
+            resolved.append(instruction)
+    return resolved
+
+
+def packFilter(program: List[Instruction]) -> bytes:
+    return b"".join(SOCK_FILTER.pack(*instruction) for instruction in program)
+
+
+def compileMappingsFilter(
+    mappings: Iterable[VmMapping],
+    sysfsPath: str | None = None,
+) -> Tuple[List[Instruction], FilterPatterns | None]:
+    patterns = buildFilterPatterns(mappings, sysfsPath)
+    program = compileFilter(patterns)
+    if len(program) > BPF_MAXINSNS:
+        # Too many ports for one program; the action check alone still cuts most of the churn
+        patterns = None
+        program = compileFilter(None)
+    return program, patterns
+
+
+# Helpers
+def helperEmitCompare(program: list, offset: int, expected: bytes, mismatch: str) -> None:
+    # Widest loads first; a packet too short for a load makes the kernel drop it, which is right
+    position = 0
+    while position < len(expected):
+        size = 4 if len(expected) - position >= 4 else (2 if len(expected) - position >= 2 else 1)
+        loadCode = {4: BPF_LD_W_ABS, 2: BPF_LD_H_ABS, 1: BPF_LD_B_ABS}[size]
+        value = int.from_bytes(expected[position:position + size], "big")
+        program.append((loadCode, 0, 0, offset + position))
+        # Equal skips the jump; jt/jf only reach 255 instructions ahead, 'ja' reaches anywhere
+        program.append((BPF_JEQ_K, 1, 0, value))
+        program.append(("ja", mismatch))
+        position += size
+
+
+def helperPortSuffix(usbPortId: str) -> Tuple[str, bytes]:
+    # "1-1.2" -> ("1", b"1-1/1-1.2\0"), "1-1.*" -> ("1", b"1-1/1-1."), "1-*" -> ("1", b"1-")
+    devpath = usbPortId.split(":", 1)[0]
+    busNum, _, ports = devpath.partition("-")
+    subtree = ports.endswith("*")
+    components = ports.rstrip("*").rstrip(".").split(".") if ports.rstrip("*") else []
+
+    chain = [f"{busNum}-{'.'.join(components[:depth])}" for depth in range(1, len(components) + 1)]
+    if not subtree:
+        return busNum, ("/".join(chain) + "\0").encode()
+    if not chain:
+        return busNum, f"{busNum}-".encode()
+    return busNum, ("/".join(chain) + "/" + chain[-1] + ".").encode()
+
+
+def helperControllerDevpaths(sysfsPath: str) -> Dict[str, str]:
+    # bus number -> devpath of its root hub, e.g. "1" -> "/devices/pci0000:00/0000:00:14.0/usb1"
+    devpaths: Dict[str, str] = {}
+    try:
+        entries = [entry.name for entry in os.scandir(sysfsPath) if entry.name.startswith("usb")]
+    except OSError:
+        return devpaths
+
+    for entryUSB in entries:
+        busNum = entryUSB[3:]
+        if not busNum.isdigit():
+            continue
+        try:
+            target = os.readlink(os.path.join(sysfsPath, entryUSB))
+        except OSError:
+            continue
+        marker = target.find("/devices/")
+        if marker >= 0:
+            devpaths[busNum] = target[marker:]
+    return devpaths
@@ -1,9 +1,14 @@
 import os
-from dataclasses import dataclass
-from typing import List
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Mapping, Tuple
 
-from .config import loadConfig, saveConfig, getUSBHistory, setUSBHistory, ConfigError
-from .drawtree import TreeNode, renderTree
+from .config import loadUSBHistory, saveUSBHistory, ConfigError
+from .drawtree import TreeNode, writeTree, writeJson, paint, fieldLabel, GREEN, NEW_BADGE
+
+USB_SYSFS_PATH = "/sys/bus/usb/devices"
 
 
 @dataclass
@@ -14,105 +19,160 @@ class UsbPortInfo:
     usbDescription: str
 
 
+class UsbInventory:
+    def __init__(self) -> None:
+        self.ports: Dict[str, UsbPortInfo] = {}
+        # port -> (BUSNUM, DEVNUM); a replugged device always gets a new DEVNUM
+        self.keys: Dict[str, Tuple[str, str]] = {}
+        self.lock = threading.Lock()
+
+    def scan(self) -> List[UsbPortInfo]:
+        try:
+            entries = sorted(entry.name for entry in os.scandir(USB_SYSFS_PATH))
+        except OSError:
+            entries = []
+
+        ports: Dict[str, UsbPortInfo] = {}
+        keys: Dict[str, Tuple[str, str]] = {}
+        for entryUSB in entries:
+            if not helperIsPortEntry(entryUSB):
+                continue
+
+            entryPath = os.path.join(USB_SYSFS_PATH, entryUSB)
+            properties = helperReadUevent(os.path.join(entryPath, "uevent"))
+            if properties is None:
+                continue
+
+            key = (properties.get("BUSNUM", ""), properties.get("DEVNUM", ""))
+            with self.lock:
+                cached = self.ports.get(entryUSB) if self.keys.get(entryUSB) == key else None
+            if cached is None:
+                cached = helperBuildPortInfo(entryUSB, entryPath, properties)
+
+            ports[entryUSB] = cached
+            keys[entryUSB] = key
+
+        with self.lock:
+            self.ports = ports
+            self.keys = keys
+        return list(ports.values())
+
+    def applyEvent(
+        self,
+        usbAction: str,
+        usbPortId: str,
+        properties: Mapping[str, str],
+        sysPath: str,
+    ) -> None:
+        if not helperIsPortEntry(usbPortId):
+            return
+
+        with self.lock:
+            if usbAction == "remove":
+                self.ports.pop(usbPortId, None)
+                self.keys.pop(usbPortId, None)
+                return
+
+        if usbAction != "add":
+            return
+        portInfo = helperBuildPortInfo(usbPortId, sysPath, properties)
+        with self.lock:
+            self.ports[usbPortId] = portInfo
+            self.keys[usbPortId] = (properties.get("BUSNUM", ""), properties.get("DEVNUM", ""))
+
+    def resync(self) -> List[UsbPortInfo]:
+        # Devices plugged since the last known state: new ports or replugged ones (new DEVNUM)
+        with self.lock:
+            knownKeys = dict(self.keys)
+        self.scan()
+        with self.lock:
+            return [
+                self.ports[port]
+                for port in sorted(self.keys)
+                if self.keys[port] != knownKeys.get(port) and self.ports[port].usbIsConnected
+            ]
+
+    def snapshot(self) -> List[UsbPortInfo]:
+        with self.lock:
+            return [self.ports[port] for port in sorted(self.ports)]
+
+
+USB_INVENTORY = UsbInventory()
+
+
 def scanUSBPorts() -> List[UsbPortInfo]:
-    allPorts: List[UsbPortInfo] = []
-
-    if not os.path.isdir("/sys/bus/usb/devices"):
-        return allPorts
-
-    for entryUSB in sorted(os.listdir("/sys/bus/usb/devices")):
-        entryPath = os.path.join("/sys/bus/usb/devices", entryUSB)
-        if not os.path.isdir(entryPath):
-            continue
-
-        # Remove hubs, interfaces etc.
-        if entryUSB.startswith("usb"):
-            continue
-        if ":" in entryUSB:
-            continue
-        if entryUSB.endswith(".0"):
-            continue
-
-        usbPortId = entryUSB
-        usbIdVendor = helperReadFile(os.path.join(entryPath, "idVendor"))
-        usbIdProduct = helperReadFile(os.path.join(entryPath, "idProduct"))
-        usbIsConnected = usbIdVendor is not None and usbIdProduct is not None
-
-        if usbIsConnected:
-            usbDeviceId = f"{usbIdVendor}:{usbIdProduct}"
-            usbProduct = helperReadFile(os.path.join(entryPath, "product")) or ""
-            usbManufacturer = helperReadFile(os.path.join(entryPath, "manufacturer")) or ""
-            __tmpUsbDesc = [p for p in [usbManufacturer, usbProduct] if p]
-            usbDescription = " ".join(__tmpUsbDesc) if __tmpUsbDesc else "Unknown device"
-        else:
-            usbDeviceId = "none"
-            usbDescription = ""
-
-        allPorts.append(
-            UsbPortInfo(
-                usbPortId = usbPortId,
-                usbIsConnected = usbIsConnected,
-                usbDeviceId = usbDeviceId,
-                usbDescription = usbDescription,
-            )
-        )
-    return allPorts
+    return USB_INVENTORY.scan()
 
 
-def showUSB() -> int:
-    try:
-        config = loadConfig(allow_missing = True)
-        usbPrevious = set(getUSBHistory(config))
-    except ConfigError as error:
-        usbPrevious = set()
-        print(f"WARNING: Cannot load config! {error}")
+def usbDeviceIdFromProperties(properties: Mapping[str, str]) -> str | None:
+    usbIdVendor = properties.get("ID_VENDOR_ID")
+    usbIdProduct = properties.get("ID_MODEL_ID")
+    if usbIdVendor and usbIdProduct:
+        return f"{usbIdVendor}:{usbIdProduct}".lower()
 
-    usbPorts = scanUSBPorts()
-    currentConnected = {usbPort.usbPortId for usbPort in usbPorts if usbPort.usbIsConnected}
+    # Raw kernel uevents only carry PRODUCT=vendor/product/bcdDevice, unpadded hex
+    usbProductKey = properties.get("PRODUCT")
+    if usbProductKey:
+        parts = usbProductKey.split("/")
+        if len(parts) >= 2 and parts[0] and parts[1]:
+            return f"{parts[0].zfill(4)}:{parts[1].zfill(4)}".lower()
 
-    if not usbPorts:
-        print("No USB ports found under /sys/bus/usb/devices")
+    return None
+
+
+def readUsbDeviceId(sysPath: str, waitTimeout: float = 0.0) -> str | None:
+    deadline = time.monotonic() + waitTimeout
+    while True:
+        usbDeviceId = helperReadDescriptorId(sysPath)
+        if usbDeviceId or time.monotonic() >= deadline:
+            return usbDeviceId
+        time.sleep(0.02)
+
+
+async def readUsbDeviceIdAsync(sysPath: str, waitTimeout: float = 0.0) -> str | None:
+    # Same wait as readUsbDeviceId, but other events keep flowing on the daemon's loop meanwhile
+    import asyncio
+
+    deadline = time.monotonic() + waitTimeout
+    while True:
+        usbDeviceId = helperReadDescriptorId(sysPath)
+        if usbDeviceId or time.monotonic() >= deadline:
+            return usbDeviceId
+        await asyncio.sleep(0.02)
+
+
+def showUSB(usbPorts: List[UsbPortInfo] | None = None, outputFormat: str = "tree") -> int:
+    usbHistory = loadUSBHistory()
+    usbPrevious = set(usbHistory)
+
+    if usbPorts is None:
+        usbPorts = scanUSBPorts()
+
+    if outputFormat == "json":
+        # For scripts polling the inventory: no tree, and the NEW-marker history stays untouched
+        writeJson([
+            {
+                **asdict(usbPort),
+                "usbIsNew": usbPort.usbIsConnected and usbPort.usbPortId not in usbPrevious,
+            }
+            for usbPort in usbPorts
+        ])
         return 0
 
-    nodes: List[TreeNode] = []
-    for usbPort in usbPorts:
-        connected_str = "Yes" if usbPort.usbIsConnected else "No"
-        isNewConnected = usbPort.usbIsConnected and (usbPort.usbPortId not in usbPrevious)
-
-        usbDescription = usbPort.usbDescription or ""
-        usbDeviceId = usbPort.usbDeviceId or "none"
-
-        usbPortLabel = f"\033[38;5;82mUSB port: \033[38;5;15m{usbPort.usbPortId}\033[0m"
-        if isNewConnected:
-            usbPortLabel += "  \033[5;48;5;196;38;5;15m ← NEW \033[0m"
-
-        children = [
-            TreeNode(
-                label = f"\033[38;5;82mConnected: \033[38;5;15m{connected_str}\033[0m"
-            ),
-            TreeNode(
-                label = f"\033[38;5;82mDevice ID: \033[38;5;15m{usbDeviceId}\033[0m"
-            ),
-        ]
-
-        if usbDescription:
-            children.append(TreeNode(
-                label = f"\033[38;5;82mDescription: \033[38;5;15m{usbDescription}\033[0m"
-            ))
-
-        nodes.append(TreeNode(
-            label = usbPortLabel,
-            children = children
-        ))
+    if not usbPorts:
+        print(f"No USB ports found under {USB_SYSFS_PATH}")
+        return 0
 
+    currentConnected = [usbPort.usbPortId for usbPort in usbPorts if usbPort.usbIsConnected]
     try:
-        config = loadConfig(allow_missing = True)
-        config = setUSBHistory(config, sorted(currentConnected))
-        saveConfig(config)
+        saveUSBHistory(currentConnected, usbHistory)
     except ConfigError as error:
-        print(f"WARNING: cannot update USB history in config: {error}")
+        print(f"WARNING: cannot update USB history: {error}", file = sys.stderr)
 
-    print(renderTree("\033[38;5;28mUSB ports\033[0m", nodes))
+    writeTree(
+        paint("USB ports", GREEN),
+        (helperUsbNode(usbPort, usbPrevious) for usbPort in usbPorts),
+    )
     return 0
 
 
@@ -122,4 +182,88 @@ def helperReadFile(path: str) -> str | None:
         with open(path, "r", encoding = "utf-8", errors = "ignore") as file:
             return file.read().strip()
     except OSError:
-        return None
\ No newline at end of file
+        return None
+
+
+def helperReadDescriptorId(sysPath: str) -> str | None:
+    usbIdVendor = helperReadFile(os.path.join(sysPath, "idVendor"))
+    usbIdProduct = helperReadFile(os.path.join(sysPath, "idProduct"))
+    if usbIdVendor and usbIdProduct:
+        return f"{usbIdVendor}:{usbIdProduct}"
+    return None
+
+
+def helperUsbNode(usbPort: UsbPortInfo, usbPrevious: set) -> TreeNode:
+    connected_str = "Yes" if usbPort.usbIsConnected else "No"
+    isNewConnected = usbPort.usbIsConnected and (usbPort.usbPortId not in usbPrevious)
+
+    usbDescription = usbPort.usbDescription or ""
+    usbDeviceId = usbPort.usbDeviceId or "none"
+
+    usbPortLabel = fieldLabel("USB port", usbPort.usbPortId)
+    if isNewConnected:
+        usbPortLabel += "  " + paint(" ← NEW ", NEW_BADGE)
+
+    children = [
+        TreeNode(label = fieldLabel("Connected", connected_str)),
+        TreeNode(label = fieldLabel("Device ID", usbDeviceId)),
+    ]
+
+    if usbDescription:
+        children.append(TreeNode(label = fieldLabel("Description", usbDescription)))
+
+    return TreeNode(label = usbPortLabel, children = children)
+
+
+def helperIsPortEntry(entryUSB: str) -> bool:
+    # Remove hubs, interfaces etc.
+    if entryUSB.startswith("usb"):
+        return False
+    if ":" in entryUSB:
+        return False
+    if entryUSB.endswith(".0"):
+        return False
+    return True
+
+
+def helperReadUevent(path: str) -> Dict[str, str] | None:
+    try:
+        with open(path, "r", encoding = "utf-8", errors = "ignore") as file:
+            data = file.read()
+    except OSError:
+        return None
+
+    properties: Dict[str, str] = {}
+    for line in data.splitlines():
+        key, sep, value = line.partition("=")
+        if sep:
+            properties[key] = value
+    return properties
+
+
+def helperBuildPortInfo(
+    usbPortId: str,
+    entryPath: str,
+    properties: Mapping[str, str],
+) -> UsbPortInfo:
+    usbDeviceId = usbDeviceIdFromProperties(properties)
+    if usbDeviceId is None:
+        return UsbPortInfo(
+            usbPortId = usbPortId,
+            usbIsConnected = False,
+            usbDeviceId = "none",
+            usbDescription = "",
+        )
+
+    # Descriptor strings are not part of uevent; read once per plugged device
+    usbProduct = helperReadFile(os.path.join(entryPath, "product")) or ""
+    usbManufacturer = helperReadFile(os.path.join(entryPath, "manufacturer")) or ""
+    __tmpUsbDesc = [p for p in [usbManufacturer, usbProduct] if p]
+    usbDescription = " ".join(__tmpUsbDesc) if __tmpUsbDesc else "Unknown device"
+
+    return UsbPortInfo(
+        usbPortId = usbPortId,
+        usbIsConnected = True,
+        usbDeviceId = usbDeviceId,
+        usbDescription = usbDescription,
+    )
@@ -1,8 +1,30 @@
+import errno
+import json
+import os
 import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
 from enum import Enum, auto
-from typing import Dict, Any, List
-from .config import (loadConfig, saveConfig, getVmMappings, setVmMappings, ConfigError)
-from .drawtree import TreeNode, renderTree
+from typing import Callable, Dict, Any, List, Tuple
+from .config import (loadConfig, saveConfig, getVmMappings, setVmMappings, lockConfig, ConfigError)
+from .drawtree import TreeNode, writeTree, writeJson, paint, fieldLabel, GREEN, LIGHT_GREEN
+from .metrics import METRICS
+from .cluster import VM_LOCATIONS, PVE_NODES_DIR
+from .mappings import VmMapping, normalizeMappings, loadMappings, mappingsToConfig
+from .inotify import (Inotify, InotifyError, IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_MODIFY,
+    IN_MOVED_FROM, IN_MOVED_TO, IN_Q_OVERFLOW, IN_IGNORED, IN_DELETE_SELF, IN_MOVE_SELF, IN_ONLYDIR)
+
+QM_COMMAND = "qm"
+PVESH_COMMAND = "pvesh"
+QEMU_RUN_DIR = "/var/run/qemu-server"
+PVE_QEMU_CONF_DIR = "/etc/pve/qemu-server"
+INVENTORY_CACHE_PATH = "/run/vusbpb/inventory.json"
+INVENTORY_CACHE_TTL = 2.0
+INVENTORY_QM_WORKERS = 8
+PVE_DEFAULT_MEMORY_MB = 512
 
 
 class VmStatus(Enum):
@@ -11,15 +33,24 @@ class VmStatus(Enum):
     UNKNOWN = auto()
 
 
+class StartOutcome(Enum):
+    STARTED = auto()
+    ALREADY_RUNNING = auto()
+    LOCKED = auto()
+    FAILED = auto()
+
+
+@dataclass
+class VmInfo:
+    vmId: int
+    name: str
+    status: VmStatus
+    node: str = ""
+
+
 def getAllVMs() -> List[Dict[str, str]]:
-    try:
-        result = subprocess.run(
-            ["qm", "list"],
-            text = True,
-            capture_output = True,
-            check = False,
-        )
-    except OSError:
+    result = helperRunQm(["list"])
+    if result is None:
         return []
     if result.returncode != 0:
         return []
@@ -52,225 +83,730 @@ def getAllVMs() -> List[Dict[str, str]]:
 
 
 def getVMStatus(vmId: int) -> VmStatus:
-    try:
-        result = subprocess.run(
-            ["qm", "status", str(vmId)],
-            text = True,
-            capture_output = True,
-            check = False,
-        )
-    except OSError:
-        return VmStatus.UNKNOWN
-    if result.returncode != 0:
-        return VmStatus.UNKNOWN
+    return helperParseQmStatus(helperRunQm(["status", str(vmId)]))
 
-    for line in result.stdout.splitlines():
-        line = line.strip().lower()
-        if line.startswith("status:"):
-            mvStatus = line.split(":", 1)[1].strip()
-            if mvStatus == "running":
-                return VmStatus.RUNNING
-            if mvStatus == "stopped":
-                return VmStatus.STOPPED
-            return VmStatus.UNKNOWN
 
-    return VmStatus.UNKNOWN
+async def getVMStatusAsync(vmId: int) -> VmStatus:
+    result = await helperRunCommandAsync([QM_COMMAND, "status", str(vmId)], "status")
+    return helperParseQmStatus(result)
+
+
+def getVMStatusFromPidFile(vmId: int) -> VmStatus:
+    pid = helperReadQemuPid(vmId)
+    if pid is None:
+        return VmStatus.UNKNOWN
+    if pid == 0:
+        return VmStatus.STOPPED
+    return VmStatus.RUNNING if helperIsPidAlive(pid) else VmStatus.STOPPED
+
+
+class VmStatusTable:
+    def __init__(self, runDir: str | None = None) -> None:
+        self.runDir = runDir or QEMU_RUN_DIR
+        # vmId -> (qemu pid, its start time), the pair a recycled pid can't match
+        self.pids: Dict[int, Tuple[int, int | None]] = {}
+        self.lock = threading.Lock()
+        self.inotify: Inotify | None = None
+        self.watchId: int | None = None
+
+        try:
+            self.inotify = Inotify()
+        except InotifyError:
+            self.inotify = None
+        self.helperEnsureWatch()
+
+    def status(self, vmId: int) -> VmStatus:
+        vmStatus = self.cachedStatus(vmId)
+        return vmStatus if vmStatus is not None else getVMStatus(vmId)
+
+    async def statusAsync(self, vmId: int) -> VmStatus:
+        vmStatus = self.cachedStatus(vmId)
+        return vmStatus if vmStatus is not None else await getVMStatusAsync(vmId)
+
+    def cachedStatus(self, vmId: int) -> VmStatus | None:
+        # Pid files only, never forks; None when only 'qm status' could tell
+        with self.lock:
+            self.helperDrainEvents()
+
+            entry = self.pids.get(vmId)
+            if entry is None:
+                pid = helperReadQemuPid(vmId, self.runDir)
+                if pid is None:
+                    return None
+                entry = (pid, helperReadPidStartTime(pid) if pid else None)
+                # Only cache while inotify keeps the entry honest
+                if self.watchId is not None:
+                    self.pids[vmId] = entry
+
+        pid, startTime = entry
+        if pid == 0:
+            return VmStatus.STOPPED
+        # qemu may die without its pid file changing; a pid reused since then started later
+        if startTime is None or helperReadPidStartTime(pid) != startTime:
+            return VmStatus.STOPPED
+        return VmStatus.RUNNING
+
+    def close(self) -> None:
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+            self.watchId = None
+
+    def helperEnsureWatch(self) -> None:
+        if self.inotify is None or self.watchId is not None:
+            return
+        try:
+            self.watchId = self.inotify.addWatch(
+                self.runDir,
+                IN_CREATE | IN_DELETE | IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+                    | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR,
+            )
+        except InotifyError:
+            self.watchId = None
+
+    def helperDrainEvents(self) -> None:
+        if self.inotify is None:
+            return
+        if self.watchId is None:
+            self.helperEnsureWatch()
+            self.pids.clear()
+            return
+
+        for _, mask, name in self.inotify.readEvents():
+            if mask & (IN_Q_OVERFLOW | IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                self.pids.clear()
+                if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                    self.watchId = None
+                continue
+            vmIdText, _, suffix = name.partition(".")
+            if suffix == "pid" and vmIdText.isdigit():
+                self.pids.pop(int(vmIdText), None)
+
+
+def collectVMInventory(useCache: bool = True) -> Dict[int, VmInfo]:
+    if useCache:
+        cached = helperReadInventoryCache()
+        if cached is not None:
+            return cached
+
+    inventory = helperInventoryFromPveConfigs()
+    if inventory is None:
+        # No access to the cluster filesystem, a single 'qm list' still covers every VM
+        inventory = {}
+        for vm in getAllVMs():
+            vmId = helperSafeInt(vm.get("vmId"))
+            if vmId is not None:
+                vmStatus = helperParseStatus(vm.get("status"))
+                inventory[vmId] = VmInfo(vmId, vm.get("name", ""), vmStatus)
+
+    helperWriteInventoryCache(inventory)
+    return inventory
+
+
+def getVMMemoryMb(vmId: int) -> int:
+    # "memory: 4096" or, on newer PVE, "memory: current=4096"
+    value = helperReadVMConfigValue(vmId, "memory")
+    if value is not None:
+        for option in value.split(","):
+            memoryMb = helperSafeInt(option.partition("=")[2] if "=" in option else option)
+            if memoryMb is not None:
+                return memoryMb
+    return PVE_DEFAULT_MEMORY_MB
 
 
 def startVM(vmId: int) -> bool:
-    try:
-        result = subprocess.run(
-            ["qm", "start", str(vmId)],
-            text = True,
-            capture_output = True,
-            check = False,
-        )
-    except OSError:
+    result = helperRunQm(["start", str(vmId)])
+    if result is None:
         return False
 
     return result.returncode == 0
 
 
-def showVMFromSystem() -> int:
+async def startVMAsync(vmId: int) -> Tuple[StartOutcome, str]:
+    # (outcome, last line of qm's stderr for the log)
+    result = await helperRunCommandAsync([QM_COMMAND, "start", str(vmId)], "start")
+    return classifyStartResult(result)
+
+
+def classifyStartResult(result: subprocess.CompletedProcess | None) -> Tuple[StartOutcome, str]:
+    if result is None:
+        return StartOutcome.FAILED, f"can't run {QM_COMMAND}"
+    errorLines = [line.strip() for line in (result.stderr or "").splitlines() if line.strip()]
+    detail = errorLines[-1] if errorLines else ""
+    if result.returncode == 0:
+        return StartOutcome.STARTED, detail
+
+    # qm exits with 255 for all of these, only its message tells them apart
+    message = "\n".join(errorLines).lower()
+    if "already running" in message:
+        return StartOutcome.ALREADY_RUNNING, detail
+    # "can't lock file '/var/lock/qemu-server/lock-100.conf' - got timeout",
+    # or "VM is locked (backup)"
+    if "can't lock file" in message or "vm is locked" in message:
+        return StartOutcome.LOCKED, detail
+    return StartOutcome.FAILED, detail or f"exit code {result.returncode}"
+
+
+async def startRemoteVMAsync(vmId: int, node: str) -> bool:
+    # 'qm' only manages local guests; the API proxies the start to the owning node
+    result = await helperRunCommandAsync(
+        [PVESH_COMMAND, "create", f"/nodes/{node}/qemu/{vmId}/status/start"],
+        "pvesh-start",
+    )
+    return result is not None and result.returncode == 0
+
+
+def showVMFromSystem(outputFormat: str = "tree") -> int:
     try:
-        config = loadConfig(allow_missing = True)
+        mappings = loadMappings(loadConfig(allow_missing = True))
     except ConfigError as error:
         print(f"ERROR: Cannot load config: {error}")
         return 1
 
-    vmIdToMapping: Dict[int, Dict[str, Any]] = {}
-    for mapping in getVmMappings(config):
-        vmId = helperSafeInt(mapping.get("vmId"))
-        if vmId is None:
-            continue
-        vmIdToMapping[vmId] = mapping
+    vmIdToMapping = {mapping.vmId: mapping for mapping in mappings}
 
-    vms = getAllVMs()
-    if not vms:
-        print("No virtual machines found")
+    inventory = collectVMInventory()
+    if outputFormat == "json":
+        writeJson([
+            helperVMRecord(inventory[vmId], vmIdToMapping.get(vmId))
+            for vmId in sorted(inventory)
+        ])
         return 0
 
-    nodes: List[TreeNode] = []
-    for vm in vms:
-        vmId = helperSafeInt(vm.get("vmId"))
-        if vmId is None:
-            continue
+    if not inventory:
+        print("No virtual machines found")
+        return 0
 
-        vmName = vm.get("name", "")
-        vmStatus = vm.get("status", "unknown")
+    writeTree(
+        paint("Virtual Machine(s)", GREEN),
+        (helperVMNode(inventory[vmId], vmIdToMapping.get(vmId)) for vmId in sorted(inventory)),
+    )
+    return 0
 
-        mapping = vmIdToMapping.get(vmId)
-        if not mapping:
-            usbInfo = "<none>"
-        else:
-            mPort = mapping.get("usbPortId")
-            mDev  = mapping.get("usbDeviceId")
 
-            if not mPort and not mDev:
-                usbInfo = "<none>"
-            else:
-                portDisplay = mPort or "<any port>"
-                devDisplay  = mDev or "<any device>"
-                usbInfo = f"{portDisplay} (device {devDisplay})"
-
-        nodes.append(
-            TreeNode(
-                label = f"\033[38;5;82mVM ID: \033[38;5;15m{vmId}\033[0m",
-                children = [
-                    TreeNode(label = f"\033[38;5;82mName: \033[38;5;15m{vmName}\033[0m"),
-                    TreeNode(label = f"\033[38;5;82mStatus: \033[38;5;15m{vmStatus}\033[0m"),
-                    TreeNode(label = f"\033[38;5;82mUSB trigger: \033[38;5;15m{usbInfo}\033[0m"),
-                ],
-            )
-        )
+def collectPowerButtons(
+    mappings: List[VmMapping],
+    statusOf: Callable[[int], VmStatus] | None = None,
+    nodeOf: Callable[[int], str | None] | None = None,
+) -> List[Dict[str, Any]]:
+    if statusOf is None and mappings:
+        inventory = collectVMInventory()
+        statusOf = lambda vmId: inventory[vmId].status if vmId in inventory else VmStatus.UNKNOWN
+        nodeOf = nodeOf or (lambda vmId: inventory[vmId].node if vmId in inventory else None)
+
+    rows: List[Dict[str, Any]] = []
+    for mapping in mappings:
+        rows.append({
+            "vmId": mapping.vmId,
+            "usbPortId": mapping.usbPortId,
+            "usbDeviceId": mapping.usbDeviceId,
+            "status": helperStatusText(statusOf(mapping.vmId)),
+            "node": (nodeOf(mapping.vmId) if nodeOf is not None else None) or None,
+        })
+    return rows
 
-    print(renderTree("\033[38;5;28mVirtual Machine(s)\033[0m", nodes))
-    return 0
 
+def listVMPowerButton(rows: List[Dict[str, Any]] | None = None, outputFormat: str = "tree") -> int:
+    if rows is None:
+        try:
+            mappings = loadMappings(loadConfig(allow_missing = True))
+        except ConfigError as error:
+            print(f"ERROR: Cannot load config: {error}")
+            return 1
+        rows = collectPowerButtons(mappings)
 
-def listVMPowerButton() -> int:
-    try:
-        config = loadConfig(allow_missing = True)
-    except ConfigError as error:
-        print(f"ERROR: Cannot load config: {error}")
-        return 1
+    if outputFormat == "json":
+        writeJson(rows)
+        return 0
 
-    mappings = getVmMappings(config)
-    if not mappings:
+    if not rows:
         print("No VM USB Power Button configured")
         return 0
 
-    statusMap = {
-        VmStatus.RUNNING: "running",
-        VmStatus.STOPPED: "stopped",
-        VmStatus.UNKNOWN: "unknown",
-    }
+    writeTree(
+        paint("VM with USB Power Buttons", GREEN),
+        (helperPowerButtonNode(row) for row in rows),
+    )
+    return 0
 
-    nodes: List[TreeNode] = []
-    for m in mappings:
-        vmId = helperSafeInt(m.get("vmId"))
-        if vmId is None:
-            continue
 
-        vmUSBPort = m.get("usbPortId")
-        vmUSBDevice = m.get("usbDeviceId")
-
-        if not (vmUSBPort or vmUSBDevice):
-            portDisplay = "<none>"
-            devDisplay = "<none>"
-        else:
-            portDisplay = vmUSBPort or "<any>"
-            devDisplay = vmUSBDevice or "<any>"
-
-        vmStatus = statusMap.get(getVMStatus(vmId), "unknown")
-
-        nodes.append(
-            TreeNode(
-                label = f"\033[38;5;28mVM ID: \033[38;5;15m{vmId}\033[0m",
-                children = [
-                    TreeNode(label = f"\033[38;5;28mStatus: \033[38;5;15m{vmStatus}\033[0m"),
-                    TreeNode(label = f"\033[38;5;28mUSB port: \033[38;5;15m{portDisplay}\033[0m"),
-                    TreeNode(label = f"\033[38;5;28mUSB device: \033[38;5;15m{devDisplay}\033[0m"),
-                ],
-            )
-        )
+def addVMPowerButton(
+    vmId: int,
+    vmUSBPort: str | None,
+    vmUSBDevice: str | None,
+    priority: int = 0,
+    optimisticStart: bool = False,
+) -> int:
+    result, message = addMapping(vmId, vmUSBPort, vmUSBDevice, priority, optimisticStart)
+    print(message)
+    return result
 
-    print(renderTree("\033[38;5;28mVM with USB Power Buttons\033[0m", nodes))
-    return 0
 
+def deleteVMPowerButton(vmIds: List[int]) -> int:
+    result, message = deleteMapping(vmIds)
+    print(message)
+    return result
 
-def addVMPowerButton(vmId: int, vmUSBPort: str | None, vmUSBDevice: str | None) -> int:
-    try:
-        config = loadConfig(allow_missing = True)
-    except ConfigError as error:
-        print(f"ERROR: Cannot load config: {error}")
-        return 1
 
-    if not vmUSBPort and not vmUSBDevice:
-        print("ERROR: You must provide --usbport and/or --usbdevice")
-        return 1
+def importVMPowerButtons(path: str, replace: bool = False) -> int:
+    result, message = importMappings(path, replace)
+    print(message)
+    return result
 
-    mappings: List[Dict[str, Any]] = getVmMappings(config)
-    for m in mappings:
-        if int(m.get("vmId", -1)) == vmId:
-            print(f"ERROR: VM ID {vmId} is already configured. Use --delete {vmId} first")
-            return 1
 
-    newMapping: Dict[str, Any] = {"vmId": vmId}
-    if vmUSBPort:
-        newMapping["usbPortId"] = vmUSBPort
-    if vmUSBDevice:
-        newMapping["usbDeviceId"] = vmUSBDevice
+def exportVMPowerButtons(path: str) -> int:
+    result, message = exportMappings(path)
+    if message:
+        print(message, file = sys.stderr if path == "-" else sys.stdout)
+    return result
+
 
-    mappings.append(newMapping)
-    config = setVmMappings(config, mappings)
+def addMapping(
+    vmId: int,
+    vmUSBPort: str | None,
+    vmUSBDevice: str | None,
+    priority: int = 0,
+    optimisticStart: bool = False,
+) -> Tuple[int, str]:
+    if not vmUSBPort and not vmUSBDevice:
+        return 1, "ERROR: You must provide --usbport and/or --usbdevice"
+
+    newMappings, errors = normalizeMappings([
+        {
+            "vmId": vmId,
+            "usbPortId": vmUSBPort,
+            "usbDeviceId": vmUSBDevice,
+            "priority": priority,
+            "optimisticStart": optimisticStart,
+        },
+    ])
+    if errors:
+        return 1, f"ERROR: {errors[0].split(': ', 1)[-1]}"
+    newMapping = newMappings[0]
 
     try:
-        saveConfig(config)
+        with lockConfig():
+            config = loadConfig(allow_missing = True)
+            mappings = loadMappings(config)
+            if any(mapping.vmId == vmId for mapping in mappings):
+                return 1, f"ERROR: VM ID {vmId} is already configured. Use --delete {vmId} first"
+
+            mappings.append(newMapping)
+            saveConfig(setVmMappings(config, mappingsToConfig(mappings)))
     except ConfigError as error:
-        print(f"ERROR: Cannot save config: {error}")
-        return 1
+        return 1, f"ERROR: Cannot update config: {error}"
 
     vmUSBConfigJoin: List[str] = []
-    if vmUSBPort:
-        vmUSBConfigJoin.append(f"USB devpath {vmUSBPort}")
-    if vmUSBDevice:
-        vmUSBConfigJoin.append(f"USB device {vmUSBDevice}")
+    if newMapping.usbPortId is not None:
+        vmUSBConfigJoin.append(f"USB devpath {newMapping.usbPortId}")
+    if newMapping.usbDeviceId is not None:
+        vmUSBConfigJoin.append(f"USB device {newMapping.usbDeviceId}")
     vmUSBConfigJoin = " and ".join(vmUSBConfigJoin)
 
-    print(f"Added VM ID: {vmId} with {vmUSBConfigJoin}")
-    return 0
+    return 0, f"Added VM ID: {vmId} with {vmUSBConfigJoin}"
 
 
-def deleteVMPowerButton(vmId: int) -> int:
+def deleteMapping(vmIds: List[int]) -> Tuple[int, str]:
+    toDelete = set(vmIds)
     try:
-        config = loadConfig(allow_missing = True)
+        with lockConfig():
+            config = loadConfig(allow_missing = True)
+            # Raw entries on purpose: --delete must still be able to drop a broken mapping
+            mappings = getVmMappings(config)
+            newMappings = [m for m in mappings if helperSafeInt(m.get("vmId")) not in toDelete]
+            removedCounter = len(mappings) - len(newMappings)
+            foundIds = {helperSafeInt(m.get("vmId")) for m in mappings} & toDelete
+
+            if removedCounter == 0:
+                missingIds = helperJoinIds(toDelete)
+                return 0, f"No mapping found for VM ID: {missingIds}. Nothing to delete"
+
+            saveConfig(setVmMappings(config, newMappings))
     except ConfigError as error:
-        print(f"ERROR: Cannot load config: {error}")
-        return 1
+        return 1, f"ERROR: Cannot update config: {error}"
 
-    mappings = getVmMappings(config)
-    newMappings = [m for m in mappings if helperSafeInt(m.get("vmId")) != vmId]
-    removedCounter = len(mappings) - len(newMappings)
+    message = f"Removed {removedCounter} mapping(s) for VM ID: {helperJoinIds(foundIds)}"
+    missingIds = toDelete - foundIds
+    if missingIds:
+        message += f"\nNo mapping found for VM ID: {helperJoinIds(missingIds)}"
+    return 0, message
 
-    if removedCounter == 0:
-        print(f"No mapping found for VM ID: {vmId}. Nothing to delete")
-        return 0
 
-    config = setVmMappings(config, newMappings)
+def importMappings(path: str, replace: bool = False) -> Tuple[int, str]:
+    try:
+        entries = helperReadMappingsFile(path)
+    except (OSError, ValueError) as error:
+        return 1, f"ERROR: Cannot read {path}: {error}"
+
+    newMappings, errors = normalizeMappings(entries)
+    if errors:
+        problems = "\n".join(f"  {e}" for e in errors)
+        return 1, f"ERROR: Nothing imported, fix these first:\n{problems}"
+    if not newMappings:
+        return 0, f"No mappings found in {path}. Nothing to import"
+
     try:
-        saveConfig(config)
+        with lockConfig():
+            config = loadConfig(allow_missing = True)
+            if replace:
+                mappings = newMappings
+            else:
+                existing = loadMappings(config)
+                existingIds = {mapping.vmId for mapping in existing}
+                conflicts = [mapping.vmId for mapping in newMappings if mapping.vmId in existingIds]
+                if conflicts:
+                    return 1, (
+                        "ERROR: Nothing imported, VM ID already configured: "
+                        f"{helperJoinIds(conflicts)}. "
+                        "Delete them first or use --replace"
+                    )
+                mappings = existing + newMappings
+
+            # One rewrite, one reload in the daemon, however many mappings
+            saveConfig(setVmMappings(config, mappingsToConfig(mappings)))
     except ConfigError as error:
-        print(f"ERROR: Cannot save config: {error}")
-        return 1
+        return 1, f"ERROR: Cannot update config: {error}"
+
+    action = "Replaced all mappings with" if replace else "Imported"
+    return 0, f"{action} {len(newMappings)} mapping(s) from {path}"
 
-    print(f"Removed {removedCounter} mapping(s) for VM ID: {vmId}")
-    return 0
+
+def exportMappings(path: str) -> Tuple[int, str]:
+    try:
+        mappings = mappingsToConfig(loadMappings(loadConfig(allow_missing = True)))
+    except ConfigError as error:
+        return 1, f"ERROR: Cannot load config: {error}"
+
+    try:
+        if path == "-":
+            helperWriteMappings(sys.stdout, mappings, csvFormat = False)
+            return 0, ""
+        with open(path, "w", encoding = "utf-8", newline = "") as file:
+            helperWriteMappings(file, mappings, csvFormat = path.lower().endswith(".csv"))
+    except OSError as error:
+        return 1, f"ERROR: Cannot write {path}: {error}"
+
+    return 0, f"Exported {len(mappings)} mapping(s) to {path}"
 
 
 # Helpers
+def helperJoinIds(vmIds) -> str:
+    return ", ".join(str(vmId) for vmId in sorted(vmIds))
+
+
+def helperReadMappingsFile(path: str) -> Any:
+    if path == "-":
+        data = sys.stdin.read()
+    else:
+        with open(path, "r", encoding = "utf-8", newline = "") as file:
+            data = file.read()
+
+    if path.lower().endswith(".csv") or not data.lstrip().startswith(("[", "{")):
+        import csv
+        return [dict(row) for row in csv.DictReader(data.splitlines())]
+
+    entries = json.loads(data)
+    # Accept a whole config file as well as a bare list
+    if isinstance(entries, dict):
+        entries = entries.get("VMS", [])
+    return entries
+
+
+def helperWriteMappings(file, mappings: List[Dict[str, Any]], csvFormat: bool) -> None:
+    if not csvFormat:
+        json.dump(mappings, file, indent = 4)
+        file.write("\n")
+        return
+
+    import csv
+    writer = csv.DictWriter(
+        file,
+        fieldnames = ["vmId", "usbPortId", "usbDeviceId", "priority", "optimisticStart"],
+        extrasaction = "ignore",
+    )
+    writer.writeheader()
+    for mapping in mappings:
+        writer.writerow(mapping)
+
+
+def helperRunQm(args: List[str]) -> subprocess.CompletedProcess | None:
+    return helperRunCommand([QM_COMMAND, *args], args[0])
+
+
+def helperRunCommand(argv: List[str], metricCommand: str) -> subprocess.CompletedProcess | None:
+    try:
+        result = subprocess.run(
+            argv,
+            text = True,
+            capture_output = True,
+            check = False,
+        )
+    except OSError:
+        METRICS.inc("vusbpb_qm_exit_total", {"command": metricCommand, "code": "exec_error"})
+        return None
+
+    METRICS.inc("vusbpb_qm_exit_total", {"command": metricCommand, "code": str(result.returncode)})
+    return result
+
+
+def helperVMRecord(vm: VmInfo, mapping: VmMapping | None) -> Dict[str, Any]:
+    return {
+        "vmId": vm.vmId,
+        "name": vm.name,
+        "status": helperStatusText(vm.status),
+        "node": vm.node or None,
+        "usbPortId": mapping.usbPortId if mapping is not None else None,
+        "usbDeviceId": mapping.usbDeviceId if mapping is not None else None,
+    }
+
+
+def helperVMNode(vm: VmInfo, mapping: VmMapping | None) -> TreeNode:
+    if mapping is None:
+        usbInfo = "<none>"
+    else:
+        portDisplay = mapping.usbPortId or "<any port>"
+        devDisplay  = mapping.usbDeviceId or "<any device>"
+        usbInfo = f"{portDisplay} (device {devDisplay})"
+
+    return TreeNode(
+        label = fieldLabel("VM ID", vm.vmId),
+        children = [
+            TreeNode(label = fieldLabel("Name", vm.name)),
+            TreeNode(label = fieldLabel("Status", helperStatusText(vm.status))),
+            *helperNodeLabel(vm.node, LIGHT_GREEN),
+            TreeNode(label = fieldLabel("USB trigger", usbInfo)),
+        ],
+    )
+
+
+def helperPowerButtonNode(row: Dict[str, Any]) -> TreeNode:
+    vmUSBPort = row.get("usbPortId")
+    vmUSBDevice = row.get("usbDeviceId")
+
+    if not (vmUSBPort or vmUSBDevice):
+        portDisplay = "<none>"
+        devDisplay = "<none>"
+    else:
+        portDisplay = vmUSBPort or "<any>"
+        devDisplay = vmUSBDevice or "<any>"
+
+    return TreeNode(
+        label = fieldLabel("VM ID", row["vmId"], GREEN),
+        children = [
+            TreeNode(label = fieldLabel("Status", row.get("status") or "unknown", GREEN)),
+            *helperNodeLabel(row.get("node"), GREEN),
+            TreeNode(label = fieldLabel("USB port", portDisplay, GREEN)),
+            TreeNode(label = fieldLabel("USB device", devDisplay, GREEN)),
+        ],
+    )
+
+
+async def helperRunCommandAsync(
+    argv: List[str],
+    metricCommand: str,
+) -> subprocess.CompletedProcess | None:
+    # Same result as helperRunCommand without blocking the loop; only the daemon pays for asyncio
+    import asyncio
+
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *argv,
+            stdin = asyncio.subprocess.DEVNULL,
+            stdout = asyncio.subprocess.PIPE,
+            stderr = asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await process.communicate()
+    except OSError:
+        METRICS.inc("vusbpb_qm_exit_total", {"command": metricCommand, "code": "exec_error"})
+        return None
+
+    METRICS.inc("vusbpb_qm_exit_total", {"command": metricCommand, "code": str(process.returncode)})
+    return subprocess.CompletedProcess(
+        argv,
+        process.returncode,
+        stdout.decode(errors = "replace"),
+        stderr.decode(errors = "replace"),
+    )
+
+
+def helperParseQmStatus(result: subprocess.CompletedProcess | None) -> VmStatus:
+    if result is None or result.returncode != 0:
+        return VmStatus.UNKNOWN
+
+    for line in result.stdout.splitlines():
+        line = line.strip().lower()
+        if line.startswith("status:"):
+            mvStatus = line.split(":", 1)[1].strip()
+            if mvStatus == "running":
+                return VmStatus.RUNNING
+            if mvStatus == "stopped":
+                return VmStatus.STOPPED
+            return VmStatus.UNKNOWN
+
+    return VmStatus.UNKNOWN
+
+
+def helperNodeLabel(node: str | None, color: str) -> List[TreeNode]:
+    # Standalone hosts have no node to show
+    if not node:
+        return []
+    return [TreeNode(label = fieldLabel("Node", node, color))]
+
+
 def helperSafeInt(value) -> int | None:
     try:
         return int(value)
     except (TypeError, ValueError):
-        return None
\ No newline at end of file
+        return None
+
+
+def helperReadQemuPid(vmId: int, runDir: str | None = None) -> int | None:
+    # Returns the qemu pid, 0 when the VM is definitely not running, None when unsure
+    runDir = runDir or QEMU_RUN_DIR
+    try:
+        with open(os.path.join(runDir, f"{vmId}.pid"), "r", encoding = "ascii") as file:
+            pidText = file.read().strip()
+    except FileNotFoundError:
+        return 0 if os.path.isdir(runDir) else None
+    except OSError:
+        return None
+
+    pid = helperSafeInt(pidText)
+    if pid is None or pid <= 0:
+        return None
+
+    # A stale pid file may point to a recycled pid, make sure it is this VM's qemu
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as file:
+            cmdline = file.read().split(b"\0")
+    except FileNotFoundError:
+        return 0
+    except OSError as error:
+        return 0 if error.errno == errno.ESRCH else None
+
+    vmIdArg = str(vmId).encode()
+    for idx, arg in enumerate(cmdline[:-1]):
+        if arg == b"-id" and cmdline[idx + 1] == vmIdArg:
+            return pid
+    return 0
+
+
+def helperIsPidAlive(pid: int) -> bool:
+    return os.path.exists(f"/proc/{pid}")
+
+
+def helperReadPidStartTime(pid: int) -> int | None:
+    # Field 22 of /proc/<pid>/stat, in clock ticks since boot; None once the process is gone
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as file:
+            stat = file.read()
+    except OSError:
+        return None
+    # The command name in field 2 may hold spaces and parentheses, the fields after it can't
+    fields = stat[stat.rfind(b")") + 2:].split()
+    try:
+        return int(fields[19])
+    except (IndexError, ValueError):
+        return None
+
+
+def helperParseStatus(value: str | None) -> VmStatus:
+    if value == "running":
+        return VmStatus.RUNNING
+    if value == "stopped":
+        return VmStatus.STOPPED
+    return VmStatus.UNKNOWN
+
+
+def helperStatusText(status: VmStatus) -> str:
+    return status.name.lower()
+
+
+def helperReadVMName(vmId: int) -> str:
+    return helperReadVMConfigValue(vmId, "name") or ""
+
+
+def helperReadVMConfigValue(vmId: int, key: str, confDir: str | None = None) -> str | None:
+    prefix = f"{key}:"
+    try:
+        confPath = os.path.join(confDir or PVE_QEMU_CONF_DIR, f"{vmId}.conf")
+        with open(confPath, "r", encoding = "utf-8") as file:
+            for line in file:
+                # Snapshot sections follow the current config, stop before them
+                if line.startswith("["):
+                    break
+                if line.startswith(prefix):
+                    return line[len(prefix):].strip()
+    except OSError:
+        pass
+    return None
+
+
+def helperInventoryFromPveConfigs() -> Dict[int, VmInfo] | None:
+    try:
+        entries = list(os.scandir(PVE_QEMU_CONF_DIR))
+    except OSError:
+        return None
+
+    localNode = VM_LOCATIONS.clusterNode() or ""
+    inventory: Dict[int, VmInfo] = {}
+    for entry in entries:
+        vmIdText, _, suffix = entry.name.partition(".")
+        if suffix != "conf" or not vmIdText.isdigit():
+            continue
+        vmId = int(vmIdText)
+        vmStatus = getVMStatusFromPidFile(vmId)
+        inventory[vmId] = VmInfo(vmId, helperReadVMName(vmId), vmStatus, localNode)
+
+    unsure = [vmId for vmId, vm in inventory.items() if vm.status == VmStatus.UNKNOWN]
+    if unsure:
+        # Pulls in logging, only worth it when some pid file was inconclusive
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers = min(INVENTORY_QM_WORKERS, len(unsure))) as executor:
+            for vmId, vmStatus in zip(unsure, executor.map(getVMStatus, unsure)):
+                inventory[vmId].status = vmStatus
+
+    # Guests of other cluster nodes: pmxcfs has their configs, their state is the owner's business
+    for vmId, node in VM_LOCATIONS.remoteVMs().items():
+        if vmId not in inventory:
+            remoteConfDir = os.path.join(PVE_NODES_DIR, node, "qemu-server")
+            name = helperReadVMConfigValue(vmId, "name", remoteConfDir) or ""
+            inventory[vmId] = VmInfo(vmId, name, VmStatus.UNKNOWN, node)
+
+    return inventory
+
+
+def helperReadInventoryCache() -> Dict[int, VmInfo] | None:
+    try:
+        if time.time() - os.stat(INVENTORY_CACHE_PATH).st_mtime > INVENTORY_CACHE_TTL:
+            return None
+        with open(INVENTORY_CACHE_PATH, "r", encoding = "utf-8") as file:
+            data = json.load(file)
+        return {
+            int(vm["vmId"]): VmInfo(
+                int(vm["vmId"]),
+                vm["name"],
+                helperParseStatus(vm["status"]),
+                vm.get("node", ""),
+            )
+            for vm in data
+        }
+    except (OSError, ValueError, TypeError, KeyError):
+        return None
+
+
+def helperWriteInventoryCache(inventory: Dict[int, VmInfo]) -> None:
+    data = [
+        {"vmId": vm.vmId, "name": vm.name, "status": helperStatusText(vm.status), "node": vm.node}
+        for vm in inventory.values()
+    ]
+    try:
+        dirName = os.path.dirname(INVENTORY_CACHE_PATH)
+        os.makedirs(dirName, exist_ok = True)
+        fd, tmpPath = tempfile.mkstemp(prefix = ".inventory_", dir = dirName)
+        with os.fdopen(fd, "w", encoding = "utf-8") as tmpFile:
+            json.dump(data, tmpFile)
+        os.replace(tmpPath, INVENTORY_CACHE_PATH)
+    except OSError:
+        # The cache is an optimisation only, e.g. non-root users can't write to /run
+        pass
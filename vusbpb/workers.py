@@ -0,0 +1,67 @@
+import asyncio
+from enum import Enum, auto
+from typing import Awaitable, Callable, List, Set, Tuple
+
+from .logging_util import logError
+
+
+class SubmitResult(Enum):
+    QUEUED = auto()
+    IN_FLIGHT = auto()
+    QUEUE_FULL = auto()
+
+
+class VmActionPool:
+    # Runs on the daemon's event loop: 'workers' bounds how many VM actions (and qm calls) overlap
+    def __init__(
+        self,
+        action: Callable[[int, float], Awaitable[None]],
+        workers: int,
+        queueSize: int,
+    ) -> None:
+        self.action = action
+        # (vmId, time the triggering event was received)
+        self.queue: "asyncio.Queue[Tuple[int, float] | None]" = asyncio.Queue(
+            maxsize = max(1, queueSize),
+        )
+        self.inFlight: Set[int] = set()
+
+        loop = asyncio.get_running_loop()
+        self.tasks: List[asyncio.Task] = [
+            loop.create_task(self.helperWorker(), name = f"vusbpb-vm-{idx}")
+            for idx in range(max(1, workers))
+        ]
+
+    def submit(self, vmId: int, receivedAt: float) -> SubmitResult:
+        if vmId in self.inFlight:
+            return SubmitResult.IN_FLIGHT
+        try:
+            self.queue.put_nowait((vmId, receivedAt))
+        except asyncio.QueueFull:
+            return SubmitResult.QUEUE_FULL
+        self.inFlight.add(vmId)
+        return SubmitResult.QUEUED
+
+    async def stop(self, timeout: float = 1.0) -> None:
+        for _ in self.tasks:
+            try:
+                self.queue.put_nowait(None)
+            except asyncio.QueueFull:
+                break
+        # Whatever has not finished by then (a slow qm call, a full queue) is cancelled
+        await asyncio.wait(self.tasks, timeout = timeout)
+        for task in self.tasks:
+            task.cancel()
+
+    async def helperWorker(self) -> None:
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            vmId, receivedAt = item
+            try:
+                await self.action(vmId, receivedAt)
+            except Exception as error:
+                logError(f"Unexpected error while handling VM {vmId}: {error}")
+            finally:
+                self.inFlight.discard(vmId)